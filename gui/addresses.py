@@ -0,0 +1,50 @@
+"""
+IPv4 addresses stored as integers (SubdomainIP.address).
+"""
+import ipaddress
+
+from .models import SubdomainIP
+
+
+def to_int(ip):
+    """
+    Integer of an IPv4 address, or None when it is not one.
+    """
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except (ipaddress.AddressValueError, ValueError):
+        return None
+
+
+def to_ip(address):
+    return str(ipaddress.IPv4Address(address))
+
+
+def address_range(value):
+    """
+    (first, last) integers of an IPv4 address or CIDR network, or None.
+    """
+    try:
+        network = ipaddress.IPv4Network(value.strip(), strict=False)
+    except (ipaddress.AddressValueError, ipaddress.NetmaskValueError, ValueError):
+        return None
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def filter_by_address(queryset, value):
+    """
+    Subdomains of the queryset with an address in `value` (IP or CIDR).
+
+    Returns None when `value` is neither. The lookup is a range scan on the
+    address index, done in a subquery so that a subdomain with several
+    matching addresses is listed once.
+    """
+    bounds = address_range(value)
+    if bounds is None:
+        return None
+    first, last = bounds
+    if first == last:
+        addresses = SubdomainIP.objects.filter(address=first)
+    else:
+        addresses = SubdomainIP.objects.filter(address__range=bounds)
+    return queryset.filter(id__in=addresses.values('subdomain_id'))
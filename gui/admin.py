@@ -1,14 +1,28 @@
+from django import forms
 from django.contrib import admin
-from .models import Domain, Subdomain, Tag, Apikey
+from django.db.models import Count, Prefetch, Q
+from .pipeline import slowest_stage
+from .models import AgentToken, Domain, Subdomain, Tag, Apikey, ScanJob, ScanRun, ScanChange, Wordlist
+from .jobs import enqueue_scan
+from .schedule import schedule_domains, schedule_tag
+from .imports import import_domains
+from .wordlists import compile_wordlist, WordlistError
+from .facets import facet_choices
+from .addresses import filter_by_address
+from .graph import cached_graph
+from .export import export, ExportError, FORMATS, CONTENT_TYPES
+from . import metrics, risk
+from django.utils.timezone import localtime
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.contrib import messages
 from django.urls import reverse
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.conf import settings
 from django.urls import path
 from django.shortcuts import render
-from django.core.management import call_command
-import threading
+import time
 
 class ApikeyAdmin(admin.ModelAdmin):
     list_display = ('virustotal', 'shodan')
@@ -32,17 +46,27 @@ class ApikeyAdmin(admin.ModelAdmin):
         return super().render_change_form(request, context, add, change, form_url, obj)
 
 class TagAdmin(admin.ModelAdmin):
-    list_display = ('name', 'assigned_domain')
+    list_display = ('name', 'scan_interval', 'assigned_domain')
     search_fields = ('name',)
     ordering = ('name',)
     actions = None
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'scan_interval' in form.changed_data:
+            schedule_tag(obj)
+
+    def get_queryset(self, request):
+        # The domains of every tag on the page are loaded with one query
+        queryset = super().get_queryset(request)
+        return queryset.prefetch_related(
+            Prefetch('domains', queryset=Domain.objects.only('id', 'name', 'tag_id'))
+        )
+
     def assigned_domain(self, obj):
         results = ""
-        domains = Domain.objects.filter(tag=obj.id)
-        if domains:
-            for domain in domains:
-                results += f"<a href='/admin/gui/subdomain/?domain={domain.id}'>{domain.name}</a><br>"
+        for domain in obj.domains.all():
+            results += f"<a href='/admin/gui/subdomain/?domain={domain.id}'>{domain.name}</a><br>"
 
         return format_html(results)
 
@@ -60,6 +84,14 @@ class TagAdmin(admin.ModelAdmin):
         })
         return super().render_change_form(request, context, add, change, form_url, obj)
 
+class DomainImportForm(forms.Form):
+    file = forms.FileField(help_text="Text file with one domain per line.")
+    tag = forms.CharField(required=False, help_text="Tag of every imported domain, empty for one tag per domain.")
+    recon = forms.BooleanField(required=False, initial=True)
+    bruteforce = forms.BooleanField(required=False)
+    wildcard = forms.BooleanField(required=False, initial=True)
+    scan = forms.BooleanField(required=False, initial=True, help_text="Queue a scan for each new domain.")
+
 class DomainAdmin(admin.ModelAdmin):
     def add_view(self, request, form_url='', extra_context=None):
         messages.info(request, "Remember, clicking Save will initiate the scan.")
@@ -70,6 +102,7 @@ class DomainAdmin(admin.ModelAdmin):
         return super().change_view(request, object_id, form_url, extra_context)
 
     list_display = ('name', 'recon', 'bruteforce', 'wildcard', 'configuration', 'status', 'result', 'tag_name', 'created_at')
+    list_select_related = ('tag',)
     search_fields = ('name',)
     ordering = ('created_at',)
 
@@ -86,7 +119,7 @@ class DomainAdmin(admin.ModelAdmin):
         advanced_fieldset = (
             'Advanced',
             {
-                'fields': ('wordlist', 'useragent', 'dns', 'timeout', 'threads'),
+                'fields': ('wordlist', 'wordlist_file', 'useragent', 'dns', 'timeout', 'threads', 'engine', 'concurrency', 'incremental', 'scan_interval'),
                 'classes': ('collapse',),
             },
         )
@@ -94,9 +127,11 @@ class DomainAdmin(admin.ModelAdmin):
         return list(fieldsets) + [advanced_fieldset]
 
     def tag_name(self, obj):
+        if not obj.tag_id:
+            return '-'
         return format_html(
             f"""
-                <a href='/admin/gui/domain/?tag__id__exact={obj.tag.id}'>{obj.tag}</a>
+                <a href='/admin/gui/domain/?tag__id__exact={obj.tag_id}'>{obj.tag}</a>
             """
         )
 
@@ -108,7 +143,10 @@ class DomainAdmin(admin.ModelAdmin):
 
         dns = format_status(obj.dns)
         useragent = format_status(obj.useragent)
-        wordlist = format_status(obj.wordlist) if obj.bruteforce else ''
+        wordlist = format_status(obj.wordlist or obj.wordlist_file_id) if obj.bruteforce else ''
+        engine = f"{obj.engine} ({obj.concurrency})" if obj.engine == 'asyncio' else obj.engine
+        every = obj.scan_interval or (obj.tag.scan_interval if obj.tag_id else None)
+        schedule = f"{every}h, next {localtime(obj.next_scan_at):%Y-%m-%d %H:%M}" if every and obj.next_scan_at else None
 
         config = format_html(f"""
             <b>dns</b>: {dns}<br>
@@ -116,6 +154,8 @@ class DomainAdmin(admin.ModelAdmin):
             {f'<b>wordlist</b>: {wordlist}<br>' if obj.bruteforce else ''}
             <b>timeout</b>: {obj.timeout}<br>
             <b>threads</b>: {obj.threads}<br>
+            <b>engine</b>: {engine}<br>
+            {f'<b>every</b>: {schedule}<br>' if schedule else ''}
         """)
 
         return config
@@ -124,19 +164,37 @@ class DomainAdmin(admin.ModelAdmin):
         if not obj.messages:
             return format_html(
                 f'''
-                    <span style="color: orangered; font-style: italic; font-size: 18px">0</span>
+                    <div data-scan-result="{obj.id}"><span style="color: orangered; font-style: italic; font-size: 18px">0</span></div>
                 ''')
         return format_html(
             f'''
-                <a href="/admin/gui/subdomain/?domain={obj.id}" style="color: blue; font-style: bold; font-size: 18px">{obj.messages["count"]}</a>
+                <div data-scan-result="{obj.id}"><a href="/admin/gui/subdomain/?domain={obj.id}" style="color: blue; font-style: bold; font-size: 18px">{obj.messages["count"]}</a></div>
             ''')
 
 
     def status(self, obj):
+        # Updated in place by js/scan_events.js as the scan events come in
         if not obj.messages:
             msg = 'The scan is currently in progress.'
             return format_html(
-                f'''<span style="color: orangered; font-style: italic;">{msg}</span>'''
+                f'''<div data-scan-status="{obj.id}"><span style="color: orangered; font-style: italic;">{msg}</span></div>'''
+            )
+
+        if not obj.completed:
+            msg = 'The scan is currently in progress.'
+            return format_html(f"""
+                <div data-scan-status="{obj.id}">
+                <span style="color: orangered; font-style: italic;">{msg}</span><br>
+                <b>found</b>: {obj.messages.get('count', 0)}<br>
+                <b>rate</b>: {obj.messages.get('rate', 0)} /s<br>
+                <b>time</b>: {obj.messages.get('time', 0)} s<br>
+                </div>
+            """)
+
+        if obj.messages.get('error'):
+            return format_html(
+                '<div data-scan-status="{}"><span style="color: red; font-style: italic;">The scan failed.</span><br>{}</div>',
+                obj.id, obj.messages['error'],
             )
 
         def format_status(value, is_wildcard=False):
@@ -161,28 +219,100 @@ class DomainAdmin(admin.ModelAdmin):
             'completed': format_status(messages['completed'])
         }
 
+        # Changes against the previous run
+        changes = ''
+        if 'run' in obj.messages:
+            changes = f"""
+                <b>changes</b>: <a href='/admin/gui/scanrun/?domain__id__exact={obj.id}'>
+                +{obj.messages['added']} -{obj.messages['removed']} ~{obj.messages['changed']}</a><br>
+            """
+
+        # Remote agent that ran the scan
+        agent = f"<b>agent</b>: {obj.messages['agent']}<br>" if obj.messages.get('agent') else ''
+
+        # Answers of the DNS cache
+        dns = ''
+        if 'dns' in obj.messages:
+            dns = f"<b>dns cache</b>: {obj.messages['dns']['hits']} hits / {obj.messages['dns']['misses']} misses<br>"
+
+        # Recon sources answered from the cache, asked, or skipped
+        recon = ''
+        if 'recon' in obj.messages:
+            stats = obj.messages['recon']
+            skipped = stats.get('failed', 0) + stats.get('limited', 0)
+            recon = f"<b>recon</b>: {stats.get('cached', 0)} cached / {stats.get('fetched', 0)} fetched{f' / {skipped} skipped' if skipped else ''}<br>"
+
+        # Stage that took the longest in the last run
+        slowest = ''
+        if obj.messages.get('slowest'):
+            slowest = f"<b>slowest stage</b>: <a href='/admin/gui/scanrun/{obj.messages['run']}/change/'>{obj.messages['slowest'][0]}</a> ({obj.messages['slowest'][1]} s)<br>"
+
         status = format_html(f"""
-            <b>wildcard</b>: {formatted_messages['wildcard']}<br>
+            <div data-scan-status="{obj.id}">
+            <b>wildcard</b>: {formatted_messages['wildcard']}{f" ({obj.messages['filtered']} filtered)" if obj.messages.get('filtered') else ''}<br>
             <b>finished</b>: {formatted_messages['finished']}<br>
             <b>completed</b>: {formatted_messages['completed']}<br>
             <b>time</b>: {messages['time']} s<br>
+            {agent}
+            {slowest}
+            {dns}
+            {recon}
+            {changes}
+            </div>
         """)
 
         return status
 
     def changelist_view(self, request, extra_context=None):
+        start = time.perf_counter()
         extra_context = extra_context or {}
         extra_context['title'] = "Home"
-        return super().changelist_view(request, extra_context=extra_context)
+        return metrics.timed_view('domain_changelist', super().changelist_view(request, extra_context=extra_context), start)
+
+    def get_urls(self):
+        urls = [
+            path('import/', self.admin_site.admin_view(self.import_view), name='gui_domain_import'),
+        ]
+        return urls + super().get_urls()
+
+    def import_view(self, request):
+        """
+        Upload a list of domains, created in bulk with their scans queued.
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        form = DomainImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            data = form.cleaned_data
+            try:
+                result = import_domains(
+                    data['file'], tag=data['tag'] or None, scan=data['scan'],
+                    recon=data['recon'], bruteforce=data['bruteforce'], wildcard=data['wildcard'],
+                )
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                messages.success(request, f"Import: {result}")
+                if result.invalid:
+                    messages.warning(request, f"Invalid names: {', '.join(result.invalid[:20])}{' ...' if len(result.invalid) > 20 else ''}")
+                return HttpResponseRedirect(reverse('admin:gui_domain_changelist'))
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Import domains',
+            'opts': self.model._meta,
+            'form': form,
+        }
+        return render(request, 'admin/gui/domain/import.html', context)
 
     def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)        
+        super().save_model(request, obj, form, change)
 
-        def run_scan_command():
-            call_command('scan', obj.id)
-
-        # Execute the function in a separate thread
-        threading.Thread(target=run_scan_command).start()
+        # The scan is run by a worker (python manage.py worker)
+        enqueue_scan(obj)
+        # and again every scan_interval hours (python manage.py scheduler)
+        schedule_domains(Domain.objects.filter(id=obj.id))
 
         return HttpResponseRedirect(reverse('admin:gui_domain_changelist'))
 
@@ -195,17 +325,23 @@ class DomainAdmin(admin.ModelAdmin):
         })
         return super().render_change_form(request, context, add, change, form_url, obj)
 
-from django.db.models import Q
 def filter_queryset(queryset, request, model):
     """
     Filters the queryset dynamically based on the parameters found in the request GET parameters.
     Handles `__exact`, `__isnull`, and other valid lookups dynamically.
     """
+    return filter_params(queryset, request.GET, model)
+
+def filter_params(queryset, params, model):
+    """
+    Same as filter_queryset, with the parameters as a mapping
+    (used by the export command).
+    """
     # Get all valid fields from the model
     valid_fields = {field.name for field in model._meta.get_fields()}
 
-    # Iterate over the parameters of the GET request
-    for param, value in request.GET.items():
+    # Iterate over the parameters
+    for param, value in params.items():
         if not value:  # Skip parameters without value
             continue
 
@@ -229,25 +365,73 @@ def filter_queryset(queryset, request, model):
                 queryset = queryset.filter(**{param: value})
 
             if param == 'q':
-                queryset = queryset.filter(Q(name__icontains=value) | Q(ip__icontains=value))
+                # IP addresses and CIDR networks use the address index
+                by_address = filter_by_address(queryset, value)
+                queryset = by_address if by_address is not None else queryset.filter(name__icontains=value)
         except (ValueError, TypeError):
             # Ignore invalid filters or errors
             continue
 
     return queryset
 
-import json
+class FacetFilter(admin.SimpleListFilter):
+    """
+    Filter on a Subdomain field with the choices and counts of the facet
+    table, scoped to the domain being shown.
+    """
+    field = None
+
+    def lookups(self, request, model_admin):
+        domain_id = request.GET.get('domain')
+        return [(value, f"{value} ({count})") for value, count in facet_choices(self.field, domain_id)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+class RiskFilter(admin.SimpleListFilter):
+    """
+    Subdomains with at least a risk score; the choices are the scores the
+    RISK_WEIGHTS allow, no query.
+    """
+    title = 'risk'
+    parameter_name = 'risk_score__gte'
+
+    def lookups(self, request, model_admin):
+        return [(str(value), f"{value} or more") for value in risk.scores()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(risk_score__gte=self.value())
+        return queryset
+
+def facet_filter(field):
+    # Same parameter as the default field filter, so links keep working
+    return type(f"{field}_filter", (FacetFilter,), {
+        'field': field,
+        'title': field.replace('_', ' '),
+        'parameter_name': f"{field}__exact",
+    })
+
 from django.template.loader import render_to_string
 class SubdomainAdmin(admin.ModelAdmin):
-    list_display = ('domain_name', 'domain', 'ip_address', 'http', 'https', 'certificate', 'created_at')
-    search_fields = ('name', 'domain__name', 'ip')
+    list_display = ('domain_name', 'domain', 'ip_address', 'http', 'https', 'certificate', 'risk_score', 'created_at')
+    # certificate() reads obj.certificate on every row
+    list_select_related = ('domain', 'certificate')
+    search_fields = ('name', 'domain__name')
     
     
     list_filter = (
+        RiskFilter, 'http_only', 'cert_expired', 'cert_mismatch',
         'cert_status',
-        'http_status', 'https_status',
-        'http_server', 'https_server'
+        facet_filter('http_status'), facet_filter('https_status'),
+        facet_filter('http_server'), facet_filter('https_server')
     )
+    # Filter choices come from the facet table, no COUNT per choice
+    # and no COUNT over the whole table
+    show_facets = admin.ShowFacets.NEVER
+    show_full_result_count = False
     
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
@@ -259,51 +443,103 @@ class SubdomainAdmin(admin.ModelAdmin):
 
         return queryset
 
+    def get_search_results(self, request, queryset, search_term):
+        # An IP address or a CIDR network lists the subdomains using it
+        by_address = filter_by_address(queryset, search_term) if search_term else None
+        if by_address is not None:
+            return by_address, False
+        return super().get_search_results(request, queryset, search_term)
+
     actions = None
 
     def has_add_permission(self, request):
         return False
 
     def changelist_view(self, request, extra_context=None):
+        start = time.perf_counter()
         title = "Subdomains"
+        extra_context = extra_context or {}
+        extra_context['export_links'] = self.export_links(request)
         if not 'domain' in request.GET:
-            extra_context = extra_context or {}
             extra_context['title'] = title
-            return super().changelist_view(request, extra_context=extra_context)
+            return metrics.timed_view('subdomain_changelist', super().changelist_view(request, extra_context=extra_context), start)
 
         domain_id = request.GET.get('domain')
         domain = Domain.objects.filter(id=domain_id).first()
         title = domain.name
 
-        queryset = self.get_queryset(request)
-        queryset = filter_queryset(queryset, request, Subdomain)
-
-        # Prepare data for templates
-        domain_ip_data = queryset.values_list('name', 'ip')
-        domain_ip_data = [(name, ip['ip']) for name, ip in domain_ip_data]
-
-        nodes = []
-        links = []
-
-        for domain, ips in domain_ip_data:
-            nodes.append({"id": domain, "group": 1})
-            for ip in ips:
-                nodes.append({"id": ip, "group": 2})
-                links.append({"source": domain, "target": ip})
-
-        # Remove duplicates in nodes
-        unique_nodes = {node["id"]: node for node in nodes}.values()
-        nodes = list(unique_nodes)
-        
+        # The graph is loaded by the page from graph_view
+        params = request.GET.copy()
         graph_html = render_to_string('admin/domain_ip_graph.html', {
-            'nodes': json.dumps(nodes),
-            'links': json.dumps(links),
+            'graph_url': f"{reverse('admin:gui_subdomain_graph')}?{params.urlencode()}",
+            'max_nodes': settings.GRAPH_MAX_NODES,
         })
 
-        extra_context = extra_context or {}
         extra_context['title'] = title
         extra_context['graph_html'] = mark_safe(graph_html)
-        return super().changelist_view(request, extra_context=extra_context)
+        return metrics.timed_view('subdomain_changelist', super().changelist_view(request, extra_context=extra_context), start)
+
+    def get_urls(self):
+        urls = [
+            path('graph/', self.admin_site.admin_view(self.graph_view), name='gui_subdomain_graph'),
+            path('export/', self.admin_site.admin_view(self.export_view), name='gui_subdomain_export'),
+        ]
+        return urls + super().get_urls()
+
+    def graph_view(self, request):
+        """
+        Graph of the domain as JSON, with the filters of the changelist.
+
+        collapse=1 merges the subdomains sharing the same addresses,
+        limit caps the number of nodes (GRAPH_MAX_NODES at most).
+        """
+        start = time.perf_counter()
+        domain = Domain.objects.filter(id=request.GET.get('domain')).first()
+        if not domain:
+            return JsonResponse({"error": "unknown domain"}, status=404)
+
+        try:
+            limit = min(int(request.GET.get('limit', settings.GRAPH_MAX_NODES)), settings.GRAPH_MAX_NODES)
+        except ValueError:
+            limit = settings.GRAPH_MAX_NODES
+        collapse = request.GET.get('collapse') in ('1', 'true', 'yes')
+
+        # Only the changelist filters select subdomains
+        filters = {k: v for k, v in request.GET.items() if k not in ('domain', 'collapse', 'limit', 'o', 'p')}
+        subdomains = None
+        if filters:
+            subdomains = filter_queryset(Subdomain.objects.filter(domain=domain), request, Subdomain)
+
+        graph = cached_graph(domain, dict(request.GET.items()), subdomains, collapse=collapse, limit=limit)
+        return metrics.timed_view('subdomain_graph', JsonResponse(graph), start)
+
+    def export_links(self, request):
+        # The export keeps the filters and the search of the changelist
+        params = request.GET.copy()
+        links = []
+        for fmt in FORMATS:
+            params['format'] = fmt
+            links.append((fmt.upper(), f"{reverse('admin:gui_subdomain_export')}?{params.urlencode()}"))
+        return links
+
+    def export_view(self, request):
+        """
+        Subdomains matching the changelist filters, streamed as
+        format=csv (default), jsonl or parquet.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        fmt = request.GET.get('format', 'csv')
+        queryset = filter_queryset(Subdomain.objects.all(), request, Subdomain)
+        try:
+            content = export(queryset, fmt)
+        except ExportError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = f'attachment; filename="subdomains.{fmt}"'
+        return response
 
     def domain_name(self, obj):
         return format_html(f"<a href='http://{obj.name}' target='_blank'>{obj.name}</a>")
@@ -321,7 +557,7 @@ class SubdomainAdmin(admin.ModelAdmin):
         # Default row style
         row_style = ""
 
-        if obj.http_status and not obj.https_status or obj.http_status == 200:
+        if obj.http_only:
             row_style = "background-color: yellow;"
             http_status = f'<span style="color: red;">{obj.http_status}</span>'
         
@@ -334,6 +570,7 @@ class SubdomainAdmin(admin.ModelAdmin):
             </div>
             """
         )
+    http.admin_order_field = 'http_only'
 
     def https(self, obj):
         https_status = getattr(obj, 'https_status', "") or ""
@@ -357,9 +594,8 @@ class SubdomainAdmin(admin.ModelAdmin):
         row_style = ""
 
         if obj.https_status:
-            # Check if cert_status or cert_expiration_date is invalid and set background color to yellow
-            if not obj.cert_status or obj.cert_expiration_date < obj.created_at or \
-               (obj.cert_common_name and obj.domain.name not in obj.cert_common_name):
+            # Invalid, expired or mismatched certificate: background color to yellow
+            if not obj.cert_status or obj.cert_expired or obj.cert_mismatch:
                 row_style = "background-color: yellow;"
 
             # Apply red color to cert_status if it is not set
@@ -372,14 +608,14 @@ class SubdomainAdmin(admin.ModelAdmin):
                 expiration_date_str = str(obj.cert_expiration_date).split()[0]
                 cert_expiration_date = (
                     f'<span style="color: red;">{expiration_date_str}</span>'
-                    if not obj.cert_status or obj.cert_expiration_date < obj.created_at
+                    if not obj.cert_status or obj.cert_expired
                     else expiration_date_str
                 )
 
             # Apply red color to cert_common_name if it does not contain the domain name
             cert_common_name = (
                 f'<span style="color: red;">{obj.cert_common_name}</span>'
-                if obj.cert_common_name and obj.domain.name not in obj.cert_common_name
+                if obj.cert_mismatch
                 else obj.cert_common_name
             )
 
@@ -395,8 +631,165 @@ class SubdomainAdmin(admin.ModelAdmin):
         )
 
 
+class WordlistAdmin(admin.ModelAdmin):
+    list_display = ('name', 'entries', 'short_checksum', 'compiled_at', 'source')
+    search_fields = ('name',)
+    readonly_fields = ('entries', 'checksum', 'path', 'compiled_at')
+    actions = None
+
+    @admin.display(description='checksum')
+    def short_checksum(self, obj):
+        return obj.checksum[:16]
+
+    def save_model(self, request, obj, form, change):
+        # Compiled again on every save, the scans use the new file
+        super().save_model(request, obj, form, change)
+        try:
+            compile_wordlist(obj)
+        except WordlistError as e:
+            messages.error(request, str(e))
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['title'] = "Wordlists"
+        return super().changelist_view(request, extra_context=extra_context)
+
+
+class ScanJobAdmin(admin.ModelAdmin):
+    list_display = ('domain', 'state', 'priority', 'attempts', 'agent', 'created_at', 'started_at', 'finished_at', 'error')
+    list_filter = ('state',)
+    list_select_related = ('domain', 'agent')
+    search_fields = ('domain__name',)
+    actions = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['title'] = "Jobs"
+        return super().changelist_view(request, extra_context=extra_context)
+
+
+class AgentTokenAdmin(admin.ModelAdmin):
+    """
+    Remote scan agents (python -m gui.agent); the token is shown once, when
+    the agent is added.
+    """
+    list_display = ('name', 'active', 'running', 'last_seen_at', 'created_at')
+    fields = ('name', 'active')
+    actions = None
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(running_jobs=Count('jobs', filter=Q(jobs__state=ScanJob.RUNNING)))
+
+    def running(self, obj):
+        return obj.running_jobs
+    running.admin_order_field = 'running_jobs'
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            token = obj.new_token()
+            messages.warning(request, format_html(
+                f"Token of the agent {obj.name}, copy it now, it is not shown again: <code>{token}</code><br>"
+                f"Run: <code>python -m gui.agent --server {request.scheme}://{request.get_host()} --token {token}</code>"
+            ))
+        super().save_model(request, obj, form, change)
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['title'] = "Agents"
+        return super().changelist_view(request, extra_context=extra_context)
+
+
+class ScanRunAdmin(admin.ModelAdmin):
+    list_display = ('domain', 'state', 'started_at', 'finished_at', 'count', 'diff_added', 'diff_removed', 'diff_changed', 'slowest')
+    list_filter = ('state',)
+    list_select_related = ('domain',)
+    search_fields = ('domain__name',)
+    exclude = ('stages',)
+    readonly_fields = ('stage_timings',)
+    actions = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def diff_link(self, obj, kind, count):
+        if not count:
+            return count
+        return format_html(f"<a href='/admin/gui/scanchange/?run__id__exact={obj.id}&kind__exact={kind}'>{count}</a>")
+
+    @admin.display(description='added', ordering='added')
+    def diff_added(self, obj):
+        return self.diff_link(obj, ScanChange.ADDED, obj.added)
+
+    @admin.display(description='removed', ordering='removed')
+    def diff_removed(self, obj):
+        return self.diff_link(obj, ScanChange.REMOVED, obj.removed)
+
+    @admin.display(description='changed', ordering='changed')
+    def diff_changed(self, obj):
+        return self.diff_link(obj, ScanChange.CHANGED, obj.changed)
+
+    @admin.display(description='slowest stage')
+    def slowest(self, obj):
+        slowest = slowest_stage(obj.stages or {})
+        if not slowest:
+            return '-'
+        return f"{slowest[0]} ({slowest[1]} s)"
+
+    @admin.display(description='stages')
+    def stage_timings(self, obj):
+        if not obj.stages:
+            return '-'
+        columns = ('workers', 'timeout', 'in', 'out', 'timeouts', 'p50', 'p90', 'p99', 'max', 'wall', 'blocked')
+        header = ''.join(f'<th>{column}</th>' for column in columns)
+        rows = ''
+        for name, stats in obj.stages.items():
+            cells = ''.join(f"<td>{'-' if stats.get(column) is None else stats[column]}</td>" for column in columns)
+            rows += f"<tr><td><b>{name}</b></td>{cells}</tr>"
+        return format_html(f"""
+            <table><tr><th>stage</th>{header}</tr>{rows}</table>
+            <small>latencies and times in seconds; blocked: time the workers spent waiting for the next stage (summed)</small>
+        """)
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['title'] = "Runs"
+        return super().changelist_view(request, extra_context=extra_context)
+
+class ScanChangeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'kind', 'run')
+    list_filter = ('kind',)
+    list_select_related = ('run__domain',)
+    search_fields = ('name',)
+    actions = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['title'] = "Changes"
+        return super().changelist_view(request, extra_context=extra_context)
+
+
 # Registered models
 admin.site.register(Domain, DomainAdmin)
 admin.site.register(Subdomain, SubdomainAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Apikey, ApikeyAdmin)
+admin.site.register(Wordlist, WordlistAdmin)
+admin.site.register(ScanJob, ScanJobAdmin)
+admin.site.register(AgentToken, AgentTokenAdmin)
+admin.site.register(ScanRun, ScanRunAdmin)
+admin.site.register(ScanChange, ScanChangeAdmin)
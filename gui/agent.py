@@ -0,0 +1,240 @@
+"""
+Remote scan agent: leases scan jobs from the web app, runs the knock engine
+on this machine and uploads the results in compressed batches.
+
+    python -m gui.agent --server http://knockpy.example.com:8000 --token TOKEN
+
+Create the token on the web app (Agents page, or python manage.py
+agent_token NAME). The agent runs from a copy of this project with its
+requirements, but needs no database: the configuration of the domain comes
+with the job, DNS and recon answers are cached in memory, and a compiled
+wordlist is read from WORDLIST_DIR under the same file name (compile it on
+the agent). The recon API keys of the agent are its own options.
+
+The lease of a job is renewed while its scan runs; when an agent dies, the
+job goes back to the queue once the lease expires (SCAN_JOB_LEASE).
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+class AgentError(Exception):
+    pass
+
+
+class LeaseLost(AgentError):
+    pass
+
+
+class Client:
+    """
+    Calls of the agent API (gui.agents).
+    """
+    def __init__(self, server, token, timeout=60):
+        self.server = server.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def call(self, path, data=None, headers=None):
+        request = urllib.request.Request(
+            f"{self.server}{path}",
+            data=data or b'',
+            method='POST',
+            headers={'Authorization': f"Bearer {self.token}", **(headers or {})},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        if status == 409:
+            raise LeaseLost(path)
+        if status >= 400:
+            raise AgentError(f"{path}: HTTP {status} {body[:200].decode(errors='replace')}")
+        return json.loads(body) if body else None
+
+    def job_path(self, lease, action):
+        return f"/agent/jobs/{lease['job']}/{action}?attempt={lease['attempt']}"
+
+    def lease(self):
+        return self.call('/agent/lease')
+
+    def heartbeat(self, lease):
+        return self.call(self.job_path(lease, 'heartbeat'))
+
+    def upload(self, lease, results):
+        body = gzip.compress(''.join(json.dumps(result) + '\n' for result in results).encode())
+        headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'}
+        return self.call(self.job_path(lease, 'results'), body, headers)
+
+    def complete(self, lease, report):
+        body = json.dumps(report).encode()
+        return self.call(self.job_path(lease, 'complete'), body, {'Content-Type': 'application/json'})['state']
+
+
+def build_domain(config):
+    """
+    An unsaved Domain with the configuration sent with a job.
+    """
+    from django.conf import settings
+    from .models import Domain, Wordlist
+
+    config = dict(config)
+    wordlist = config.pop('wordlist_file', None)
+    domain = Domain(**config)
+    if wordlist:
+        domain.wordlist_file = Wordlist(id=wordlist['id'], path=os.path.join(settings.WORDLIST_DIR, wordlist['file']))
+    return domain
+
+
+class Agent:
+    """
+    Run up to `concurrency` leased scans at the same time.
+    """
+    def __init__(self, client, concurrency=1, batch_size=None, flush_interval=None, poll=None, log=None, keys=None):
+        from django.conf import settings
+        from .recon import MemoryStore
+        from . import wildcard
+
+        self.client = client
+        self.concurrency = concurrency
+        self.batch_size = batch_size or settings.AGENT_BATCH_SIZE
+        self.flush_interval = settings.AGENT_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.poll = settings.AGENT_POLL if poll is None else poll
+        self.log = log or (lambda line: print(line, flush=True))
+        # Recon API keys, and the recon cache and rate limits of this agent
+        self.keys = keys or {}
+        self.recon_store = MemoryStore()
+        # Wildcard fingerprints of the domains scanned by this agent
+        self.wildcard_store = wildcard.MemoryStore()
+
+    def keep_lease(self, lease, stop, lost):
+        """
+        Renew the lease every third of its duration until `stop` is set.
+        """
+        while not stop.wait(lease['lease'] / 3):
+            try:
+                self.client.heartbeat(lease)
+            except LeaseLost:
+                lost.set()
+                return
+            except (AgentError, OSError) as e:
+                self.log(f"[{lease['job']}] heartbeat failed: {e}")
+
+    def upload(self, lease, batch):
+        for rejected in self.client.upload(lease, batch)['rejected']:
+            self.log(f"[{lease['job']}] {rejected['domain']} rejected: {rejected['error']}")
+
+    def scan(self, lease):
+        """
+        Run the scan of a leased job, upload its results and report its end;
+        returns the state of the job, or 'lost' when the lease was lost.
+        """
+        from .dnscache import DNSCache
+        from .recon import Recon
+        from . import engine, wildcard
+
+        domain = build_domain(lease['domain'])
+        stop, lost = threading.Event(), threading.Event()
+        threading.Thread(target=self.keep_lease, args=(lease, stop, lost), daemon=True).start()
+        stages = {}
+        try:
+            fingerprint = wildcard.fingerprint(domain, store=self.wildcard_store)
+            filtering = domain.wildcard and fingerprint
+            dns_cache = DNSCache.for_domain(domain)
+            recon = Recon(self.keys, timeout=domain.timeout, store=self.recon_store)
+            batch, filtered, uploaded = [], 0, time.monotonic()
+            for result in engine.stream(domain, dns_cache, stages, recon):
+                if lost.is_set():
+                    raise LeaseLost(f"job {lease['job']}")
+                if filtering and fingerprint.filters(result):
+                    filtered += 1
+                    continue
+                batch.append(result)
+                if len(batch) >= self.batch_size or time.monotonic() - uploaded >= self.flush_interval:
+                    self.upload(lease, batch)
+                    batch, uploaded = [], time.monotonic()
+            if batch:
+                self.upload(lease, batch)
+            report = {"finished": True, "wildcard": bool(fingerprint), "filtered": filtered,
+                      "stages": stages, "dns": dns_cache.stats(), "recon": recon.stats}
+        except LeaseLost:
+            return 'lost'
+        except Exception as e:
+            report = {"error": f"{type(e).__name__}: {e}", "stages": stages}
+        finally:
+            stop.set()
+
+        try:
+            return self.client.complete(lease, report)
+        except LeaseLost:
+            return 'lost'
+
+    def next_lease(self):
+        try:
+            return self.client.lease()
+        except (AgentError, OSError) as e:
+            self.log(f"lease failed: {e}")
+            return None
+
+    def run(self, once=False):
+        running = {}  # future -> lease
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                while len(running) < self.concurrency:
+                    lease = self.next_lease()
+                    if not lease:
+                        break
+                    self.log(f"[{lease['job']}] scan {lease['domain']['name']} (attempt {lease['attempt']})")
+                    running[executor.submit(self.scan, lease)] = lease
+
+                if once and not running:
+                    break
+
+                if running:
+                    done, _ = wait(running, timeout=self.poll, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        lease = running.pop(future)
+                        try:
+                            self.log(f"[{lease['job']}] {future.result()}")
+                        except (AgentError, OSError) as e:
+                            self.log(f"[{lease['job']}] {e}")
+                else:
+                    time.sleep(self.poll)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Knockpy remote scan agent')
+    parser.add_argument('--server', required=True, help='URL of the web app, e.g. http://127.0.0.1:8000')
+    parser.add_argument('--token', default=os.environ.get('KNOCKPY_AGENT_TOKEN'),
+                        help='Token of the agent (or KNOCKPY_AGENT_TOKEN).')
+    parser.add_argument('--concurrency', type=int, default=1, help='Scans run at the same time by this agent.')
+    parser.add_argument('--once', action='store_true',
+                        help='Exit when the queue is empty instead of waiting for new jobs.')
+    parser.add_argument('--virustotal-key', default=os.environ.get('API_KEY_VIRUSTOTAL'),
+                        help='VirusTotal API key for the recon (or API_KEY_VIRUSTOTAL).')
+    parser.add_argument('--shodan-key', default=os.environ.get('API_KEY_SHODAN'),
+                        help='Shodan API key for the recon (or API_KEY_SHODAN).')
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error('--token is required')
+
+    # Settings of the project, for the engine; no database is opened
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'knockpygui.settings')
+    import django
+    django.setup()
+
+    keys = {'virustotal': args.virustotal_key, 'shodan': args.shodan_key}
+    Agent(Client(args.server, args.token), concurrency=max(1, args.concurrency), keys=keys).run(once=args.once)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Server side of the remote scan agents (python -m gui.agent).
+
+An agent authenticates with `Authorization: Bearer <token>` (AgentToken)
+and, for each job:
+- leases it: POST /agent/lease answers the job, its attempt and the
+  configuration of the domain (204 when there is nothing to run);
+- uploads the results in batches: POST /agent/jobs/<id>/results, JSON lines
+  compressed with gzip, written by the usual ingestion in the run of the job
+  (the results that are not valid are dropped and listed in the answer);
+- renews its lease while the scan runs: POST /agent/jobs/<id>/heartbeat;
+- reports the end of the scan: POST /agent/jobs/<id>/complete.
+
+The calls about a job carry its attempt (?attempt=N). When the lease of an
+agent expires the job goes back to the queue (requeue_expired), and the
+calls of that agent are refused (409) once another attempt has started.
+"""
+from datetime import datetime
+import json
+import logging
+import os
+import re
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+
+from .ingest import SubdomainWriter
+from .jobs import claim_job, finish_job, renew_leases, requeue_expired
+from .models import AgentToken, Domain, ScanEvent, ScanJob, ScanObservation
+from .progress import start_scan, finish_scan, fail_scan
+from . import events, writes
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT = re.compile(r'[0-9a-f]{64}')
+# Limits of the certificates uploaded by the agents (Certificate.common_name)
+MAX_NAME = 255
+MAX_SANS = 1000
+
+# Configuration of the domain sent with a job
+DOMAIN_FIELDS = ('name', 'recon', 'bruteforce', 'wildcard', 'wordlist', 'dns', 'useragent',
+                 'timeout', 'threads', 'engine', 'concurrency')
+
+
+class LeaseLost(Exception):
+    """
+    The job is no longer held by the agent under that attempt.
+    """
+
+
+def authenticate(request):
+    """
+    The active AgentToken of the request, or None.
+    """
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    agent = AgentToken.objects.filter(digest=AgentToken.hash(header[len('Bearer '):]), active=True).first()
+    if agent:
+        AgentToken.objects.filter(id=agent.id).update(last_seen_at=timezone.now())
+    return agent
+
+
+def domain_config(domain):
+    config = {field: getattr(domain, field) for field in DOMAIN_FIELDS}
+    # Compiled wordlists are looked up by file name under WORDLIST_DIR of the agent
+    wordlist = domain.wordlist_file
+    config['wordlist_file'] = {"id": wordlist.id, "file": os.path.basename(wordlist.path)} if wordlist and wordlist.path else None
+    return config
+
+
+def lease(agent):
+    """
+    Claim the next job for the agent and open its run; None when there is
+    nothing to run.
+    """
+    requeue_expired()
+    job = claim_job(limit=settings.SCAN_MAX_RUNNING, agent=agent)
+    if job is None:
+        return None
+    domain = Domain.objects.select_related('wordlist_file').get(id=job.domain_id)
+    run, messages = start_scan(domain, agent=agent.name)
+    ScanJob.objects.filter(id=job.id).update(run=run)
+    return {
+        "job": job.id,
+        "attempt": job.attempts,
+        "lease": settings.SCAN_JOB_LEASE,
+        "domain": domain_config(domain),
+    }
+
+
+def held_job(agent, job_id, attempt):
+    job = ScanJob.objects.select_related('domain', 'run').filter(
+        id=job_id, agent=agent, attempts=attempt, state=ScanJob.RUNNING,
+    ).first()
+    if job is None or job.run is None:
+        raise LeaseLost(f"job {job_id} attempt {attempt}")
+    return job
+
+
+def heartbeat(agent, job_id, attempt):
+    renew_leases([held_job(agent, job_id, attempt).id])
+
+
+def result_error(result, domain):
+    """
+    Why an uploaded result cannot be written, or None when it has the shape
+    of a knock result for a name of the domain.
+    """
+    try:
+        name = result['domain']
+        if not (isinstance(name, str) and (name == domain.name or name.endswith('.' + domain.name))):
+            return f"not a name of {domain.name}"
+        if not (isinstance(result['ip'], (list, type(None)))
+                and all(len(result[field]) == 3 for field in ('http', 'https', 'cert'))):
+            return "not a knock result"
+    except (KeyError, TypeError):
+        return "not a knock result"
+    if result.get('certificate') is not None:
+        return certificate_error(result['certificate'])
+    return None
+
+
+def certificate_error(certificate):
+    """
+    Why a certificate description (certificates.describe) cannot be stored,
+    or None.
+    """
+    if not isinstance(certificate, dict):
+        return "certificate: not an object"
+    fingerprint = certificate.get('fingerprint')
+    if not (isinstance(fingerprint, str) and FINGERPRINT.fullmatch(fingerprint)):
+        return "certificate: the fingerprint must be 64 hexadecimal digits"
+    common_name = certificate.get('common_name')
+    if not (common_name is None or isinstance(common_name, str) and len(common_name) <= MAX_NAME):
+        return f"certificate: the common name must be a string of at most {MAX_NAME} characters"
+    try:
+        if certificate.get('not_after') is not None:
+            datetime.strptime(certificate['not_after'], '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return "certificate: not_after must be a date (YYYY-MM-DD)"
+    sans = certificate.get('sans')
+    if not (isinstance(sans, list) and len(sans) <= MAX_SANS
+            and all(isinstance(san, str) and len(san) <= MAX_NAME for san in sans)):
+        return f"certificate: sans must be a list of at most {MAX_SANS} names of at most {MAX_NAME} characters"
+    return None
+
+
+def parse_results(body, compressed=True):
+    """
+    The results of an upload: JSON lines, compressed with gzip unless
+    `compressed` is False. Raises ValueError when it cannot be read.
+    """
+    limit = settings.AGENT_MAX_UPLOAD
+    if compressed:
+        try:
+            decompressor = zlib.decompressobj(wbits=31)
+            data = decompressor.decompress(body, limit + 1)
+        except zlib.error as e:
+            raise ValueError(f"Not gzip data: {e}")
+    else:
+        data = body
+    if len(data) > limit:
+        raise ValueError(f"Upload larger than {limit} bytes")
+    results = [json.loads(line) for line in data.splitlines() if line.strip()]
+    if not all(isinstance(result, dict) for result in results):
+        raise ValueError("Every line must be a JSON object")
+    return results
+
+
+def upload(agent, job_id, attempt, results):
+    """
+    Write a batch of results in the run of the job; returns the number of
+    results written and the rejected ones, [{domain, error}] (results that
+    are not valid are dropped, the others are written).
+    """
+    job = held_job(agent, job_id, attempt)
+    domain, run = job.domain, job.run
+    valid, rejected = [], []
+    for result in results:
+        error = result_error(result, domain)
+        if error is None:
+            valid.append(result)
+        else:
+            rejected.append({"domain": result.get('domain'), "error": error})
+    if rejected:
+        logger.warning("Agent %s: %s results of %s rejected", agent.name, len(rejected), domain.name)
+    results = valid
+    with SubdomainWriter(domain, run=run, update=domain.incremental) as writer:
+        writer.extend(results)
+    renew_leases([job.id])
+
+    # Resent batches are counted once: observations are unique per run
+    count = ScanObservation.objects.filter(run=run).count()
+    elapsed = (timezone.now() - run.started_at).total_seconds()
+    messages = domain.messages or {}
+    messages.update({"count": count, "rate": f"{count / elapsed:.1f}" if elapsed else "0.0", "time": f"{elapsed:.2f}"})
+    writes.write(Domain.objects.filter(id=domain.id).update, messages=messages)
+    events.publish(domain.id, ScanEvent.PROGRESS, count=count, rate=messages["rate"], time=messages["time"],
+                   filtered=messages.get("filtered", 0))
+    return len(results), rejected
+
+
+def complete(agent, job_id, attempt, report):
+    """
+    Close the scan of a job from the report of the agent: {finished,
+    wildcard, filtered, stages, dns, recon} or {error, stages}. Returns the state
+    of the job.
+    """
+    job = held_job(agent, job_id, attempt)
+    domain, run = job.domain, job.run
+    stages = report.get('stages') or {}
+    if report.get('error'):
+        error = str(report['error'])
+        fail_scan(domain, run, error, stages)
+        return finish_job(job, error=error)
+
+    messages = domain.messages or {}
+    messages.update({
+        "wildcard": bool(report.get('wildcard')),
+        "filtered": int(report.get('filtered') or 0),
+        "finished": bool(report.get('finished', True)),
+        "agent": agent.name,
+    })
+    for stats in ('dns', 'recon'):
+        if isinstance(report.get(stats), dict):
+            messages[stats] = report[stats]
+    finish_scan(domain, run, messages, stages)
+    return finish_job(job)
@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def enable_wal(using, **kwargs):
+    """
+    Switch a SQLite database to write-ahead logging: readers (the admin) do
+    not wait for the writers, and the writers do not wait for them. The mode
+    is stored in the database file, so it is set once, when it is migrated.
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
 
 
 class GuiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gui'
+
+    def ready(self):
+        post_migrate.connect(enable_wal, sender=self)
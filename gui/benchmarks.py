@@ -0,0 +1,181 @@
+"""
+Benchmark suite: the scan ingestion, the admin pages and the graph timed
+on a synthetic dataset, and compared with a saved baseline.
+
+    python manage.py benchmark suite --scale 100000 --save benchmarks/baseline.json
+    python manage.py benchmark suite --scale 100000 --baseline benchmarks/baseline.json
+
+The dataset spreads `scale` subdomains over DOMAINS domains whose names
+share a pool of addresses (NAMES_PER_ADDRESS names per address, like CDN
+edges); the last domain is a wildcard domain holding a tenth of the rows.
+
+A measurement regresses when it is slower than the baseline by more than
+its threshold (a fraction: the "thresholds" of the baseline file, or
+BENCHMARK_THRESHOLD) and by more than BENCHMARK_MIN_DELTA seconds, so
+that noise on fast pages is not reported.
+"""
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory
+
+from .facets import refresh_facets
+from .graph import build_graph
+from .ingest import SubdomainWriter
+from .models import Domain, Subdomain, Tag
+from .synthetic import generate
+
+FORMAT_VERSION = 1
+DOMAINS = 10
+NAMES_PER_ADDRESS = 50
+
+
+class BaselineError(Exception):
+    pass
+
+
+def dataset(scale):
+    """
+    Yield (domain name, rows, generate() options) for a dataset of `scale` rows.
+    """
+    wildcard_rows = scale // 10
+    rows = (scale - wildcard_rows) // (DOMAINS - 1)
+    for i in range(DOMAINS - 1):
+        count = rows if i < DOMAINS - 2 else scale - wildcard_rows - rows * (DOMAINS - 2)
+        yield f"suite{i}.invalid", count, {"seed": i, "addresses": max(1, count // NAMES_PER_ADDRESS)}
+    yield "wildcard.suite.invalid", wildcard_rows, {"seed": DOMAINS, "wildcard": True}
+
+
+class Suite:
+    """
+    Build the dataset and time every measurement; results are the median
+    seconds over `repeat` runs (the ingestion runs once).
+    """
+    def __init__(self, scale, repeat=5, log=None):
+        self.scale = scale
+        self.repeat = repeat
+        self.log = log or (lambda line: None)
+        self.results = {}
+        self.factory = RequestFactory()
+        self.user = None
+        self.domains = []
+
+    def record(self, name, seconds):
+        self.results[name] = seconds
+        self.log(f"{name}: {seconds * 1000:.1f} ms")
+
+    def time(self, name, function, repeat=None):
+        timings = []
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        self.record(name, statistics.median(timings))
+
+    def view(self, model, path):
+        """
+        Render an admin changelist as a superuser.
+        """
+        def render():
+            request = self.factory.get(path)
+            request.user = self.user
+            response = admin.site._registry[model].changelist_view(request)
+            if hasattr(response, 'render'):
+                response.render()
+            if response.status_code != 200:
+                raise BaselineError(f"{path} answered {response.status_code}")
+        return render
+
+    def populate(self):
+        start = time.perf_counter()
+        for name, count, options in dataset(self.scale):
+            tag = Tag.objects.create(name=name)
+            domain = Domain.objects.create(name=name, tag=tag, wildcard=options.get('wildcard', False))
+            with SubdomainWriter(domain) as writer:
+                writer.extend(generate(name, count, **options))
+            refresh_facets(domain)
+            self.domains.append(domain)
+        self.record('ingest.insert', time.perf_counter() - start)
+
+        # A rescan of the largest domain in incremental mode
+        domain = self.domains[0]
+        name, count, options = next(dataset(self.scale))
+        start = time.perf_counter()
+        with SubdomainWriter(domain, update=True) as writer:
+            writer.extend(generate(name, count, **options))
+        self.record('ingest.update', time.perf_counter() - start)
+
+    def run(self):
+        self.user = User.objects.filter(is_superuser=True).first() or User.objects.create_superuser('benchmark', '', 'benchmark')
+        self.populate()
+        domain, wildcard = self.domains[0], self.domains[-1]
+
+        self.time('admin.subdomain_changelist', self.view(Subdomain, '/admin/gui/subdomain/'))
+        self.time('admin.subdomain_changelist.domain', self.view(Subdomain, f'/admin/gui/subdomain/?domain={domain.id}'))
+        self.time('admin.subdomain_changelist.filtered', self.view(
+            Subdomain, f'/admin/gui/subdomain/?domain={domain.id}&http_status__exact=200&http_server__exact=nginx'))
+        self.time('admin.subdomain_changelist.search', self.view(Subdomain, '/admin/gui/subdomain/?q=10.0.0.0/24'))
+        self.time('admin.domain_changelist', self.view(Domain, '/admin/gui/domain/'))
+        self.time('admin.tag_changelist', self.view(Tag, '/admin/gui/tag/'))
+
+        self.time('graph.build', lambda: build_graph(domain))
+        self.time('graph.collapsed', lambda: build_graph(domain, collapse=True))
+        self.time('graph.wildcard', lambda: build_graph(wildcard, collapse=True))
+        return self.baseline()
+
+    def baseline(self):
+        return {
+            "version": FORMAT_VERSION,
+            "scale": self.scale,
+            "repeat": self.repeat,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "results": {name: round(seconds, 6) for name, seconds in self.results.items()},
+            "thresholds": {},
+        }
+
+
+def save(baseline, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path):
+    try:
+        with open(path) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BaselineError(f"Cannot read the baseline {path}: {e}")
+    if baseline.get('version') != FORMAT_VERSION:
+        raise BaselineError(f"{path} is not a baseline of this version of the suite")
+    return baseline
+
+
+def compare(baseline, current, threshold=None):
+    """
+    [(name, baseline seconds, current seconds, change, regressed)] for the
+    measurements of both runs; change is a fraction (0.1: 10% slower).
+    """
+    if baseline['scale'] != current['scale']:
+        raise BaselineError(f"The baseline was measured at scale {baseline['scale']}, not {current['scale']}")
+    rows = []
+    for name, seconds in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        limit = threshold if threshold is not None else baseline.get('thresholds', {}).get(name, settings.BENCHMARK_THRESHOLD)
+        change = (seconds - before) / before if before else 0
+        regressed = change > limit and seconds - before > settings.BENCHMARK_MIN_DELTA
+        rows.append((name, before, seconds, change, regressed))
+    return rows
@@ -0,0 +1,197 @@
+"""
+TLS certificates of the subdomains.
+
+A certificate is fetched once per (IP, SNI name) and kept in a process-wide
+cache for CERT_CACHE_TTL seconds, described by its sha256 fingerprint.
+Names served by an IP whose known certificate covers them (a SAN, often
+a wildcard) reuse it without a handshake: the thousands of names behind a
+CDN edge cost one handshake per certificate instead of one per name.
+
+Scan results carry the description under "certificate"; the ingestion
+stores one Certificate row per fingerprint and the subdomains reference it.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+import hashlib
+import socket
+import ssl
+import threading
+import time
+
+from cryptography import x509
+from cryptography.x509.oid import ExtensionOID, NameOID
+from django.conf import settings
+
+
+def describe(der):
+    """
+    {"fingerprint", "common_name", "not_after", "sans"} of a DER
+    certificate, or None when it cannot be parsed.
+    """
+    try:
+        cert = x509.load_der_x509_certificate(der)
+    except ValueError:
+        return None
+    names = cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    try:
+        sans = cert.extensions.get_extension_for_oid(ExtensionOID.SUBJECT_ALTERNATIVE_NAME).value.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        sans = []
+    return {
+        "fingerprint": hashlib.sha256(der).hexdigest(),
+        "common_name": names[0].value if names else None,
+        "not_after": cert.not_valid_after_utc.date().isoformat(),
+        "sans": [san.lower() for san in sans],
+    }
+
+
+def from_knock(cert):
+    """
+    Description of a certificate known only by knock's (status, date,
+    common name) triple; the fingerprint is derived from those fields.
+    """
+    status, not_after, common_name = cert
+    if not (not_after or common_name):
+        return None
+    digest = hashlib.sha256(f"knock:{common_name}:{not_after}".encode()).hexdigest()
+    return {"fingerprint": digest, "common_name": common_name, "not_after": not_after, "sans": []}
+
+
+def covers(sans, name):
+    """
+    True when one of the SANs is the name or a wildcard matching it.
+    """
+    for san in sans:
+        if san == name:
+            return True
+        if san.startswith('*.') and name.partition('.')[2] == san[2:]:
+            return True
+    return False
+
+
+def status(certificate, name):
+    """
+    knock's (valid, expiration date, common name) for a name: valid when
+    not expired and issued for the name; the common name is only given for
+    a certificate that is not expired.
+    """
+    if not certificate:
+        return None, None, None
+    valid = certificate["not_after"] >= datetime.now(timezone.utc).date().isoformat()
+    common_name = certificate["common_name"] if valid else None
+    if valid and certificate["sans"] and not covers(certificate["sans"], name):
+        valid = False
+    return valid, certificate["not_after"], common_name
+
+
+class CertificateCache:
+    """
+    Certificates seen by this process: by (ip, name), and per ip for the
+    names covered by their SANs. Counts the handshakes avoided (`hits`,
+    `shared` when the certificate was fetched for another name) and done
+    (`misses`).
+
+    Both maps keep their `size` (CERT_CACHE_SIZE) most recently used keys,
+    and expired certificates are dropped when they are met, so a worker
+    scanning many hosts does not grow with them. The certificates of an ip
+    remember the TLS name they were first fetched with (tls_name).
+    """
+    def __init__(self, size=None):
+        self.size = size
+        self.lock = threading.Lock()
+        self.by_name = OrderedDict()  # (ip, name) -> (description, expires)
+        self.by_ip = OrderedDict()  # ip -> {fingerprint: (description, expires, tls name)}
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+
+    def get(self, ip, name):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.by_name.get((ip, name))
+            if entry and entry[1] > now:
+                self.by_name.move_to_end((ip, name))
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self.by_name[(ip, name)]
+            shared = self.by_ip.get(ip, {})
+            for fingerprint, (certificate, expires, _) in list(shared.items()):
+                if expires <= now:
+                    del shared[fingerprint]
+                elif covers(certificate["sans"], name):
+                    self.by_ip.move_to_end(ip)
+                    self.hits += 1
+                    self.shared += 1
+                    return certificate
+            if ip in self.by_ip and not shared:
+                del self.by_ip[ip]
+            self.misses += 1
+            return None
+
+    def put(self, ip, name, certificate):
+        now = time.monotonic()
+        expires = now + settings.CERT_CACHE_TTL
+        size = self.size or settings.CERT_CACHE_SIZE
+        with self.lock:
+            self.by_name[(ip, name)] = (certificate, expires)
+            self.by_name.move_to_end((ip, name))
+            shared = {fingerprint: entry for fingerprint, entry in self.by_ip.get(ip, {}).items() if entry[1] > now}
+            tls_name = shared[certificate["fingerprint"]][2] if certificate["fingerprint"] in shared else name
+            shared[certificate["fingerprint"]] = (certificate, expires, tls_name)
+            self.by_ip[ip] = shared
+            self.by_ip.move_to_end(ip)
+            while len(self.by_name) > size:
+                self.by_name.popitem(last=False)
+            while len(self.by_ip) > size:
+                self.by_ip.popitem(last=False)
+
+    def tls_name(self, ip, name):
+        """
+        The TLS name a known certificate of the ip covering the name was
+        fetched with, or the name itself.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for certificate, expires, tls_name in self.by_ip.get(ip, {}).values():
+                if expires > now and covers(certificate["sans"], name):
+                    return tls_name
+        return name
+
+    def clear(self):
+        with self.lock:
+            self.by_name.clear()
+            self.by_ip.clear()
+            self.hits = self.shared = self.misses = 0
+
+
+cache = CertificateCache()
+
+
+def fetch(ip, name, timeout):
+    """
+    DER certificate served by ip for the SNI name, or None.
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    try:
+        with socket.create_connection((ip, settings.PROBE_HTTPS_PORT), timeout=timeout) as sock:
+            with context.wrap_socket(sock, server_hostname=name) as tls:
+                return tls.getpeercert(binary_form=True)
+    except (OSError, ssl.SSLError):
+        return None
+
+
+def certificate_for(ip, name, timeout):
+    """
+    Description of the certificate of a name on an ip, from the cache when
+    it is known, otherwise with a handshake.
+    """
+    certificate = cache.get(ip, name)
+    if certificate is None:
+        der = fetch(ip, name, timeout)
+        certificate = describe(der) if der else None
+        if certificate:
+            cache.put(ip, name, certificate)
+    return certificate
@@ -0,0 +1,154 @@
+"""
+DNS answer cache shared by the scans.
+
+Two tiers:
+- memory: an LRU per process (DNS_CACHE_SIZE answers), used by every scan
+  run by a worker;
+- database: DNSAnswer rows shared by the worker processes. A scan loads
+  the unexpired answers of its zone when it starts and writes its new
+  answers back in bulk when it ends.
+
+Answers are kept for their TTL (at most DNS_CACHE_MAX_TTL seconds).
+Negative answers (NXDOMAIN, no address) are cached too, for the SOA
+minimum of the response or DNS_CACHE_NEGATIVE_TTL. Timeouts are not cached.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone as dt_timezone
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DNSAnswer
+from . import writes
+from .resolver import DEFAULT_NAMESERVER
+
+
+class LRU:
+    """
+    Thread-safe mapping keeping the `size` most recently used keys.
+    """
+    def __init__(self, size=None):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value):
+        size = self.size or settings.DNS_CACHE_SIZE
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Memory tier of this process: (nameserver, name) -> (ips, expires, shared)
+memory = LRU()
+
+
+class DNSCache:
+    """
+    The cache as seen by one scan: answers of `nameserver` for the names of
+    `zone`, with the hit and miss counters of the scan.
+
+    get() and put() only touch memory and may be called from any thread or
+    from the event loop; warm() and flush() query the database.
+    """
+    def __init__(self, zone, nameserver=None, lru=None):
+        self.zone = zone
+        self.nameserver = nameserver or DEFAULT_NAMESERVER
+        self.memory = lru if lru is not None else memory
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.hits = 0
+        self.shared = 0
+        self.negative = 0
+        self.misses = 0
+
+    @classmethod
+    def for_domain(cls, domain):
+        return cls(domain.name, domain.dns)
+
+    def warm(self):
+        """
+        Load the unexpired answers of the zone stored by any process.
+        """
+        now = timezone.now()
+        answers = DNSAnswer.objects.filter(zone=self.zone, nameserver=self.nameserver)
+        writes.write(answers.filter(expires_at__lte=now).delete)
+
+        loaded = 0
+        rows = answers.filter(expires_at__gt=now).values_list('name', 'ips', 'expires_at')
+        for name, ips, expires_at in rows.iterator(chunk_size=settings.HISTORY_CHUNK_SIZE):
+            self.memory.set((self.nameserver, name), (ips, expires_at.timestamp(), True))
+            loaded += 1
+        return loaded
+
+    def get(self, name):
+        """
+        (hit, ips): ips is None for a cached negative answer.
+        """
+        entry = self.memory.get((self.nameserver, name))
+        with self.lock:
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return False, None
+            ips, expires, shared = entry
+            self.hits += 1
+            self.shared += shared
+            self.negative += ips is None
+        return True, ips
+
+    def put(self, name, ips, ttl):
+        """
+        Cache an answer (ips None when negative) for `ttl` seconds.
+        """
+        if ttl is None and ips is None:
+            ttl = settings.DNS_CACHE_NEGATIVE_TTL
+        if not ttl:
+            return
+        expires = time.time() + min(ttl, settings.DNS_CACHE_MAX_TTL)
+        self.memory.set((self.nameserver, name), (ips, expires, False))
+        with self.lock:
+            self.pending[name] = (ips, expires)
+
+    def flush(self):
+        """
+        Write the answers cached since the last flush to the database.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        rows = [
+            DNSAnswer(
+                zone=self.zone, nameserver=self.nameserver, name=name, ips=ips,
+                expires_at=datetime.fromtimestamp(expires, tz=dt_timezone.utc),
+            )
+            for name, (ips, expires) in pending.items()
+        ]
+        writes.write(
+            DNSAnswer.objects.bulk_create,
+            rows,
+            batch_size=settings.INGEST_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['nameserver', 'name'],
+            update_fields=['zone', 'ips', 'expires_at'],
+        )
+        return len(rows)
+
+    def stats(self):
+        return {"hits": self.hits, "shared": self.shared, "negative": self.negative, "misses": self.misses}
@@ -0,0 +1,303 @@
+"""
+Scan engines: turn a Domain into a stream of knock results.
+
+Results are yielded as soon as they are produced, so that the caller can
+write them in batches while the scan is still running. A scan runs as a
+pipeline of stages with bounded queues (gui.pipeline): recon and
+bruteforce names, resolve, http, certificate, write. Memory stays flat
+whatever the number of results.
+
+Two engines are available, selected by Domain.engine:
+- threads: knock probes (DNS, HTTP, HTTPS) in domain.threads threads per stage
+- asyncio: DNS lookups on asyncio (domain.concurrency in flight), then the
+  pooled, rate-limited asyncio HTTP probes (gui.prober) for the names
+  that resolve
+In both, certificates go through the certificate cache.
+"""
+import asyncio
+import queue
+import threading
+import time
+import os
+
+from django.conf import settings
+from django.db import connection
+from knock.knockpy import ROOT, HttpStatus
+
+from .resolver import AsyncResolver, addresses, resolve_sync, response_ttl
+from .pipeline import Pipeline, Stage
+from .prober import HTTPProber
+from .recon import Recon
+from . import certificates, metrics, wordlists
+
+DEFAULT_WORDLIST = os.path.join(ROOT, 'wordlist', 'wordlist.txt')
+
+
+def read_wordlist(path):
+    """
+    Yield the words of a wordlist one line at a time.
+    """
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                word = line.strip()
+                if word:
+                    yield word
+    except FileNotFoundError:
+        return
+
+
+def domain_words(domain):
+    """
+    The bruteforce words of a domain: its compiled wordlist (memory-mapped)
+    when it has one, otherwise the text file at domain.wordlist.
+    """
+    if domain.wordlist_file_id:
+        wordlist = domain.wordlist_file
+        if not wordlist.path:
+            raise wordlists.WordlistError(f"The wordlist {wordlist} is not compiled (python manage.py compile_wordlist)")
+        return wordlists.words(wordlist.path)
+    return read_wordlist(domain.wordlist or DEFAULT_WORDLIST)
+
+
+def recon_names(domain, seen, recon=None):
+    """
+    Yield the names found by the recon sources for the domain; `recon` is
+    the Recon client of the scan (its API keys), or one without keys.
+    """
+    if domain.recon:
+        recon = recon or Recon(timeout=domain.timeout)
+        try:
+            names = recon.names(domain.name)
+        finally:
+            # Read from a thread of the pipeline, whose connection is not reused
+            if not connection.in_atomic_block:
+                connection.close()
+        for name in names:
+            if name not in seen:
+                seen.add(name)
+                yield name
+
+
+def bruteforce_names(domain, seen):
+    """
+    Yield the names of the bruteforce wordlist not already found by recon.
+    """
+    if domain.bruteforce:
+        for word in domain_words(domain):
+            name = f"{word}.{domain.name}"
+            if name not in seen:
+                yield name
+
+
+def sources(domain, recon=None, seen=None):
+    """
+    The sources of the names to test, in order: recon, then bruteforce.
+    `seen` receives the names found by recon.
+    """
+    seen = set() if seen is None else seen
+    return [('recon', recon_names(domain, seen, recon)), ('bruteforce', bruteforce_names(domain, seen))]
+
+
+def resolve(name, domain, cache=None):
+    """
+    Addresses of the name with the name server of the domain, or None.
+    """
+    if cache is not None:
+        hit, ips = cache.get(name)
+        if hit:
+            metrics.DNS_QUERIES.inc('cached')
+            return ips
+
+    start = time.perf_counter()
+    response = resolve_sync(name, domain.dns, port=settings.ASYNC_DNS_PORT, timeout=domain.timeout or 3, retries=0)
+    if response is None:
+        metrics.DNS_QUERIES.inc('timeout')
+        return None
+    metrics.DNS_SECONDS.observe(time.perf_counter() - start)
+    ips = addresses(response)
+    metrics.DNS_QUERIES.inc('answer' if ips else 'nxdomain')
+    if cache is not None:
+        cache.put(name, ips, response_ttl(response))
+    return ips
+
+
+def probe(name, domain, cache=None):
+    """
+    Resolve the name and check HTTP, HTTPS and certificate, like knock's
+    HttpStatus.scan but with the DNS answers going through the cache.
+    """
+    ips = resolve(name, domain, cache)
+    if not ips:
+        return None
+    return check_certificate(probe_http(name, ips, domain), domain)
+
+
+def http_response(status, url):
+    """
+    knock's (status, redirect, server) of the url, measured.
+    """
+    scheme = url.split('://')[0]
+    start = time.perf_counter()
+    response = status.http_response(url)
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - start, scheme)
+    metrics.HTTP_PROBES.inc(scheme, 'response' if response[0] else 'error')
+    return response
+
+
+def probe_http(name, ips, domain):
+    """
+    The knock HTTP and HTTPS probes of an already resolved name.
+    """
+    status = HttpStatus(name, domain.dns, domain.useragent, domain.timeout)
+    result = {"domain": name, "ip": ips}
+
+    http = http_response(status, f"http://{name}")
+    https = http_response(status, f"https://{name}")
+
+    # Same fallback as knock: follow the HTTP redirect when HTTPS does not answer
+    if http[0] and http[1] and not https[0]:
+        location = http[1]
+        if not location.startswith(('http://', 'https://')):
+            location = 'http://' + location
+        https = http_response(status, f"https://{location.split('://')[1].split('/')[0]}")
+
+    result.update({"http": list(http), "https": list(https)})
+    return result
+
+
+def check_certificate(result, domain):
+    """
+    Add the certificate of a probed name to its result: the one read by
+    the probes when they did, otherwise through the certificate cache.
+    """
+    certificate = result.get("certificate")
+    if certificate is None and result["https"][0]:
+        # One handshake per certificate and IP, not per name
+        certificate = certificates.certificate_for(result["ip"][0], result["domain"], domain.timeout or 3)
+    result.update({"cert": list(certificates.status(certificate, result["domain"])), "certificate": certificate})
+    return result
+
+
+def threaded_stages(domain, cache):
+    """
+    Stages of the threads engine: knock probes, domain.threads per stage.
+    """
+    threads = domain.threads or 10
+
+    def resolve_name(name):
+        ips = resolve(name, domain, cache)
+        return (name, ips) if ips else None
+
+    return [
+        Stage.configured('resolve', resolve_name, threads, blocking=True),
+        Stage.configured('http', lambda item: probe_http(*item, domain), threads, blocking=True),
+    ]
+
+
+def async_stages(domain, resolver, prober):
+    """
+    Stages of the asyncio engine: domain.concurrency lookups and the
+    pooled asyncio HTTP probes.
+    """
+    async def resolve_name(name):
+        ips = await resolver.resolve(name)
+        return (name, ips) if ips else None
+
+    async def probe_name(item):
+        return await prober.probe_http(*item)
+
+    return [
+        Stage.configured('resolve', resolve_name, resolver.concurrency),
+        Stage.configured('http', probe_name, settings.HTTP_CONCURRENCY),
+    ]
+
+
+async def run_pipeline(domain, cache, emit, stats, recon=None):
+    """
+    Run the scan pipeline of the domain; `emit` is the blocking callable
+    writing a result, `stats` receives the statistics of the stages.
+    Results are labelled with their "source", 'recon' or 'bruteforce'.
+    """
+    found = set()  # names found by recon
+
+    def write(result):
+        result["source"] = 'recon' if result["domain"] in found else 'bruteforce'
+        emit(result)
+        return result
+
+    tail = [
+        Stage.configured('certificate', lambda result: check_certificate(result, domain), domain.threads or 10, blocking=True),
+        # One writer: results leave the pipeline in a single file
+        Stage('write', write, 1, blocking=True),
+    ]
+    pipeline = None
+    try:
+        if domain.engine == 'asyncio':
+            resolver = AsyncResolver(
+                domain.dns,
+                port=settings.ASYNC_DNS_PORT,
+                timeout=settings.ASYNC_DNS_TIMEOUT,
+                retries=settings.ASYNC_DNS_RETRIES,
+                concurrency=domain.concurrency or settings.ASYNC_DNS_CONCURRENCY,
+                cache=cache,
+            )
+            prober = HTTPProber(timeout=domain.timeout or 5, useragent=domain.useragent, resolve=resolver.resolve)
+            async with resolver, prober:
+                pipeline = Pipeline(sources(domain, recon, found), async_stages(domain, resolver, prober) + tail)
+                await pipeline.run()
+        else:
+            pipeline = Pipeline(sources(domain, recon, found), threaded_stages(domain, cache) + tail)
+            await pipeline.run()
+    finally:
+        if pipeline is not None and stats is not None:
+            stats.update(pipeline.stats())
+
+
+def stream(domain, cache=None, stats=None, recon=None):
+    """
+    Yield the results of a scan with the engine selected by the domain.
+
+    `cache` is an optional DNSCache used by the lookups, `recon` the Recon
+    client of the scan; the statistics of the pipeline stages are written
+    in the `stats` dict when it ends.
+
+    The pipeline runs on an event loop in its own thread, so that the
+    probes in flight keep being served while the caller writes the
+    results; at most ASYNC_RESULT_QUEUE results wait for the caller.
+    """
+    results = queue.Queue(maxsize=settings.ASYNC_RESULT_QUEUE)
+    done = object()
+    stopped = threading.Event()
+
+    def emit(result):
+        while not stopped.is_set():
+            try:
+                return results.put(result, timeout=0.5)
+            except queue.Full:
+                continue
+        raise asyncio.CancelledError
+
+    def run():
+        try:
+            asyncio.run(run_pipeline(domain, cache, emit, stats, recon))
+            item = done
+        except BaseException as e:
+            item = e
+        try:
+            emit(item)
+        except asyncio.CancelledError:
+            pass  # the caller went away
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
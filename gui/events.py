@@ -0,0 +1,184 @@
+"""
+Scan events pushed to the admin pages.
+
+The scans write their steps in ScanEvent: queued, started, stage
+(wildcard, scan, history), progress (at most every SCAN_PROGRESS_INTERVAL
+seconds), finished and failed. The domain changelist listens to /events
+(Server-Sent Events) and updates the rows of the domains concerned.
+
+Each web process runs a single poller that reads the new events every
+EVENTS_POLL_INTERVAL seconds while a page listens, and hands them to every
+open stream: the database is read once per process whatever the number of
+viewers. Pushing needs the ASGI application (knockpygui.asgi); under WSGI
+a stream answers the events written since the last one the browser got,
+and the browser asks again after EVENTS_RETRY seconds.
+"""
+import asyncio
+from datetime import timedelta
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ScanEvent
+from . import writes
+
+# Events read per query
+BATCH = 500
+
+# Put in the queue of a viewer that fell too far behind: its stream ends
+DROPPED = object()
+
+
+def publish(domain_id, kind, **data):
+    writes.write(ScanEvent.objects.create, domain_id=domain_id, kind=kind, data=data)
+
+
+def publish_many(domain_ids, kind, **data):
+    writes.write(ScanEvent.objects.bulk_create, [ScanEvent(domain_id=domain_id, kind=kind, data=data) for domain_id in domain_ids])
+
+
+def prune():
+    """
+    Delete the events older than EVENTS_RETENTION seconds.
+    """
+    writes.write(ScanEvent.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=settings.EVENTS_RETENTION)).delete)
+
+
+def latest_id():
+    return ScanEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def fetch(after, upto=None, limit=BATCH):
+    """
+    The events with an id above `after` (and up to `upto`), oldest first.
+    """
+    events = ScanEvent.objects.filter(id__gt=after).order_by('id')
+    if upto is not None:
+        events = events.filter(id__lte=upto)
+    return list(events.values('id', 'domain_id', 'kind', 'data')[:limit])
+
+
+def format_event(event):
+    data = json.dumps({"domain": event['domain_id'], **event['data']})
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {data}\n\n"
+
+
+def ready(last_id):
+    """
+    First event of a stream: sets the id the browser resumes from.
+    """
+    return f"retry: {settings.EVENTS_RETRY * 1000}\nid: {last_id}\nevent: ready\ndata: {{}}\n\n"
+
+
+class Broadcaster:
+    """
+    The poller of a process and the queues of its open streams.
+    """
+    def __init__(self):
+        self.loop = None
+        self.listeners = set()
+        self.last_id = None
+        self.task = None
+        self.polls = 0
+
+    async def subscribe(self):
+        """
+        (queue, id of the last event read): the queue gets every later event.
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # Bound to the loop of the server (a new one after a reload, or in tests)
+            self.loop, self.listeners, self.last_id, self.task = loop, set(), None, None
+        if self.last_id is None:
+            self.last_id = await sync_to_async(latest_id)()
+        queue = asyncio.Queue(settings.EVENTS_QUEUE_SIZE)
+        self.listeners.add(queue)
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self.poll())
+        return queue, self.last_id
+
+    def unsubscribe(self, queue):
+        self.listeners.discard(queue)
+
+    def dispatch(self, events):
+        for event in events:
+            self.last_id = event['id']
+            for queue in list(self.listeners):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # The browser resumes from its last event on a new stream
+                    self.listeners.discard(queue)
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(DROPPED)
+
+    async def poll(self):
+        while self.listeners:
+            await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+            while self.listeners:
+                events = await sync_to_async(fetch)(self.last_id)
+                self.polls += 1
+                self.dispatch(events)
+                if len(events) < BATCH:
+                    break
+
+
+broadcaster = Broadcaster()
+
+
+async def replay(after, upto):
+    """
+    The events the browser missed between two streams.
+    """
+    while True:
+        events = await sync_to_async(fetch)(after, upto)
+        for event in events:
+            yield format_event(event)
+        if len(events) < BATCH:
+            return
+        after = events[-1]['id']
+
+
+async def stream(after=None):
+    """
+    The text of an event stream: the events after the `after` id, then
+    the events published from now on, until the browser goes away.
+    """
+    queue, last_id = await broadcaster.subscribe()
+    try:
+        if after is not None:
+            async for text in replay(after, last_id):
+                yield text
+        yield ready(last_id)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), settings.EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is DROPPED:
+                return
+            yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(queue)
+
+
+def snapshot(after=None):
+    """
+    The text of a stream that ends at once (WSGI): the events after the
+    `after` id, and the id to resume from.
+    """
+    last_id = latest_id()
+    parts = []
+    if after is not None:
+        while True:
+            events = fetch(after, last_id)
+            parts.extend(format_event(event) for event in events)
+            if len(events) < BATCH:
+                break
+            after = events[-1]['id']
+    parts.append(ready(last_id))
+    return ''.join(parts)
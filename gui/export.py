@@ -0,0 +1,183 @@
+"""
+Streaming export of subdomains as CSV, JSONL or Parquet.
+
+Rows are read with a chunked iterator over a values_list (no model
+instances) and written one chunk at a time, so memory does not depend on
+the number of rows exported. Parquet needs pyarrow, which is optional.
+"""
+import csv
+import datetime
+import json
+
+from django.conf import settings
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# (column, queryset field)
+COLUMNS = (
+    ('name', 'name'),
+    ('domain', 'domain__name'),
+    ('ip', 'ip'),
+    ('http_status', 'http_status'),
+    ('http_redirect', 'http_redirect'),
+    ('http_server', 'http_server'),
+    ('https_status', 'https_status'),
+    ('https_redirect', 'https_redirect'),
+    ('https_server', 'https_server'),
+    ('cert_status', 'cert_status'),
+    ('cert_expiration_date', 'certificate__not_after'),
+    ('cert_common_name', 'certificate__common_name'),
+    ('http_only', 'http_only'),
+    ('cert_expired', 'cert_expired'),
+    ('cert_mismatch', 'cert_mismatch'),
+    ('risk_score', 'risk_score'),
+    ('created_at', 'created_at'),
+)
+
+HEADER = [column for column, field in COLUMNS]
+
+
+class ExportError(Exception):
+    pass
+
+
+def rows(queryset, chunk_size=None):
+    """
+    Tuples in the order of COLUMNS, read chunk_size rows at a time.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    values = queryset.order_by('id').values_list(*(field for column, field in COLUMNS))
+    ip = HEADER.index('ip')
+    for row in values.iterator(chunk_size=chunk_size):
+        row = list(row)
+        row[ip] = (row[ip] or {}).get('ip', [])
+        yield row
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def to_text(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+class Buffer:
+    """
+    File-like object keeping what was written until it is drained.
+    """
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(part if isinstance(part, bytes) else part.encode() for part in self.parts)
+        self.parts = []
+        return data
+
+
+def export_csv(rows, chunk_size):
+    buffer = Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    for chunk in chunked(rows, chunk_size):
+        for row in chunk:
+            writer.writerow([' '.join(value) if isinstance(value, list) else to_text(value) for value in row])
+        yield buffer.drain()
+    yield buffer.drain()
+
+
+def export_jsonl(rows, chunk_size):
+    for chunk in chunked(rows, chunk_size):
+        yield ''.join(
+            json.dumps(dict(zip(HEADER, row)), default=to_text) + '\n' for row in chunk
+        ).encode()
+
+
+def parquet_schema(pa):
+    return pa.schema([
+        ('name', pa.string()),
+        ('domain', pa.string()),
+        ('ip', pa.list_(pa.string())),
+        ('http_status', pa.int32()),
+        ('http_redirect', pa.string()),
+        ('http_server', pa.string()),
+        ('https_status', pa.int32()),
+        ('https_redirect', pa.string()),
+        ('https_server', pa.string()),
+        ('cert_status', pa.bool_()),
+        ('cert_expiration_date', pa.timestamp('us', tz='UTC')),
+        ('cert_common_name', pa.string()),
+        ('http_only', pa.bool_()),
+        ('cert_expired', pa.bool_()),
+        ('cert_mismatch', pa.bool_()),
+        ('risk_score', pa.int16()),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+    ])
+
+
+def load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportError("The parquet format needs pyarrow (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+
+def export_parquet(rows, chunk_size):
+    # One row group per chunk
+    pa, pq = load_pyarrow()
+    schema = parquet_schema(pa)
+    buffer = Buffer()
+    with pq.ParquetWriter(pa.PythonFile(buffer, mode='w'), schema) as writer:
+        for chunk in chunked(rows, chunk_size):
+            columns = list(zip(*chunk))
+            writer.write_batch(pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def export(queryset, fmt, chunk_size=None):
+    """
+    Bytes of the subdomains of the queryset in the format, chunk by chunk.
+
+    Raises ExportError for an unknown format or a missing dependency,
+    before any row is read.
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt}, choose one of {', '.join(FORMATS)}")
+    if fmt == 'parquet':
+        load_pyarrow()
+
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    writer = {'csv': export_csv, 'jsonl': export_jsonl, 'parquet': export_parquet}[fmt]
+    return writer(rows(queryset, chunk_size), chunk_size)
@@ -0,0 +1,93 @@
+from collections import Counter
+from functools import reduce
+import operator
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from .models import Subdomain, SubdomainFacet
+from . import writes
+
+# Subdomain fields offered as filters from the facet table
+FACET_FIELDS = ('http_status', 'https_status', 'http_server', 'https_server')
+
+
+def refresh_facets(domain):
+    """
+    Count the subdomains of the domain per value of each facet field.
+
+    One GROUP BY per field, limited to the domain that was just ingested.
+    """
+    facets = []
+    for field in FACET_FIELDS:
+        rows = (
+            Subdomain.objects.filter(domain=domain)
+            .exclude(**{f"{field}__isnull": True})
+            .values_list(field)
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        facets += [SubdomainFacet(domain=domain, field=field, value=str(value), count=count) for value, count in rows]
+
+    writes.write(replace_facets, domain, facets)
+
+
+def replace_facets(domain, facets):
+    with transaction.atomic():
+        SubdomainFacet.objects.filter(domain=domain).delete()
+        SubdomainFacet.objects.bulk_create(facets)
+
+
+def count_values(rows):
+    """
+    Counter of (field, value) over rows of {field: value}.
+    """
+    counts = Counter()
+    for row in rows:
+        for field in FACET_FIELDS:
+            if row[field] is not None:
+                counts[(field, str(row[field]))] += 1
+    return counts
+
+
+def update_facets(domain, before, after):
+    """
+    Move the facets of the domain from the subdomains `before` a write to
+    the ones `after` it (rows of {field: value}), so that the filters
+    follow a scan while it runs. Called inside the transaction of the
+    write; refresh_facets counts them again at the end of the scan.
+    """
+    delta = count_values(after)
+    delta.subtract(count_values(before))
+    delta = {key: count for key, count in delta.items() if count}
+    if not delta:
+        return
+
+    current = {
+        (field, value): count
+        for field, value, count in SubdomainFacet.objects.select_for_update()
+        .filter(domain=domain).values_list('field', 'value', 'count')
+    }
+    counts = {key: current.get(key, 0) + count for key, count in delta.items()}
+    gone = [key for key, count in counts.items() if count <= 0]
+    if gone:
+        SubdomainFacet.objects.filter(
+            reduce(operator.or_, (Q(field=field, value=value) for field, value in gone)), domain=domain,
+        ).delete()
+    SubdomainFacet.objects.bulk_create(
+        [SubdomainFacet(domain=domain, field=field, value=value, count=count)
+         for (field, value), count in counts.items() if count > 0],
+        update_conflicts=True,
+        unique_fields=['domain', 'field', 'value'],
+        update_fields=['count'],
+    )
+
+
+def facet_choices(field, domain_id=None):
+    """
+    [(value, count), ...] of a field, for one domain or for all of them.
+    """
+    facets = SubdomainFacet.objects.filter(field=field)
+    if domain_id:
+        facets = facets.filter(domain_id=domain_id)
+    return list(facets.values_list('value').annotate(total=Sum('count')).order_by('value'))
@@ -0,0 +1,95 @@
+"""
+Subdomain/IP graph of a domain, served as JSON to the changelist.
+
+The links are read with one query on SubdomainIP. Subdomains answering
+on exactly the same addresses can be collapsed into one node (typical of
+CDN edges shared by thousands of names), and the number of nodes is
+capped. Graphs are cached per domain, scan version and parameters.
+"""
+from collections import Counter, defaultdict
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .addresses import to_ip
+from .models import SubdomainIP
+
+
+def cache_key(domain, params):
+    # The version changes with every run and with the progress of a running scan
+    messages = domain.messages or {}
+    version = f"{messages.get('run')}-{messages.get('count')}-{domain.completed}"
+    digest = hashlib.md5(json.dumps(sorted(params.items())).encode()).hexdigest()
+    return f"graph:{domain.id}:{version}:{digest}"
+
+
+def build_graph(domain, subdomains=None, collapse=False, limit=None):
+    """
+    {"nodes": [...], "links": [...], "subdomains": n, "truncated": bool}
+
+    `subdomains` is an optional filtered Subdomain queryset of the domain.
+    Subdomain nodes are group 1, IP nodes group 2 and collapsed nodes
+    group 3 (their `size` is the number of subdomains they stand for).
+    """
+    limit = limit or settings.GRAPH_MAX_NODES
+
+    rows = SubdomainIP.objects.filter(domain=domain)
+    if subdomains is not None:
+        rows = rows.filter(subdomain__in=subdomains.values('id'))
+    rows = rows.values_list('subdomain__name', 'address').iterator(chunk_size=5000)
+
+    addresses = defaultdict(list)
+    for name, address in rows:
+        addresses[name].append(address)
+
+    # Subdomains grouped by their set of addresses
+    groups = defaultdict(list)
+    for name, ips in addresses.items():
+        groups[tuple(sorted(ips))].append(name)
+
+    # The addresses used by most subdomains are kept first when capping
+    usage = Counter()
+    for ips, names in groups.items():
+        for address in ips:
+            usage[address] += len(names)
+
+    nodes = []
+    links = []
+    seen = set()
+    truncated = False
+
+    def add_node(node):
+        if node["id"] not in seen:
+            seen.add(node["id"])
+            nodes.append(node)
+
+    for ips, names in sorted(groups.items(), key=lambda group: -max(usage[a] for a in group[0])):
+        if collapse and len(names) > 1:
+            members = [{"id": f"{len(names)} subdomains on {', '.join(to_ip(a) for a in ips)}",
+                        "group": 3, "size": len(names)}]
+        else:
+            members = [{"id": name, "group": 1} for name in sorted(names)]
+
+        if len(nodes) + len(members) + len(ips) > limit:
+            truncated = True
+            break
+
+        for address in ips:
+            add_node({"id": to_ip(address), "group": 2})
+        for member in members:
+            add_node(member)
+            for address in ips:
+                links.append({"source": member["id"], "target": to_ip(address)})
+
+    return {"nodes": nodes, "links": links, "subdomains": len(addresses), "truncated": truncated}
+
+
+def cached_graph(domain, params, subdomains=None, collapse=False, limit=None):
+    key = cache_key(domain, params)
+    graph = cache.get(key)
+    if graph is None:
+        graph = build_graph(domain, subdomains, collapse=collapse, limit=limit)
+        cache.set(key, graph, settings.GRAPH_CACHE_TTL)
+    return graph
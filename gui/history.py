@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ScanRun, ScanObservation, ScanChange, Subdomain
+from . import writes
+
+
+def start_run(domain):
+    """
+    Open a run for the domain, linked to its last finished run.
+    """
+    previous = ScanRun.objects.filter(domain=domain, state=ScanRun.FINISHED).order_by('-started_at', '-id').first()
+    return writes.write(ScanRun.objects.create, domain=domain, previous=previous)
+
+
+def observations(run):
+    """
+    {name: digest} of the subdomains seen by a run, read in chunks.
+    """
+    if run is None:
+        return {}
+    rows = ScanObservation.objects.filter(run=run).values_list('name', 'digest')
+    return dict(rows.iterator(chunk_size=settings.HISTORY_CHUNK_SIZE))
+
+
+def diff(previous, current):
+    """
+    Compare two {name: digest} mappings.
+
+    Returns the sets of added, removed and changed names, computed with set
+    operations over the names and the (name, digest) pairs.
+    """
+    added = current.keys() - previous.keys()
+    removed = previous.keys() - current.keys()
+    # Pairs that differ are either new names or names with a new digest
+    changed = {name for name, digest in current.items() - previous.items()} - added
+    return added, removed, changed
+
+
+def chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def finish_run(run, prune=False, stages=None):
+    """
+    Record the changes of a run against the previous one and close it.
+
+    With `prune` the subdomains that are gone are deleted from the domain,
+    so that Subdomain holds the state seen by the last run. `stages` are
+    the statistics of the scan pipeline.
+    """
+    current = observations(run)
+    added, removed, changed = diff(observations(run.previous), current)
+    run.count = len(current)
+    run.added = len(added)
+    run.removed = len(removed)
+    run.changed = len(changed)
+    run.stages = stages or {}
+    run.state = ScanRun.FINISHED
+    run.finished_at = timezone.now()
+    # The observations are read here; only the changes go through the writer
+    writes.write(record_changes, run, added, removed, changed, prune)
+    return run
+
+
+def record_changes(run, added, removed, changed, prune):
+    size = settings.HISTORY_CHUNK_SIZE
+    with transaction.atomic():
+        for kind, names in ((ScanChange.ADDED, added), (ScanChange.REMOVED, removed), (ScanChange.CHANGED, changed)):
+            for chunk in chunks(sorted(names), size):
+                ScanChange.objects.bulk_create([ScanChange(run=run, name=name, kind=kind) for name in chunk])
+
+        if prune:
+            for chunk in chunks(removed, 500):
+                Subdomain.objects.filter(domain_id=run.domain_id, name__in=chunk).delete()
+
+        run.save()
+
+
+def fail_run(run, stages=None):
+    writes.write(ScanRun.objects.filter(id=run.id).update, state=ScanRun.FAILED, finished_at=timezone.now(),
+                 stages=stages or {})
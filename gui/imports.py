@@ -0,0 +1,108 @@
+"""
+Bulk import of domains.
+
+The names are validated and deduplicated in Python, the tags are resolved
+or created with a few set-based queries, the domains are bulk-created and
+their scans queued in batches of IMPORT_BATCH_SIZE.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import DomainNameValidator
+from django.db import transaction
+
+from .jobs import enqueue_scans
+from .models import Domain, Tag
+from .schedule import schedule_domains
+
+validate_domain_name = DomainNameValidator()
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = []
+        self.existing = []
+        self.invalid = []
+        self.queued = 0
+
+    def __str__(self):
+        return (f"{len(self.created)} created, {len(self.existing)} already present, "
+                f"{len(self.invalid)} invalid, {self.queued} scans queued")
+
+
+def parse_names(lines):
+    """
+    (names, invalid) from lines of text, one domain per line.
+
+    Blank lines and # comments are ignored; names are lowercased, stripped
+    of a scheme, a path and a trailing dot, and kept once in input order.
+    """
+    names = {}
+    invalid = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode(errors='replace')
+        line = line.split('#', 1)[0].strip().lower()
+        if not line:
+            continue
+        name = line.split('://', 1)[-1].split('/', 1)[0].rstrip('.')
+        try:
+            validate_domain_name(name)
+        except ValidationError:
+            invalid.append(line)
+            continue
+        names.setdefault(name, None)
+    return list(names), invalid
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def resolve_tags(names, batch_size):
+    """
+    {name: Tag} for the names, the missing tags are created.
+    """
+    tags = {}
+    for batch in chunks(sorted(set(names)), batch_size):
+        Tag.objects.bulk_create([Tag(name=name) for name in batch], ignore_conflicts=True)
+        tags.update((tag.name, tag) for tag in Tag.objects.filter(name__in=batch))
+    return tags
+
+
+def import_domains(lines, tag=None, scan=True, priority=0, batch_size=None, **options):
+    """
+    Create the domains listed in `lines` that do not exist yet.
+
+    Each domain gets the tag named `tag`, or a tag with its own name like a
+    domain saved from the admin. `options` are Domain fields (recon,
+    bruteforce, wildcard...). With `scan` their scans are queued.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    if not options.get('recon', True) and not options.get('bruteforce', False):
+        raise ValidationError("At least one of 'recon' or 'bruteforce' must be enabled.")
+
+    result = ImportResult()
+    names, result.invalid = parse_names(lines)
+
+    with transaction.atomic():
+        existing = set()
+        for batch in chunks(names, batch_size):
+            existing.update(Domain.objects.filter(name__in=batch).values_list('name', flat=True))
+        result.existing = [name for name in names if name in existing]
+        new = [name for name in names if name not in existing]
+
+        tags = resolve_tags([tag] if tag else new, batch_size)
+        for batch in chunks(new, batch_size):
+            domains = [Domain(name=name, tag=tags[tag or name], **options) for name in batch]
+            result.created.extend(Domain.objects.bulk_create(domains))
+
+        if scan:
+            result.queued = enqueue_scans(result.created, priority=priority, batch_size=batch_size)
+
+        # Domains joining a tag with an interval are scanned again with it
+        recurring = [tag.id for tag in tags.values() if tag.scan_interval]
+        if recurring:
+            schedule_domains(Domain.objects.filter(tag__in=recurring, next_scan_at__isnull=True), spread=not scan)
+
+    return result
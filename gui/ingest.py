@@ -0,0 +1,240 @@
+from datetime import datetime
+from functools import lru_cache
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Certificate, Subdomain, SubdomainIP, ScanObservation
+from .addresses import to_int
+from .certificates import from_knock
+from .facets import FACET_FIELDS, update_facets
+from . import metrics, risk, writes
+
+# Fields refreshed when an existing subdomain is found again (incremental mode)
+UPDATE_FIELDS = [
+    'ip',
+    'http_status', 'http_redirect', 'http_server',
+    'https_status', 'https_redirect', 'https_server',
+    'cert_status', 'certificate',
+    'http_only', 'cert_expired', 'cert_mismatch', 'risk_score',
+]
+
+
+@lru_cache(maxsize=4096)
+def cert_expiration(value):
+    """
+    Convert the certificate expiration date returned by knock ('%Y-%m-%d').
+
+    Cached: the subdomains of a domain share a handful of certificates.
+    """
+    if not value:
+        return None
+    return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
+
+
+def result_digest(result):
+    """
+    Digest of what a scan saw for a subdomain, used to detect changes between runs.
+    """
+    data = [sorted(result['ip'] or []), result['http'], result['https'], result['cert']]
+    return hashlib.blake2b(json.dumps(data).encode(), digest_size=16).hexdigest()
+
+
+def result_certificate(result):
+    """
+    Description of the certificate of a result: the one read by the probes,
+    or one derived from knock's certificate fields.
+    """
+    return result.get('certificate') or from_knock(result['cert'])
+
+
+def subdomain_from_result(result, domain, certificates=None, now=None):
+    """
+    Build an unsaved Subdomain from a knock result, with its risk flags;
+    `certificates` maps fingerprints to Certificate ids, `now` is the time
+    certificates expire against.
+    """
+    certificate = result_certificate(result)
+    flags = risk.flags(
+        result['http'][0],
+        result['https'][0],
+        cert_expiration(certificate["not_after"]) if certificate else None,
+        certificate["common_name"] if certificate else None,
+        domain.name,
+        now or timezone.now(),
+    )
+    return Subdomain(
+        name=result['domain'],
+        ip={"ip": result['ip']},
+        http_status=result['http'][0],
+        http_redirect=result['http'][1],
+        http_server=result['http'][2],
+        https_status=result['https'][0],
+        https_redirect=result['https'][1],
+        https_server=result['https'][2],
+        cert_status=result['cert'][0],
+        certificate_id=(certificates or {}).get(certificate["fingerprint"]) if certificate else None,
+        domain=domain,
+        risk_score=risk.score(flags),
+        **flags
+    )
+
+
+class SubdomainWriter:
+    """
+    Buffer the results of a scan and write them in chunks.
+
+    Each chunk is written with bulk queries inside a transaction, by the
+    writer of the process (gui.writes) while the next chunk fills up. With
+    `update` the subdomains already stored for the domain are refreshed,
+    otherwise they are skipped by the database through the (domain, name)
+    unique constraint. With a `run` each result is also recorded as an
+    observation of that run.
+
+    Use it as a context manager so that the last chunk is written:
+
+        with SubdomainWriter(domain) as writer:
+            for result in results:
+                writer.add(result)
+    """
+    def __init__(self, domain, batch_size=None, run=None, update=False):
+        self.domain = domain
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.run = run
+        self.update = update
+        self.pending = {}
+        self.names = set()
+        self.futures = []
+
+    @property
+    def count(self):
+        """
+        Names added, each counted once however many times it is added.
+        """
+        return len(self.names)
+
+    def add(self, result):
+        # Keyed by name: a chunk must not hit the same row twice
+        self.pending[result['domain']] = result
+        self.names.add(result['domain'])
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def extend(self, results):
+        for result in results:
+            self.add(result)
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        self.futures.append(writes.submit(self.write_chunk, pending))
+        # One chunk written while the next one fills up
+        while len(self.futures) > 1:
+            self.futures.pop(0).result()
+
+    def wait(self):
+        """
+        Wait until the chunks handed to the writer are committed.
+        """
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def write_chunk(self, pending):
+        start = time.perf_counter()
+        with transaction.atomic():
+            certificates = self.write_certificates(pending)
+            now = timezone.now()
+            subdomains = [subdomain_from_result(result, self.domain, certificates, now) for result in pending.values()]
+            # The rows already stored are replaced in update mode, kept otherwise
+            before = list(Subdomain.objects.filter(domain=self.domain, name__in=list(pending)).values('name', *FACET_FIELDS))
+            if self.update:
+                Subdomain.objects.bulk_create(
+                    subdomains,
+                    batch_size=self.batch_size,
+                    update_conflicts=True,
+                    unique_fields=['domain', 'name'],
+                    update_fields=UPDATE_FIELDS,
+                )
+                written = subdomains
+            else:
+                Subdomain.objects.bulk_create(subdomains, batch_size=self.batch_size, ignore_conflicts=True)
+                stored = {row['name'] for row in before}
+                written = [subdomain for subdomain in subdomains if subdomain.name not in stored]
+                before = []
+
+            self.write_addresses(pending)
+            update_facets(self.domain, before, [{field: getattr(subdomain, field) for field in FACET_FIELDS} for subdomain in written])
+
+            if self.run:
+                ScanObservation.objects.bulk_create(
+                    [ScanObservation(run=self.run, name=name, digest=result_digest(result))
+                     for name, result in pending.items()],
+                    batch_size=self.batch_size,
+                    ignore_conflicts=True,
+                )
+        metrics.DB_BATCHES.observe(time.perf_counter() - start)
+        metrics.DB_ROWS.inc(amount=len(written))
+
+    def write_certificates(self, pending):
+        """
+        Store the certificates of the pending results, once per fingerprint;
+        returns {fingerprint: id}.
+        """
+        described = {}
+        for result in pending.values():
+            certificate = result_certificate(result)
+            if certificate:
+                described[certificate["fingerprint"]] = certificate
+        if not described:
+            return {}
+
+        Certificate.objects.bulk_create(
+            [Certificate(
+                fingerprint=fingerprint,
+                common_name=certificate["common_name"],
+                not_after=cert_expiration(certificate["not_after"]),
+                sans=certificate["sans"],
+            ) for fingerprint, certificate in described.items()],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        return dict(Certificate.objects.filter(fingerprint__in=list(described)).values_list('fingerprint', 'id'))
+
+    def write_addresses(self, pending):
+        """
+        Store the addresses of the pending results in SubdomainIP.
+
+        The ids of the chunk are read back with one query; in update mode
+        the previous addresses of those subdomains are replaced.
+        """
+        ids = dict(
+            Subdomain.objects.filter(domain=self.domain, name__in=list(pending)).values_list('name', 'id')
+        )
+        if self.update:
+            SubdomainIP.objects.filter(subdomain_id__in=ids.values()).delete()
+
+        addresses = []
+        for name, result in pending.items():
+            for ip in set(result['ip'] or ()):
+                address = to_int(ip)
+                if address is not None and name in ids:
+                    addresses.append(SubdomainIP(subdomain_id=ids[name], domain=self.domain, address=address))
+        SubdomainIP.objects.bulk_create(addresses, batch_size=self.batch_size, ignore_conflicts=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            self.wait()
+        else:
+            # Nothing of the scan is written after it failed
+            for future in self.futures:
+                future.exception()
@@ -0,0 +1,163 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ScanEvent, ScanJob, ScanRun
+from .progress import fail_domain
+from . import events
+
+
+def enqueue_scan(domain, priority=0):
+    """
+    Put a scan for the domain in the queue.
+
+    If a scan for the same domain is already waiting, that job is returned
+    (with the higher of the two priorities) instead of queuing a duplicate.
+    """
+    job = ScanJob.objects.filter(domain=domain, state=ScanJob.QUEUED).first()
+    if job:
+        if priority > job.priority:
+            job.priority = priority
+            job.save(update_fields=['priority'])
+        return job
+
+    job = ScanJob.objects.create(
+        domain=domain,
+        priority=priority,
+        max_attempts=settings.SCAN_JOB_ATTEMPTS,
+    )
+    events.publish(domain.id, ScanEvent.QUEUED)
+    return job
+
+
+def enqueue_scans(domains, priority=0, batch_size=None):
+    """
+    Queue a scan for many domains, batch_size jobs per query.
+
+    Domains with a scan already waiting are skipped. Returns the number of
+    jobs created; the workers still run at most SCAN_MAX_RUNNING of them.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    domains = list(domains)
+    created = 0
+    for i in range(0, len(domains), batch_size):
+        batch = domains[i:i + batch_size]
+        waiting = set(ScanJob.objects.filter(
+            domain__in=batch, state=ScanJob.QUEUED,
+        ).values_list('domain_id', flat=True))
+        jobs = [
+            ScanJob(domain=domain, priority=priority, max_attempts=settings.SCAN_JOB_ATTEMPTS)
+            for domain in batch if domain.id not in waiting
+        ]
+        ScanJob.objects.bulk_create(jobs)
+        events.publish_many([job.domain_id for job in jobs], ScanEvent.QUEUED)
+        created += len(jobs)
+    return created
+
+
+def lease_deadline():
+    return timezone.now() + timedelta(seconds=settings.SCAN_JOB_LEASE)
+
+
+def claim_job(limit=None, agent=None):
+    """
+    Move the next queued job to running and return it; `agent` is the
+    remote agent claiming it (None for a local worker).
+
+    Returns None when the queue is empty or when `limit` jobs are already
+    running (the global cap shared by every worker process and agent).
+    """
+    with transaction.atomic():
+        if limit and ScanJob.objects.filter(state=ScanJob.RUNNING).count() >= limit:
+            return None
+
+        job = ScanJob.objects.filter(state=ScanJob.QUEUED).order_by('-priority', 'created_at', 'id').first()
+        if not job:
+            return None
+
+        # Conditional update: another worker may have claimed it meanwhile
+        claimed = ScanJob.objects.filter(id=job.id, state=ScanJob.QUEUED).update(
+            state=ScanJob.RUNNING,
+            attempts=F('attempts') + 1,
+            started_at=timezone.now(),
+            finished_at=None,
+            lease_expires_at=lease_deadline(),
+            agent=agent,
+            run=None,
+        )
+        if not claimed:
+            return None
+
+    job.refresh_from_db()
+    return job
+
+
+def renew_leases(job_ids):
+    """
+    Extend the lease of the jobs still being run by this worker.
+    """
+    if job_ids:
+        ScanJob.objects.filter(id__in=job_ids, state=ScanJob.RUNNING).update(lease_expires_at=lease_deadline())
+
+
+def requeue_expired():
+    """
+    Give back to the queue the running jobs whose worker went away.
+
+    Jobs that already used all of their attempts are marked as failed.
+    """
+    expired = ScanJob.objects.filter(state=ScanJob.RUNNING, lease_expires_at__lt=timezone.now())
+    # Runs left open by the remote agents that went away
+    ScanRun.objects.filter(id__in=expired.exclude(run=None).values('run_id'), state=ScanRun.RUNNING).update(
+        state=ScanRun.FAILED,
+        finished_at=timezone.now(),
+    )
+    exhausted = expired.filter(attempts__gte=F('max_attempts'))
+    domain_ids = list(exhausted.values_list('domain_id', flat=True))
+    failed = exhausted.update(
+        state=ScanJob.FAILED,
+        error='lease expired',
+        finished_at=timezone.now(),
+        lease_expires_at=None,
+    )
+    for domain_id in domain_ids:
+        fail_domain(domain_id, 'lease expired')
+    requeued = expired.update(state=ScanJob.QUEUED, lease_expires_at=None)
+    return requeued, failed
+
+
+def finish_job(job, error=None):
+    """
+    Record the outcome of a run: done, back to the queue for a retry, or failed.
+    """
+    if error is None:
+        state = ScanJob.DONE
+    elif job.attempts < job.max_attempts:
+        state = ScanJob.QUEUED
+    else:
+        state = ScanJob.FAILED
+
+    ScanJob.objects.filter(id=job.id).update(
+        state=state,
+        error=error,
+        finished_at=timezone.now() if state != ScanJob.QUEUED else None,
+        lease_expires_at=None,
+    )
+    if state == ScanJob.QUEUED:
+        events.publish(job.domain_id, ScanEvent.QUEUED, retry=job.attempts)
+    return state
+
+
+def run_job(job):
+    """
+    Run the scan of a claimed job and record its outcome.
+    """
+    try:
+        call_command('scan', job.domain_id)
+    except Exception as e:
+        return finish_job(job, error=f"{type(e).__name__}: {e}")
+    return finish_job(job)
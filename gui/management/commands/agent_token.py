@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from gui.models import AgentToken
+
+class Command(BaseCommand):
+    help = 'Create the token of a remote scan agent (python -m gui.agent), or revoke it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Agent name.')
+        parser.add_argument('--revoke', action='store_true', help='Revoke the token of the agent.')
+        parser.add_argument('--rotate', action='store_true', help='Replace the token of an existing agent.')
+
+    def handle(self, *args, **kwargs):
+        agent = AgentToken.objects.filter(name=kwargs['name']).first()
+        if kwargs['revoke'] or kwargs['rotate']:
+            if not agent:
+                raise CommandError(f"Unknown agent {kwargs['name']}")
+            if kwargs['revoke']:
+                agent.active = False
+                agent.save(update_fields=['active'])
+                self.stdout.write(f"{agent.name}: revoked")
+                return
+            token = agent.new_token()
+            agent.active = True
+            agent.save(update_fields=['digest', 'active'])
+        elif agent:
+            raise CommandError(f"The agent {agent.name} exists, use --rotate for a new token")
+        else:
+            agent, token = AgentToken.create(kwargs['name'])
+
+        # Only the digest is stored: the token cannot be shown again
+        self.stdout.write(token)
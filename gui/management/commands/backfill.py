@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from gui.models import Domain, Subdomain, SubdomainIP
+from gui.addresses import to_int
+from gui.facets import refresh_facets
+from gui import risk
+
+class Command(BaseCommand):
+    help = 'Fill the derived tables of the subdomains stored before they existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=['ips', 'risk', 'facets'])
+        parser.add_argument('--chunk', type=int, default=5000)
+
+    def handle(self, *args, **kwargs):
+        if kwargs['target'] == 'facets':
+            # Counted per domain with one GROUP BY per field
+            total = 0
+            for domain in Domain.objects.order_by('id').iterator():
+                refresh_facets(domain)
+                total += 1
+            self.stdout.write(f"{total} domains")
+            return
+
+        chunk = kwargs['chunk']
+        fill = getattr(self, f"fill_{kwargs['target']}")
+        # The risk flags read the domain name and the certificate of each row
+        related = {'ips': (), 'risk': ('domain', 'certificate')}[kwargs['target']]
+
+        # Walk the table by primary key, one chunk per transaction
+        last = 0
+        total = 0
+        while True:
+            rows = list(Subdomain.objects.select_related(*related).filter(id__gt=last).order_by('id')[:chunk])
+            if not rows:
+                break
+            with transaction.atomic():
+                fill(rows)
+            last = rows[-1].id
+            total += len(rows)
+            self.stdout.write(f"{total} subdomains")
+
+    def fill_ips(self, rows):
+        addresses = [
+            SubdomainIP(subdomain_id=row.id, domain_id=row.domain_id, address=address)
+            for row in rows
+            for address in {to_int(ip) for ip in (row.ip or {}).get('ip', [])}
+            if address is not None
+        ]
+        SubdomainIP.objects.bulk_create(addresses, ignore_conflicts=True)
+
+    def fill_risk(self, rows):
+        # Certificates are checked against the time of the backfill
+        now = timezone.now()
+        for row in rows:
+            risk.assess(row, row.domain.name, row.cert_expiration_date, row.cert_common_name, now)
+        Subdomain.objects.bulk_update(rows, [*risk.FLAGS, 'risk_score'])
@@ -0,0 +1,323 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import RequestFactory
+from gui.models import Domain, Tag, Subdomain, ScanObservation
+from gui.facets import refresh_facets
+from gui.ingest import SubdomainWriter
+from gui.history import start_run, finish_run
+from gui.resolver import AsyncResolver
+from gui.dnscache import DNSCache, LRU
+from gui.synthetic import StubDNSServer, StubHTTPServer, generate
+from gui.prober import HTTPProber
+from knock.knockpy import HttpStatus
+from django.test.utils import override_settings
+from gui.export import export, ExportError, FORMATS
+from gui import benchmarks, certificates, engine, wordlists
+from gui.engine import read_wordlist
+
+from concurrent.futures import ThreadPoolExecutor
+import dns.resolver
+import statistics
+import tracemalloc
+import tempfile
+import os
+import asyncio
+import time
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Measure the performance of the scan pipeline on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('case', choices=['ingest', 'dns', 'diff', 'changelist', 'export', 'wordlist', 'http', 'pipeline', 'suite'])
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--threads', type=int, default=30)
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument('--domains', type=int, default=10,
+                            help='Domains the rows are spread over (changelist).')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='Seconds taken by the stub name server to answer.')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Requests per second per IP of the HTTP probes (http).')
+        parser.add_argument('--scale', type=int, default=10000,
+                            help='Subdomains of the synthetic dataset (suite).')
+        parser.add_argument('--save', default=None,
+                            help='Write the results as a baseline to this JSON file (suite).')
+        parser.add_argument('--baseline', default=None,
+                            help='Compare the results with this baseline and fail on regressions (suite).')
+        parser.add_argument('--threshold', type=float, default=None,
+                            help='Slowdown allowed against the baseline, as a fraction (suite).')
+
+    def handle(self, *args, **kwargs):
+        # Everything written by a benchmark is rolled back at the end
+        try:
+            with transaction.atomic():
+                getattr(self, f"bench_{kwargs['case']}")(**kwargs)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, label, rows, seconds, unit='rows'):
+        self.stdout.write(f"{label}: {rows} {unit} in {seconds:.2f} s ({rows / seconds:.0f} {unit}/s)")
+
+    def create_domain(self, name='benchmark.invalid'):
+        tag = Tag.objects.create(name=name)
+        return Domain.objects.create(name=name, tag=tag)
+
+    def populate(self, rows, domains):
+        """
+        Spread `rows` synthetic subdomains over `domains` domains.
+        """
+        created = []
+        for i in range(domains):
+            domain = self.create_domain(f"benchmark{i}.invalid")
+            with SubdomainWriter(domain) as writer:
+                writer.extend(generate(domain.name, rows // domains, seed=i))
+            refresh_facets(domain)
+            created.append(domain)
+        return created
+
+    def time_view(self, view, path, repeat):
+        """
+        Median milliseconds to render an admin view as a superuser.
+        """
+        factory = RequestFactory()
+        user = User.objects.filter(is_superuser=True).first() or User.objects.create_superuser('benchmark', '', 'benchmark')
+        timings = []
+        for _ in range(repeat):
+            request = factory.get(path)
+            request.user = user
+            start = time.perf_counter()
+            response = view(request)
+            if hasattr(response, 'render'):
+                response.render()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def bench_ingest(self, rows, batch_size, **kwargs):
+        domain = self.create_domain()
+        results = list(generate(domain.name, rows))
+
+        # First pass inserts, second pass only hits duplicates
+        for label in ('insert', 'duplicates'):
+            start = time.perf_counter()
+            with SubdomainWriter(domain, batch_size=batch_size) as writer:
+                writer.extend(results)
+            self.report(label, rows, time.perf_counter() - start)
+
+    def bench_dns(self, queries, threads, concurrency, latency, **kwargs):
+        # Half of the names exist, the other half get NXDOMAIN
+        names = [f"host{i}.benchmark.invalid" for i in range(queries)]
+
+        def records(name):
+            number = int(name.split('.')[0][4:])
+            return [f"10.0.{number % 256}.1"] if number % 2 == 0 else None
+
+        with StubDNSServer(records, latency=latency, process=True) as server:
+            resolver = dns.resolver.Resolver(configure=False)
+            resolver.nameservers = ['127.0.0.1']
+            resolver.port = server.port
+            resolver.lifetime = 2
+
+            def lookup(name):
+                try:
+                    return [str(ip) for ip in resolver.resolve(name, 'A')]
+                except dns.exception.DNSException:
+                    return None
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(lookup, names))
+            self.report(f"threads ({threads})", queries, time.perf_counter() - start, unit='queries')
+
+            async def run(cache=None):
+                async with AsyncResolver('127.0.0.1', port=server.port, concurrency=concurrency, cache=cache) as resolver:
+                    await asyncio.gather(*(resolver.resolve(name) for name in names))
+
+            start = time.perf_counter()
+            asyncio.run(run())
+            self.report(f"asyncio ({concurrency})", queries, time.perf_counter() - start, unit='queries')
+
+            # Second scan of the same names, answers cached by the first one
+            cache = DNSCache('benchmark.invalid', '127.0.0.1', lru=LRU(queries))
+            asyncio.run(run(cache))
+            start = time.perf_counter()
+            asyncio.run(run(cache))
+            self.report(f"asyncio cached ({cache.hits} hits)", queries, time.perf_counter() - start, unit='queries')
+
+    def bench_diff(self, rows, **kwargs):
+        # Two runs of `rows` subdomains: 1% removed, 1% added, 5% changed
+        domain = self.create_domain()
+        step = max(1, rows // 100)
+        for version in range(2):
+            run = start_run(domain)
+            observations = []
+            for i in range(rows):
+                name = f"host{i if version == 0 or i % step else rows + i}.{domain.name}"
+                digest = f"{i:032x}" if version == 0 or i % 20 else f"{i + 1:032x}"
+                observations.append(ScanObservation(run=run, name=name, digest=digest))
+            ScanObservation.objects.bulk_create(observations, batch_size=5000)
+            del observations
+            start = time.perf_counter()
+            run = finish_run(run)
+        seconds = time.perf_counter() - start
+        self.report(f"diff (+{run.added} -{run.removed} ~{run.changed})", run.count, seconds)
+
+    def bench_changelist(self, rows, domains, repeat, **kwargs):
+        domain = self.populate(rows, domains)[0]
+        view = admin.site._registry[Subdomain].changelist_view
+        queries = [
+            '',
+            '?http_server__exact=nginx',
+            f'?domain={domain.id}',
+            f'?domain={domain.id}&http_status__exact=200',
+            f'?domain={domain.id}&http_server__exact=nginx&cert_status__exact=1',
+        ]
+        for query in queries:
+            ms = self.time_view(view, f"/admin/gui/subdomain/{query}", repeat)
+            self.stdout.write(f"subdomain changelist {query or '(all)'}: {ms:.0f} ms ({rows} rows)")
+
+    def bench_export(self, rows, **kwargs):
+        domain = self.populate(rows, 1)[0]
+        queryset = Subdomain.objects.filter(domain=domain)
+        for fmt in FORMATS:
+            try:
+                export(queryset, fmt)
+            except ExportError as e:
+                self.stdout.write(f"{fmt}: skipped, {e}")
+                continue
+
+            start = time.perf_counter()
+            size = sum(len(data) for data in export(queryset, fmt))
+            self.report(f"{fmt} ({size / 1e6:.1f} MB)", rows, time.perf_counter() - start)
+
+            # Peak of the Python heap while exporting, separate pass
+            tracemalloc.start()
+            for data in export(queryset, fmt):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.stdout.write(f"{fmt}: peak memory {peak / 1e6:.1f} MB")
+
+    def bench_wordlist(self, rows, **kwargs):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'words.txt')
+            with open(source, 'w') as f:
+                for i in range(rows):
+                    f.write(f"word{(i * 7919) % rows}\n")
+
+            start = time.perf_counter()
+            entries, checksum = wordlists.compile_file(source, os.path.join(directory, 'words.kwl'))
+            self.report(f"compile ({entries} entries)", rows, time.perf_counter() - start)
+
+            for label, words in (('text', lambda: read_wordlist(source)),
+                                 ('compiled', lambda: wordlists.words(os.path.join(directory, 'words.kwl')))):
+                start = time.perf_counter()
+                count = sum(1 for word in words())
+                self.report(f"read {label}", count, time.perf_counter() - start, unit='words')
+
+                tracemalloc.start()
+                for word in words():
+                    pass
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.stdout.write(f"read {label}: peak memory {peak / 1e6:.2f} MB")
+
+    def bench_http(self, queries, threads, latency, rate, **kwargs):
+        # Every name is served by the same local edge, over HTTP and HTTPS
+        names = [f"host{i}.benchmark.invalid" for i in range(queries)]
+        with StubHTTPServer(names=['*.benchmark.invalid'], latency=latency, process=True) as server:
+            def knock_probe(name):
+                status = HttpStatus(name, timeout=5)
+                status.http_response(f"http://127.0.0.1:{server.http_port}/")
+                status.http_response(f"https://127.0.0.1:{server.https_port}/")
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(knock_probe, names))
+            self.report(f"knock, new connections ({threads} threads)", queries * 2, time.perf_counter() - start, unit='requests')
+
+            async def run():
+                async with HTTPProber(timeout=5, rate=rate or queries * 2, burst=rate or queries * 2) as prober:
+                    await asyncio.gather(*(prober.probe(name, ['127.0.0.1']) for name in names))
+                    return prober
+
+            with override_settings(PROBE_HTTP_PORT=server.http_port, PROBE_HTTPS_PORT=server.https_port):
+                start = time.perf_counter()
+                prober = asyncio.run(run())
+            seconds = time.perf_counter() - start
+            self.report(f"asyncio pooled ({prober.opened} connections)", prober.requests, seconds, unit='requests')
+
+            # Certificates of the knock engine: a handshake per name or per certificate and address
+            with override_settings(PROBE_HTTPS_PORT=server.https_port), ThreadPoolExecutor(max_workers=threads) as executor:
+                start = time.perf_counter()
+                list(executor.map(lambda name: certificates.fetch('127.0.0.1', name, 5), names))
+                self.report("certificates, one handshake per name", queries, time.perf_counter() - start, unit='names')
+
+                certificates.cache.clear()
+                start = time.perf_counter()
+                list(executor.map(lambda name: certificates.certificate_for('127.0.0.1', name, 5), names))
+                self.report(f"certificates, cached ({certificates.cache.misses} handshakes)", queries,
+                            time.perf_counter() - start, unit='names')
+
+    def bench_pipeline(self, queries, concurrency, latency, rate, **kwargs):
+        # A bruteforce scan with the asyncio engine, every name on the same local edge
+        domain = self.create_domain()
+        domain.engine = 'asyncio'
+        domain.recon = False
+        domain.bruteforce = True
+        domain.dns = '127.0.0.1'
+        domain.concurrency = concurrency
+        words = [f"host{i}" for i in range(queries)]
+
+        with tempfile.TemporaryDirectory() as directory, \
+                StubDNSServer(lambda name: ['127.0.0.1'], latency=latency, process=True) as dns_server, \
+                StubHTTPServer(names=['*.benchmark.invalid'], process=True) as http_server:
+            domain.wordlist = os.path.join(directory, 'words.txt')
+            with open(domain.wordlist, 'w') as f:
+                f.write('\n'.join(words))
+
+            stages = {}
+            with override_settings(ASYNC_DNS_PORT=dns_server.port, PROBE_HTTP_PORT=http_server.http_port,
+                                   PROBE_HTTPS_PORT=http_server.https_port,
+                                   HTTP_RATE_PER_IP=rate or queries * 2, HTTP_BURST_PER_IP=rate or queries * 2):
+                start = time.perf_counter()
+                with SubdomainWriter(domain) as writer:
+                    for result in engine.stream(domain, stats=stages):
+                        writer.add(result)
+                self.report("scan", writer.count, time.perf_counter() - start, unit='names')
+
+        for name, stats in stages.items():
+            self.stdout.write(
+                f"  {name:<12} in {stats['in']:>7} out {stats['out']:>7} timeouts {stats['timeouts']:>4} "
+                f"p50 {stats['p50']} p99 {stats['p99']} wall {stats['wall']} s blocked {stats['blocked']} s"
+            )
+
+    def bench_suite(self, scale, repeat, save, baseline, threshold, **kwargs):
+        try:
+            reference = benchmarks.load(baseline) if baseline else None
+            results = benchmarks.Suite(scale, repeat, log=self.stdout.write).run()
+            if save:
+                benchmarks.save(results, save)
+                self.stdout.write(f"baseline written to {save}")
+            if not reference:
+                return
+            rows = benchmarks.compare(reference, results, threshold)
+        except benchmarks.BaselineError as e:
+            raise CommandError(e)
+
+        regressions = []
+        for name, before, now, change, regressed in rows:
+            self.stdout.write(f"{'REGRESSION ' if regressed else ''}{name}: {before * 1000:.1f} ms -> {now * 1000:.1f} ms ({change:+.0%})")
+            if regressed:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s) against {baseline}: {', '.join(regressions)}")
+
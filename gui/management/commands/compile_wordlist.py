@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from gui.models import Wordlist
+from gui.wordlists import compile_wordlist, WordlistError
+
+import os
+
+class Command(BaseCommand):
+    help = 'Compile a wordlist for the bruteforce (normalized, deduplicated, sorted, memory-mapped by the scans)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Wordlist name, created when it does not exist.')
+        parser.add_argument('source', nargs='?', help='Text file, one word per line (default: the current source).')
+
+    def handle(self, *args, **kwargs):
+        wordlist = Wordlist.objects.filter(name=kwargs['name']).first()
+        if kwargs['source']:
+            source = os.path.abspath(kwargs['source'])
+            wordlist = wordlist or Wordlist(name=kwargs['name'])
+            wordlist.source = source
+        elif not wordlist:
+            raise CommandError(f"Unknown wordlist {kwargs['name']}, give its source file")
+
+        try:
+            compile_wordlist(wordlist)
+        except WordlistError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{wordlist.name}: {wordlist.entries} entries, sha256 {wordlist.checksum} ({wordlist.path})")
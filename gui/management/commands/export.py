@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from gui.models import Subdomain
+from gui.admin import filter_params
+from gui.export import export, ExportError, FORMATS
+
+import sys
+
+class Command(BaseCommand):
+    help = 'Stream the subdomains of a domain, a tag or a filter set as CSV, JSONL or Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--domain', help='Domain name.')
+        parser.add_argument('--tag', help='Tag name.')
+        parser.add_argument('--filter', action='append', default=[], metavar='FIELD=VALUE',
+                            help='Changelist filter, e.g. http_status__exact=200 or q=10.0.0.0/24 (repeatable).')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', '-o', help='File to write, standard output by default.')
+        parser.add_argument('--chunk', type=int, default=None)
+
+    def handle(self, *args, **kwargs):
+        params = {}
+        for item in kwargs['filter']:
+            field, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"Invalid filter {item}, expected FIELD=VALUE")
+            params[field] = value
+        if kwargs['domain']:
+            params['domain__name'] = kwargs['domain']
+        if kwargs['tag']:
+            params['domain__tag__name'] = kwargs['tag']
+
+        queryset = filter_params(Subdomain.objects.all(), params, Subdomain)
+        try:
+            content = export(queryset, kwargs['format'], chunk_size=kwargs['chunk'])
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        output = open(kwargs['output'], 'wb') if kwargs['output'] else sys.stdout.buffer
+        try:
+            for data in content:
+                output.write(data)
+        finally:
+            if kwargs['output']:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,45 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from gui.imports import import_domains
+
+import sys
+
+class Command(BaseCommand):
+    help = 'Create the domains listed in a file (one per line) and queue their scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="File with one domain per line, '-' for standard input.")
+        parser.add_argument('--tag', help='Tag of every imported domain (default: one tag per domain).')
+        parser.add_argument('--no-recon', action='store_true')
+        parser.add_argument('--bruteforce', action='store_true')
+        parser.add_argument('--no-wildcard', action='store_true')
+        parser.add_argument('--priority', type=int, default=0)
+        parser.add_argument('--no-scan', action='store_true', help='Create the domains without queuing scans.')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **kwargs):
+        try:
+            lines = sys.stdin if kwargs['file'] == '-' else open(kwargs['file'])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        try:
+            result = import_domains(
+                lines,
+                tag=kwargs['tag'],
+                scan=not kwargs['no_scan'],
+                priority=kwargs['priority'],
+                batch_size=kwargs['batch_size'],
+                recon=not kwargs['no_recon'],
+                bruteforce=kwargs['bruteforce'],
+                wildcard=not kwargs['no_wildcard'],
+            )
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+        for line in result.invalid:
+            self.stderr.write(f"invalid: {line}")
+        self.stdout.write(str(result))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+from gui.schedule import next_due, run_due
+
+import time
+
+class Command(BaseCommand):
+    help = 'Queue the recurring scans of the domains when they are due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, default=settings.SCHEDULE_POLL,
+                            help='Most seconds between two looks at the due domains.')
+        parser.add_argument('--once', action='store_true',
+                            help='Queue the scans due now and exit.')
+
+    def handle(self, *args, **kwargs):
+        while True:
+            queued, skipped = run_due()
+            if queued or skipped:
+                self.stdout.write(f"{timezone.now():%Y-%m-%d %H:%M:%S} queued {queued}, skipped {skipped} (previous scan not finished)")
+            if queued + skipped >= settings.SCHEDULE_BATCH:
+                continue
+            if kwargs['once']:
+                break
+
+            # Sleep until the next due domain, looking again at least every --poll
+            # seconds for the domains scheduled meanwhile from the admin
+            due = next_due()
+            wait = kwargs['poll'] if due is None else (due - timezone.now()).total_seconds()
+            time.sleep(min(kwargs['poll'], max(wait, 0.1)))
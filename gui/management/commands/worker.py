@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections
+from gui.jobs import claim_job, renew_leases, requeue_expired, run_job
+from gui import metrics
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+
+class Command(BaseCommand):
+    help = 'Run the queued scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.SCAN_WORKER_CONCURRENCY,
+                            help='Scans run at the same time by this worker.')
+        parser.add_argument('--poll', type=float, default=settings.SCAN_WORKER_POLL,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty instead of waiting for new jobs.')
+
+    def handle(self, *args, **kwargs):
+        metrics.ACTIVE_WORKERS.inc()
+        try:
+            self.run(max(1, kwargs['concurrency']), kwargs['poll'], kwargs['once'])
+        finally:
+            metrics.ACTIVE_WORKERS.dec()
+
+    def run(self, concurrency, poll, once):
+        def execute(job):
+            try:
+                return run_job(job)
+            finally:
+                # Each pool thread owns its own connection
+                close_old_connections()
+
+        running = {}  # future -> job
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                # Keeps the gauges of this worker alive at /metrics
+                if metrics.enabled():
+                    metrics.store.maybe_flush()
+                requeue_expired()
+                renew_leases([job.id for job in running.values()])
+
+                while len(running) < concurrency:
+                    job = claim_job(limit=settings.SCAN_MAX_RUNNING)
+                    if not job:
+                        break
+                    self.stdout.write(f"[{job.id}] scan {job.domain} (attempt {job.attempts})")
+                    running[executor.submit(execute, job)] = job
+
+                if once and not running:
+                    break
+
+                if running:
+                    done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = running.pop(future)
+                        self.stdout.write(f"[{job.id}] {future.result()}")
+                else:
+                    time.sleep(poll)
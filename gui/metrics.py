@@ -0,0 +1,348 @@
+"""
+Metrics of the scans and of the admin, exported in the Prometheus text format.
+
+Off unless METRICS_ENABLED: every hook first checks the setting, so a
+disabled metric costs one attribute lookup.
+
+Each process keeps its values in memory and writes them to its own file
+under METRICS_DIR, at most every METRICS_FLUSH_INTERVAL seconds. The
+/metrics endpoint adds up the files of every process: counters and
+histograms of processes that have exited are kept, gauges of a process
+are dropped once its file has not been written for METRICS_GAUGE_TTL
+seconds (workers write theirs on each poll).
+
+When a process exits, or when /metrics finds the file of a process that
+is gone (killed), the counters and histograms of its file are added to
+exited.json and the file is removed: the directory holds one file per
+running process, plus that one. This needs fcntl and os.kill (POSIX);
+elsewhere the files are kept.
+
+    DNS_QUERIES.inc('answer')
+    DNS_SECONDS.observe(seconds)
+"""
+from contextlib import contextmanager
+import atexit
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from django.conf import settings
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Counters and histograms of the processes that have exited
+EXITED = 'exited.json'
+
+
+def enabled():
+    return settings.METRICS_ENABLED
+
+
+class Store:
+    """
+    Values of this process: {(metric name, label values): value}, a
+    histogram value being [bucket counts..., sum, count].
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.flushed = time.monotonic()
+        # Not the pid alone: a new process may get the pid of an old one
+        self.process = f"{os.getpid()}-{time.time_ns()}"
+
+    def add(self, metric, labels, amount):
+        with self.lock:
+            key = (metric.name, labels)
+            self.values[key] = self.values.get(key, 0) + amount
+        self.maybe_flush()
+
+    def set(self, metric, labels, value):
+        with self.lock:
+            self.values[(metric.name, labels)] = value
+        self.maybe_flush()
+
+    def observe(self, metric, labels, value):
+        with self.lock:
+            key = (metric.name, labels)
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, f"{self.process}.json")
+
+    def flush(self):
+        """
+        Write the values of this process to its file (atomically).
+        """
+        with self.lock:
+            self.flushed = time.monotonic()
+            values = [[name, list(labels), value] for (name, labels), value in self.values.items()]
+        if not values:
+            return
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = self.path()
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(values, f)
+        os.replace(f"{path}.tmp", path)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+store = Store()
+registry = {}
+
+
+@atexit.register
+def flush_at_exit():
+    if settings.configured and settings.METRICS_ENABLED:
+        store.flush()
+        retire([store.path()])
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        registry[name] = self
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if settings.METRICS_ENABLED:
+            store.add(self, labels, amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        if settings.METRICS_ENABLED:
+            store.add(self, labels, amount)
+
+    def dec(self, *labels, amount=1):
+        if settings.METRICS_ENABLED:
+            store.add(self, labels, -amount)
+
+    def set(self, value, *labels):
+        if settings.METRICS_ENABLED:
+            store.set(self, labels, value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def observe(self, value, *labels):
+        if settings.METRICS_ENABLED:
+            store.observe(self, labels, value)
+
+
+DNS_QUERIES = Counter('knockpy_dns_queries_total', 'DNS lookups by result (answer, nxdomain, timeout, cached).', ['result'])
+DNS_SECONDS = Histogram('knockpy_dns_query_seconds', 'Time to get a DNS answer from the name server.')
+HTTP_PROBES = Counter('knockpy_http_probes_total', 'HTTP/HTTPS probes by scheme and outcome (response, error).', ['scheme', 'outcome'])
+HTTP_SECONDS = Histogram('knockpy_http_probe_seconds', 'Time of an HTTP/HTTPS probe.', ['scheme'])
+DB_BATCHES = Histogram('knockpy_db_write_batch_seconds', 'Time to write a chunk of scan results.')
+DB_ROWS = Counter('knockpy_db_rows_written_total', 'Subdomain rows inserted or updated by the scans.')
+ACTIVE_WORKERS = Gauge('knockpy_active_workers', 'Worker processes running.')
+ACTIVE_SCANS = Gauge('knockpy_active_scans', 'Scans running.')
+ADMIN_SECONDS = Histogram('knockpy_admin_render_seconds', 'Time to build and render an admin view.', ['view'])
+
+
+def timed_view(view_name, response, start):
+    """
+    Observe the render time of an admin view once its template response
+    is rendered (right away for other responses).
+    """
+    if not settings.METRICS_ENABLED:
+        return response
+
+    def observe(rendered):
+        ADMIN_SECONDS.observe(time.perf_counter() - start, view_name)
+
+    if hasattr(response, 'add_post_render_callback') and not response.is_rendered:
+        response.add_post_render_callback(observe)
+    else:
+        observe(response)
+    return response
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # running as another user
+    return True
+
+
+@contextmanager
+def locked():
+    """
+    Hold the lock of METRICS_DIR: one process at a time updates exited.json.
+    """
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.METRICS_DIR, '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def add_values(totals, values, gauges=True):
+    """
+    Add the values of a process file to `totals`; without `gauges` they
+    are left out.
+    """
+    for name, labels, value in values:
+        metric = registry.get(name)
+        if metric is None or (metric.kind == 'gauge' and not gauges):
+            continue
+        key = (name, tuple(labels))
+        if metric.kind == 'histogram':
+            current = totals.setdefault(key, [0] * len(value))
+            for i, count in enumerate(value):
+                current[i] += count
+        else:
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def retire(paths):
+    """
+    Add the counters and histograms of the files of exited processes to
+    exited.json, then remove the files.
+    """
+    if fcntl is None or not paths:
+        return
+    with locked():
+        exited = os.path.join(settings.METRICS_DIR, EXITED)
+        try:
+            with open(exited) as f:
+                totals = add_values({}, json.load(f))
+        except (OSError, ValueError):
+            totals = {}
+        retired = []
+        for path in paths:
+            try:
+                with open(path) as f:
+                    add_values(totals, json.load(f), gauges=False)
+            except (OSError, ValueError):
+                continue  # retired by another process meanwhile
+            retired.append(path)
+        if not retired:
+            return
+        with open(f"{exited}.tmp", 'w') as f:
+            json.dump([[name, list(labels), value] for (name, labels), value in totals.items()], f)
+        os.replace(f"{exited}.tmp", exited)
+        for path in retired:
+            os.remove(path)
+
+
+def prune():
+    """
+    Retire the files of the processes that are gone.
+    """
+    if fcntl is None or not os.path.isdir(settings.METRICS_DIR):
+        return
+    gone = []
+    for entry in os.scandir(settings.METRICS_DIR):
+        pid = entry.name.split('-')[0]
+        if entry.name.endswith('.json') and pid.isdigit() and int(pid) != os.getpid() and not alive(int(pid)):
+            gone.append(entry.path)
+    retire(gone)
+
+
+def read_processes():
+    """
+    Yield (values, live) for the file of every process: live when it was
+    written less than METRICS_GAUGE_TTL seconds ago.
+    """
+    directory = settings.METRICS_DIR
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                values = json.load(f)
+            live = now - entry.stat().st_mtime < settings.METRICS_GAUGE_TTL
+        except (OSError, ValueError):
+            continue  # replaced or removed meanwhile
+        yield values, live
+
+
+def collect():
+    """
+    {(name, label values): value} added up over the processes.
+    """
+    store.flush()
+    prune()
+    totals = {}
+    for values, live in read_processes():
+        add_values(totals, values, gauges=live)
+    return totals
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def exposition(extra=()):
+    """
+    The metrics in the Prometheus text format; `extra` adds gauges computed
+    at scrape time: [(name, help, label names, {label values: value})].
+    """
+    totals = collect()
+    lines = []
+    for name, metric in sorted(registry.items()):
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for (key_name, labels), value in sorted(totals.items()):
+            if key_name != name:
+                continue
+            if metric.kind != 'histogram':
+                lines.append(f"{name}{format_labels(metric.labels, labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, value):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(metric.labels, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(metric.labels, labels, [('le', '+Inf')])} {value[-1]}")
+            lines.append(f"{name}_sum{format_labels(metric.labels, labels)} {value[-2]}")
+            lines.append(f"{name}_count{format_labels(metric.labels, labels)} {value[-1]}")
+    for name, help, label_names, values in extra:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(values.items()):
+            lines.append(f"{name}{format_labels(label_names, labels)} {value}")
+    return '\n'.join(lines) + '\n'
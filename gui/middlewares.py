@@ -32,6 +32,34 @@ menu = """
             margin-right: 15px;
         ">Tag</a>
         |
+        <a href='/admin/gui/wordlist/' style="
+            color: #ffffff;
+            text-decoration: none;
+            margin-left: 15px;
+            margin-right: 15px;
+        ">Wordlists</a>
+        |
+        <a href='/admin/gui/scanjob/' style="
+            color: #ffffff;
+            text-decoration: none;
+            margin-left: 15px;
+            margin-right: 15px;
+        ">Jobs</a>
+        |
+        <a href='/admin/gui/scanrun/' style="
+            color: #ffffff;
+            text-decoration: none;
+            margin-left: 15px;
+            margin-right: 15px;
+        ">Runs</a>
+        |
+        <a href='/admin/gui/agenttoken/' style="
+            color: #ffffff;
+            text-decoration: none;
+            margin-left: 15px;
+            margin-right: 15px;
+        ">Agents</a>
+        |
         <a href='/admin/gui/apikey/' style="
             color: #ffffff;
             text-decoration: none;
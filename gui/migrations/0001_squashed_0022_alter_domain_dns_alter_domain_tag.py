@@ -0,0 +1,107 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+import gui.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    replaces = [
+        ('gui', '0001_initial'),
+        ('gui', '0002_domain_bruteforce_domain_dns_domain_recon_and_more'),
+        ('gui', '0003_alter_domain_threads_alter_domain_timeout'),
+        ('gui', '0004_alter_domain_dns'),
+        ('gui', '0005_domain_completed'),
+        ('gui', '0006_domain_wordlist_path'),
+        ('gui', '0007_alter_domain_wordlist_path'),
+        ('gui', '0008_rename_wordlist_path_domain_wordlist'),
+        ('gui', '0009_domain_wildcard'),
+        ('gui', '0010_alter_domain_threads_alter_domain_timeout'),
+        ('gui', '0011_domain_messages'),
+        ('gui', '0012_alter_domain_messages'),
+        ('gui', '0013_rename_name_subdomain_subdomain'),
+        ('gui', '0014_alter_subdomain_cert_expiration_date_and_more'),
+        ('gui', '0015_rename_subdomain_subdomain_name'),
+        ('gui', '0016_target'),
+        ('gui', '0017_domain_target'),
+        ('gui', '0018_alter_domain_name_alter_domain_target'),
+        ('gui', '0019_apikey_alter_domain_options_alter_subdomain_options_and_more'),
+        ('gui', '0020_alter_subdomain_http_status_and_more'),
+        ('gui', '0021_rename_target_tag_rename_target_domain_tag_and_more'),
+        ('gui', '0022_alter_domain_dns_alter_domain_tag'),
+    ]
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Apikey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('virustotal', models.CharField(max_length=255)),
+                ('shodan', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Domain',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('name', models.CharField(max_length=255, verbose_name='domain name')),
+                ('recon', models.BooleanField(default=True)),
+                ('bruteforce', models.BooleanField(default=False)),
+                ('wildcard', models.BooleanField(default=True)),
+                ('wordlist', models.CharField(blank=True, max_length=255, null=True)),
+                ('dns', models.CharField(blank=True, max_length=255, null=True)),
+                ('useragent', models.CharField(blank=True, max_length=255, null=True)),
+                ('timeout', models.IntegerField(blank=True, default=5, null=True, validators=[gui.models.validate_timeout])),
+                ('threads', models.IntegerField(blank=True, default=10, null=True, validators=[gui.models.validate_threads])),
+                ('messages', models.JSONField(blank=True, null=True)),
+                ('completed', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Subdomain',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('name', models.CharField(max_length=255)),
+                ('ip', models.JSONField()),
+                ('http_status', models.IntegerField(blank=True, null=True)),
+                ('http_redirect', models.CharField(blank=True, max_length=255, null=True)),
+                ('http_server', models.CharField(blank=True, max_length=255, null=True)),
+                ('https_status', models.IntegerField(blank=True, null=True)),
+                ('https_redirect', models.CharField(blank=True, max_length=255, null=True)),
+                ('https_server', models.CharField(blank=True, max_length=255, null=True)),
+                ('cert_status', models.BooleanField(blank=True, null=True)),
+                ('cert_expiration_date', models.DateTimeField(blank=True, null=True)),
+                ('cert_common_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subdomains', to='gui.domain')),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='tag',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='domains', to='gui.tag'),
+        ),
+    ]
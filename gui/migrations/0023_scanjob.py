@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0001_squashed_0022_alter_domain_dns_alter_domain_tag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanJob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('state', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=16)),
+                ('priority', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=3)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='gui.domain')),
+            ],
+            options={
+                'ordering': ('-priority', 'created_at'),
+                'indexes': [models.Index(fields=['state', '-priority', 'created_at'], name='gui_scanjob_state_ee5977_idx'), models.Index(fields=['state', 'lease_expires_at'], name='gui_scanjob_state_82a4c1_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Scans before the constraint stored a name again for each scan of its
+    domain: keep the newest row of each (domain, name).
+    """
+    Subdomain = apps.get_model('gui', 'Subdomain')
+    newest = Subdomain.objects.values('domain', 'name').annotate(newest=Max('id')).values('newest')
+    Subdomain.objects.exclude(id__in=newest).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0023_scanjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subdomain',
+            constraint=models.UniqueConstraint(fields=('domain', 'name'), name='unique_subdomain_per_domain'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import gui.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0024_subdomain_unique_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='concurrency',
+            field=models.IntegerField(blank=True, default=500, null=True, validators=[gui.models.validate_concurrency]),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='engine',
+            field=models.CharField(choices=[('threads', 'threads'), ('asyncio', 'asyncio')], default='threads', max_length=16),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0025_domain_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='incremental',
+            field=models.BooleanField(default=True, help_text='Update changed subdomains and delete the ones that are gone after each scan.'),
+        ),
+        migrations.CreateModel(
+            name='ScanRun',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('state', models.CharField(choices=[('running', 'running'), ('finished', 'finished'), ('failed', 'failed')], default='running', max_length=16)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('added', models.IntegerField(default=0)),
+                ('removed', models.IntegerField(default=0)),
+                ('changed', models.IntegerField(default=0)),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='gui.domain')),
+                ('previous', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gui.scanrun')),
+            ],
+            options={
+                'ordering': ('-started_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ScanObservation',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('digest', models.CharField(max_length=32)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='observations', to='gui.scanrun')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScanChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('added', 'added'), ('removed', 'removed'), ('changed', 'changed')], max_length=16)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='gui.scanrun')),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='scanrun',
+            index=models.Index(fields=['domain', 'state', '-started_at'], name='gui_scanrun_domain__56845e_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='scanobservation',
+            constraint=models.UniqueConstraint(fields=('run', 'name'), name='unique_observation_per_run'),
+        ),
+        migrations.AddIndex(
+            model_name='scanchange',
+            index=models.Index(fields=['run', 'kind', 'name'], name='gui_scancha_run_id_8a9d22_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0026_scan_history'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='domain',
+            name='wildcard',
+            field=models.BooleanField(default=True, help_text='Filter out the results answered by a wildcard DNS record.'),
+        ),
+    ]
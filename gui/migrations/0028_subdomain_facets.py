@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0027_wildcard_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubdomainFacet',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('field', models.CharField(max_length=32)),
+                ('value', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['domain', 'http_status', 'name'], name='gui_subdoma_domain__d55b28_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['domain', 'https_status', 'name'], name='gui_subdoma_domain__cc0223_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['domain', 'cert_status', 'name'], name='gui_subdoma_domain__c9633b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['domain', 'http_server', 'name'], name='gui_subdoma_domain__629b02_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['domain', 'https_server', 'name'], name='gui_subdoma_domain__e2512c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['name'], name='gui_subdoma_name_6b632f_idx'),
+        ),
+        migrations.AddField(
+            model_name='subdomainfacet',
+            name='domain',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='gui.domain'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomainfacet',
+            index=models.Index(fields=['field', 'value'], name='gui_subdoma_field_0a9d8b_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='subdomainfacet',
+            constraint=models.UniqueConstraint(fields=('domain', 'field', 'value'), name='unique_facet_per_domain'),
+        ),
+    ]
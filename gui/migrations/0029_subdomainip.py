@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0028_subdomain_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubdomainIP',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('address', models.BigIntegerField()),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='gui.domain')),
+                ('subdomain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ips', to='gui.subdomain')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['address'], name='gui_subdoma_address_f71be1_idx'), models.Index(fields=['domain', 'address'], name='gui_subdoma_domain__e51db1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('subdomain', 'address'), name='unique_address_per_subdomain')],
+            },
+        ),
+    ]
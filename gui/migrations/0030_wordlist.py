@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0029_subdomainip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Wordlist',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('source', models.CharField(help_text='Path of the text file, one word per line.', max_length=255)),
+                ('path', models.CharField(blank=True, editable=False, max_length=255)),
+                ('entries', models.IntegerField(default=0, editable=False)),
+                ('checksum', models.CharField(blank=True, editable=False, max_length=64)),
+                ('compiled_at', models.DateTimeField(blank=True, editable=False, null=True)),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='wordlist_file',
+            field=models.ForeignKey(blank=True, help_text='Used instead of the wordlist path when set.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='domains', to='gui.wordlist', verbose_name='compiled wordlist'),
+        ),
+    ]
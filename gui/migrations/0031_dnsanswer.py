@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0030_wordlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DNSAnswer',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('zone', models.CharField(max_length=255)),
+                ('nameserver', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=255)),
+                ('ips', models.JSONField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['zone', 'nameserver', 'expires_at'], name='gui_dnsansw_zone_9a64da_idx'), models.Index(fields=['expires_at'], name='gui_dnsansw_expires_571fdb_idx')],
+                'constraints': [models.UniqueConstraint(fields=('nameserver', 'name'), name='unique_dns_answer')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+from collections import defaultdict
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils import timezone
+
+
+def copy_certificates(apps, schema_editor):
+    """
+    Store the certificates described by the old columns of the subdomains,
+    once per (common name, expiration date), and link their subdomains. The
+    fingerprint is derived as gui.certificates.from_knock does, so the next
+    scans of these names find the same rows.
+    """
+    Certificate = apps.get_model('gui', 'Certificate')
+    Subdomain = apps.get_model('gui', 'Subdomain')
+    rows = Subdomain.objects.filter(
+        Q(cert_expiration_date__isnull=False) | Q(cert_common_name__isnull=False),
+    ).values_list('id', 'cert_expiration_date', 'cert_common_name')
+
+    described = {}
+    subdomains = defaultdict(list)
+    for subdomain_id, expiration, common_name in rows.iterator():
+        not_after = timezone.localtime(expiration).strftime('%Y-%m-%d') if expiration else None
+        if not (not_after or common_name):
+            continue
+        fingerprint = hashlib.sha256(f"knock:{common_name}:{not_after}".encode()).hexdigest()
+        described[fingerprint] = (common_name, expiration)
+        subdomains[fingerprint].append(subdomain_id)
+
+    Certificate.objects.bulk_create(
+        [Certificate(fingerprint=fingerprint, common_name=common_name, not_after=expiration)
+         for fingerprint, (common_name, expiration) in described.items()],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    ids = dict(Certificate.objects.filter(fingerprint__in=list(described)).values_list('fingerprint', 'id'))
+    for fingerprint, subdomain_ids in subdomains.items():
+        for start in range(0, len(subdomain_ids), 500):
+            Subdomain.objects.filter(id__in=subdomain_ids[start:start + 500]).update(certificate_id=ids[fingerprint])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0031_dnsanswer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Certificate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64, unique=True)),
+                ('common_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('not_after', models.DateTimeField(blank=True, null=True)),
+                ('sans', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='subdomain',
+            name='certificate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='subdomains', to='gui.certificate'),
+        ),
+        migrations.RunPython(copy_certificates, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='subdomain',
+            name='cert_common_name',
+        ),
+        migrations.RemoveField(
+            model_name='subdomain',
+            name='cert_expiration_date',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0032_certificate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanrun',
+            name='stages',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
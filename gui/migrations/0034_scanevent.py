@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0033_pipeline_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('kind', models.CharField(choices=[('queued', 'queued'), ('started', 'started'), ('stage', 'stage'), ('progress', 'progress'), ('finished', 'finished'), ('failed', 'failed')], max_length=16)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='gui.domain')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0034_scanevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentToken',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('active', models.BooleanField(default=True, help_text='Uncheck to revoke the token.')),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='run',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gui.scanrun'),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='gui.agenttoken'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import gui.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0035_agents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='next_scan_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='scan_interval',
+            field=models.IntegerField(blank=True, help_text='Scan the domain again every this many hours, empty for the interval of its tag.', null=True, validators=[gui.models.validate_scan_interval], verbose_name='scan every (hours)'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='scan_interval',
+            field=models.IntegerField(blank=True, help_text='Scan the domains of the tag again every this many hours, empty for no recurring scan.', null=True, validators=[gui.models.validate_scan_interval], verbose_name='scan every (hours)'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0037_recon_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subdomain',
+            name='cert_expired',
+            field=models.BooleanField(default=False, verbose_name='expired certificate'),
+        ),
+        migrations.AddField(
+            model_name='subdomain',
+            name='cert_mismatch',
+            field=models.BooleanField(default=False, verbose_name='certificate mismatch'),
+        ),
+        migrations.AddField(
+            model_name='subdomain',
+            name='http_only',
+            field=models.BooleanField(default=False, verbose_name='HTTP only'),
+        ),
+        migrations.AddField(
+            model_name='subdomain',
+            name='risk_score',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='risk'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['http_only', 'name'], name='gui_subdoma_http_on_a3d58f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['cert_expired', 'name'], name='gui_subdoma_cert_ex_5d4ff1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['cert_mismatch', 'name'], name='gui_subdoma_cert_mi_a023ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subdomain',
+            index=models.Index(fields=['risk_score', 'name'], name='gui_subdoma_risk_sc_88e9b7_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0038_subdomain_risk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WildcardFingerprint',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('domain', models.CharField(max_length=255, unique=True)),
+                ('ips', models.JSONField()),
+                ('signatures', models.JSONField()),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_ipv4_address
+import hashlib
+import ipaddress
+import secrets
 
 def validate_timeout(value):
     """
@@ -20,6 +23,24 @@ def validate_threads(value):
     if not (9 < value < 31):
         raise ValidationError(f"The value of threads must be between 10 and 30 (exclusive). Provided value: {value}.")
 
+def validate_concurrency(value):
+    """
+    Number of DNS lookups in flight with the asyncio engine
+
+    It is a validator in the 'concurrency' field within the Domain table.
+    """
+    if not (0 < value < 5001):
+        raise ValidationError(f"The value of concurrency must be between 1 and 5000. Provided value: {value}.")
+
+def validate_scan_interval(value):
+    """
+    Hours between two scheduled scans
+
+    It is a validator in the 'scan_interval' field within the Domain and Tag tables.
+    """
+    if value < 1:
+        raise ValidationError(f"The scan interval must be at least 1 hour. Provided value: {value}.")
+
 class Tag(models.Model):
     """
     The tag name is used to label one or more scans.
@@ -30,6 +51,8 @@ class Tag(models.Model):
     """
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255, unique=True)
+    scan_interval = models.IntegerField(blank=True, null=True, validators=[validate_scan_interval], verbose_name='scan every (hours)',
+                                        help_text="Scan the domains of the tag again every this many hours, empty for no recurring scan.")
 
     class Meta:
         ordering = ('name',)
@@ -45,22 +68,62 @@ class Apikey(models.Model):
     def __str__(self):
         return "Apikey"
 
+class Wordlist(models.Model):
+    """
+    A bruteforce wordlist shared by the domains.
+
+    The source file is compiled (normalized, deduplicated, sorted) into a
+    binary file that the scans memory-map (python manage.py compile_wordlist).
+    """
+    id = models.AutoField(primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    name = models.CharField(max_length=255, unique=True)
+    source = models.CharField(max_length=255, help_text="Path of the text file, one word per line.")
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    entries = models.IntegerField(default=0, editable=False)
+    checksum = models.CharField(max_length=64, blank=True, editable=False)
+    compiled_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    class Meta:
+        ordering = ('name',)
+
+    def __str__(self):
+        return self.name
+
 class Domain(models.Model):
     """
     It contains all the information about the domain name to be scanned.
+
+    The engine selects how names are resolved:
+    threads: knock resolves and probes each name in one of the 'threads' threads
+    asyncio: up to 'concurrency' DNS lookups in flight, then pooled asyncio HTTP probes
     """
+    ENGINES = (
+        ('threads', 'threads'),
+        ('asyncio', 'asyncio'),
+    )
+
     id = models.AutoField(primary_key=True)
     created_at = models.DateTimeField(auto_now_add=True)
     name = models.CharField(max_length=255, verbose_name='domain name')
     recon = models.BooleanField(default=True)
     bruteforce = models.BooleanField(default=False)
-    wildcard = models.BooleanField(default=True)
+    wildcard = models.BooleanField(default=True, help_text="Filter out the results answered by a wildcard DNS record.")
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE, blank=True, null=True, related_name='domains')
     wordlist = models.CharField(max_length=255, blank=True, null=True)
+    wordlist_file = models.ForeignKey(Wordlist, on_delete=models.SET_NULL, blank=True, null=True, related_name='domains',
+                                      verbose_name='compiled wordlist', help_text="Used instead of the wordlist path when set.")
     dns = models.CharField(max_length=255, blank=True, null=True)
     useragent = models.CharField(max_length=255, blank=True, null=True)
     timeout = models.IntegerField(default=5, blank=True, null=True, validators=[validate_timeout])
     threads = models.IntegerField(default=10, blank=True, null=True, validators=[validate_threads])
+    engine = models.CharField(max_length=16, choices=ENGINES, default='threads')
+    concurrency = models.IntegerField(default=500, blank=True, null=True, validators=[validate_concurrency])
+    incremental = models.BooleanField(default=True, help_text="Update changed subdomains and delete the ones that are gone after each scan.")
+    scan_interval = models.IntegerField(blank=True, null=True, validators=[validate_scan_interval], verbose_name='scan every (hours)',
+                                        help_text="Scan the domain again every this many hours, empty for the interval of its tag.")
+    # Set by gui.schedule, read in this order by the scheduler
+    next_scan_at = models.DateTimeField(blank=True, null=True, db_index=True, editable=False)
     messages = models.JSONField(blank=True, null=True)
     completed = models.BooleanField(default=False)
 
@@ -88,6 +151,20 @@ class Domain(models.Model):
     def __str__(self):
         return self.name
 
+class Certificate(models.Model):
+    """
+    A TLS certificate served to the subdomains, stored once per sha256
+    fingerprint of its DER encoding.
+    """
+    fingerprint = models.CharField(max_length=64, unique=True)
+    common_name = models.CharField(max_length=255, blank=True, null=True)
+    not_after = models.DateTimeField(blank=True, null=True)
+    sans = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.common_name or self.fingerprint[:16]
+
 class Subdomain(models.Model):
     """
     Show all scanned subdomains, you can filter by:
@@ -107,13 +184,354 @@ class Subdomain(models.Model):
     https_status = models.IntegerField(blank=True, null=True)
     https_redirect = models.CharField(max_length=255, blank=True, null=True)
     https_server = models.CharField(max_length=255, blank=True, null=True)
+    # Validity for this name; the certificate itself is shared
     cert_status = models.BooleanField(blank=True, null=True)
-    cert_expiration_date = models.DateTimeField(blank=True, null=True)
-    cert_common_name = models.CharField(max_length=255, blank=True, null=True)
+    certificate = models.ForeignKey(Certificate, on_delete=models.SET_NULL, blank=True, null=True, related_name='subdomains')
     domain = models.ForeignKey(Domain, on_delete=models.CASCADE, related_name='subdomains')
+    # Risk flags (gui.risk), set when the result is written
+    http_only = models.BooleanField(default=False, verbose_name='HTTP only')
+    cert_expired = models.BooleanField(default=False, verbose_name='expired certificate')
+    cert_mismatch = models.BooleanField(default=False, verbose_name='certificate mismatch')
+    risk_score = models.PositiveSmallIntegerField(default=0, verbose_name='risk')
 
     class Meta:
         ordering = ('name',)
+        constraints = [
+            # Lets the ingestion skip duplicates in the database
+            models.UniqueConstraint(fields=['domain', 'name'], name='unique_subdomain_per_domain'),
+        ]
+        # The changelist filters a domain on one of these fields, ordered by name
+        indexes = [
+            models.Index(fields=['domain', 'http_status', 'name']),
+            models.Index(fields=['domain', 'https_status', 'name']),
+            models.Index(fields=['domain', 'cert_status', 'name']),
+            models.Index(fields=['domain', 'http_server', 'name']),
+            models.Index(fields=['domain', 'https_server', 'name']),
+            models.Index(fields=['name']),
+            # Triage across the domains: one risk, or the riskiest first
+            models.Index(fields=['http_only', 'name']),
+            models.Index(fields=['cert_expired', 'name']),
+            models.Index(fields=['cert_mismatch', 'name']),
+            models.Index(fields=['risk_score', 'name']),
+        ]
+
+    @property
+    def cert_expiration_date(self):
+        return self.certificate.not_after if self.certificate else None
+
+    @property
+    def cert_common_name(self):
+        return self.certificate.common_name if self.certificate else None
 
     def __str__(self):
         return self.name
+
+class AgentToken(models.Model):
+    """
+    Credentials of a remote scan agent (python -m gui.agent).
+
+    Only the sha256 of the token is stored: the token is shown once, when
+    it is created (python manage.py agent_token NAME).
+    """
+    id = models.AutoField(primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    name = models.CharField(max_length=255, unique=True)
+    digest = models.CharField(max_length=64, unique=True)
+    active = models.BooleanField(default=True, help_text="Uncheck to revoke the token.")
+    last_seen_at = models.DateTimeField(blank=True, null=True)
+
+    @staticmethod
+    def hash(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def new_token(self):
+        """
+        Replace the token of the agent (not saved); returns the token.
+        """
+        token = secrets.token_urlsafe(32)
+        self.digest = self.hash(token)
+        return token
+
+    @classmethod
+    def create(cls, name):
+        """
+        (agent, token) for a new agent.
+        """
+        agent = cls(name=name)
+        token = agent.new_token()
+        agent.save()
+        return agent, token
+
+    def __str__(self):
+        return self.name
+
+class ScanJob(models.Model):
+    """
+    A scan waiting in the queue or being run by a worker (manage.py worker).
+
+    Jobs are claimed by priority (highest first), then by age.
+    A running job holds a lease that the worker renews; when the lease
+    expires (e.g. the worker was restarted) the job goes back to the queue
+    until max_attempts is reached.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+
+    id = models.AutoField(primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    domain = models.ForeignKey(Domain, on_delete=models.CASCADE, related_name='jobs')
+    state = models.CharField(max_length=16, choices=STATES, default=QUEUED)
+    priority = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    error = models.TextField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    # Remote agent holding the job, and the run it writes to (agents only)
+    agent = models.ForeignKey(AgentToken, on_delete=models.SET_NULL, blank=True, null=True, related_name='jobs')
+    run = models.ForeignKey('ScanRun', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+
+    class Meta:
+        ordering = ('-priority', 'created_at')
+        indexes = [
+            models.Index(fields=['state', '-priority', 'created_at']),
+            models.Index(fields=['state', 'lease_expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.domain} ({self.state})"
+
+class ScanEvent(models.Model):
+    """
+    A step of the scan of a domain, pushed to the open admin pages (gui.events).
+
+    The id orders the events: browsers resume their stream after the last
+    id they received.
+    """
+    QUEUED = 'queued'
+    STARTED = 'started'
+    STAGE = 'stage'
+    PROGRESS = 'progress'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    KINDS = (
+        (QUEUED, 'queued'),
+        (STARTED, 'started'),
+        (STAGE, 'stage'),
+        (PROGRESS, 'progress'),
+        (FINISHED, 'finished'),
+        (FAILED, 'failed'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    domain = models.ForeignKey(Domain, on_delete=models.CASCADE, related_name='events')
+    kind = models.CharField(max_length=16, choices=KINDS)
+    data = models.JSONField(default=dict, blank=True)
+
+    def __str__(self):
+        return f"{self.domain} {self.kind}"
+
+class SubdomainIP(models.Model):
+    """
+    One IPv4 address of a subdomain, stored as an integer so that exact,
+    CIDR range and reverse (IP to subdomains) lookups use an index.
+
+    The domain is copied from the subdomain to look up the addresses of a
+    domain without a join.
+    """
+    id = models.BigAutoField(primary_key=True)
+    subdomain = models.ForeignKey(Subdomain, on_delete=models.CASCADE, related_name='ips')
+    domain = models.ForeignKey(Domain, on_delete=models.CASCADE, related_name='+')
+    address = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subdomain', 'address'], name='unique_address_per_subdomain'),
+        ]
+        indexes = [
+            models.Index(fields=['address']),
+            models.Index(fields=['domain', 'address']),
+        ]
+
+    @property
+    def ip(self):
+        return str(ipaddress.IPv4Address(self.address))
+
+    def __str__(self):
+        return self.ip
+
+class ScanRun(models.Model):
+    """
+    One run of the scan of a domain.
+
+    Every run keeps an observation (name and digest of the result) of each
+    subdomain found, and the changes against the previous finished run:
+    added, removed and changed subdomains.
+    """
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATES = (
+        (RUNNING, 'running'),
+        (FINISHED, 'finished'),
+        (FAILED, 'failed'),
+    )
+
+    id = models.AutoField(primary_key=True)
+    domain = models.ForeignKey(Domain, on_delete=models.CASCADE, related_name='runs')
+    previous = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    state = models.CharField(max_length=16, choices=STATES, default=RUNNING)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    count = models.IntegerField(default=0)
+    added = models.IntegerField(default=0)
+    removed = models.IntegerField(default=0)
+    changed = models.IntegerField(default=0)
+    # Statistics of the pipeline stages: {stage: {in, out, timeouts, p50, p90, p99, wall, ...}}
+    stages = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ('-started_at',)
+        indexes = [
+            models.Index(fields=['domain', 'state', '-started_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.domain} #{self.id}"
+
+class ScanObservation(models.Model):
+    """
+    A subdomain as seen by a run; the digest covers ip, http, https and cert.
+    """
+    id = models.BigAutoField(primary_key=True)
+    run = models.ForeignKey(ScanRun, on_delete=models.CASCADE, related_name='observations')
+    name = models.CharField(max_length=255)
+    digest = models.CharField(max_length=32)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'name'], name='unique_observation_per_run'),
+        ]
+
+class ScanChange(models.Model):
+    """
+    A subdomain added, removed or changed by a run.
+    """
+    ADDED = 'added'
+    REMOVED = 'removed'
+    CHANGED = 'changed'
+    KINDS = (
+        (ADDED, 'added'),
+        (REMOVED, 'removed'),
+        (CHANGED, 'changed'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    run = models.ForeignKey(ScanRun, on_delete=models.CASCADE, related_name='changes')
+    name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=16, choices=KINDS)
+
+    class Meta:
+        ordering = ('name',)
+        indexes = [
+            models.Index(fields=['run', 'kind', 'name']),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class SubdomainFacet(models.Model):
+    """
+    Number of subdomains of a domain per value of a filtered field.
+
+    The choices and counts of the Subdomain filters are read from here
+    instead of a DISTINCT over the whole Subdomain table; the rows of a
+    domain are refreshed when its results are ingested.
+    """
+    id = models.BigAutoField(primary_key=True)
+    domain = models.ForeignKey(Domain, on_delete=models.CASCADE, related_name='facets')
+    field = models.CharField(max_length=32)
+    value = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['domain', 'field', 'value'], name='unique_facet_per_domain'),
+        ]
+        indexes = [
+            models.Index(fields=['field', 'value']),
+        ]
+
+class DNSAnswer(models.Model):
+    """
+    Persistent tier of the DNS cache, shared by the worker processes.
+
+    `ips` is null for a negative answer (NXDOMAIN or no address). `zone` is
+    the scanned domain, so a scan loads the answers of its zone at once.
+    """
+    id = models.BigAutoField(primary_key=True)
+    zone = models.CharField(max_length=255)
+    nameserver = models.CharField(max_length=64)
+    name = models.CharField(max_length=255)
+    ips = models.JSONField(blank=True, null=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['nameserver', 'name'], name='unique_dns_answer'),
+        ]
+        indexes = [
+            models.Index(fields=['zone', 'nameserver', 'expires_at']),
+            models.Index(fields=['expires_at']),
+        ]
+
+class ReconAnswer(models.Model):
+    """
+    Persistent cache of the passive recon sources (gui.recon), shared by the
+    worker processes: the names answered by `source` for the domain.
+    """
+    id = models.BigAutoField(primary_key=True)
+    source = models.CharField(max_length=32)
+    domain = models.CharField(max_length=255)
+    names = models.JSONField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['domain', 'source'], name='unique_recon_answer'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+class RateBucket(models.Model):
+    """
+    Token bucket of an API key (gui.recon), shared by the worker processes.
+
+    `key` is the source and a digest of the API key, never the key itself;
+    `updated_at` is the time (epoch seconds) of the last refill.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.FloatField()
+
+class WildcardFingerprint(models.Model):
+    """
+    Wildcard fingerprint of a domain name (gui.wildcard), shared by the
+    worker processes: the addresses and HTTP signatures of its wildcard.
+    """
+    id = models.BigAutoField(primary_key=True)
+    domain = models.CharField(max_length=255, unique=True)
+    ips = models.JSONField()
+    signatures = models.JSONField()
+    expires_at = models.DateTimeField()
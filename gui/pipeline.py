@@ -0,0 +1,241 @@
+"""
+Staged scan pipeline.
+
+A scan is a chain of stages connected by bounded asyncio queues:
+
+    recon, bruteforce (sources) -> resolve -> http -> certificate -> write
+
+Every stage has its own number of workers and a timeout per item
+(SCAN_STAGES). A worker waits when the queue of the next stage is full
+(SCAN_QUEUE_PER_WORKER items per worker of that stage), so a slow stage
+holds back the ones before it instead of piling up work. Blocking stages
+(knock probes, TLS handshakes, writing) run in a thread pool of their own,
+the others on the event loop.
+
+Each stage records its items in and out, its timeouts, the percentiles of
+the time spent on an item (over a sample), its wall time and the time it
+was blocked by the next stage; the scan stores them with its run.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import random
+import time
+
+from django.conf import settings
+
+DONE = object()
+
+# Names read from a source per trip to its thread
+SOURCE_BATCH = 256
+
+
+def take(iterator, count):
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= count:
+            break
+    return batch
+
+
+def slowest_stage(stages):
+    """
+    (name, wall time) of the stage that ran the longest in the statistics
+    of a pipeline, sources excluded; None without any.
+    """
+    timed = [(stats['wall'], name) for name, stats in stages.items() if stats.get('p50') is not None]
+    if not timed:
+        return None
+    wall, name = max(timed)
+    return name, wall
+
+
+class StageStats:
+    """
+    Counters of a stage and a sample of the time spent on its items.
+    """
+    SAMPLES = 10000
+
+    def __init__(self, name, workers=None, timeout=None):
+        self.name = name
+        self.workers = workers
+        self.timeout = timeout
+        self.received = 0
+        self.sent = 0
+        self.timeouts = 0
+        self.blocked = 0.0
+        self.started = None
+        self.finished = None
+        self.latencies = []
+        self.random = random.Random(0)
+
+    def begin(self):
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def record(self, seconds):
+        self.finished = time.monotonic()
+        if seconds is None:
+            return
+        # Reservoir sample: memory stays flat on long scans
+        if len(self.latencies) < self.SAMPLES:
+            self.latencies.append(seconds)
+        else:
+            i = self.random.randrange(self.received)
+            if i < self.SAMPLES:
+                self.latencies[i] = seconds
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4)
+
+        return {
+            "workers": self.workers,
+            "timeout": self.timeout,
+            "in": self.received,
+            "out": self.sent,
+            "timeouts": self.timeouts,
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": round(latencies[-1], 4) if latencies else None,
+            "wall": round(self.finished - self.started, 3) if self.finished else 0,
+            "blocked": round(self.blocked, 3),
+        }
+
+
+class Stage:
+    """
+    A step of the pipeline: `work(item)` returns the item passed to the next
+    stage, or None to drop it. `work` is a coroutine function, or a plain
+    function run in a pool of `workers` threads when `blocking`.
+
+    An item over `timeout` seconds is dropped. A blocking one keeps its
+    worker until its thread returns, threads cannot be interrupted.
+    """
+    def __init__(self, name, work, workers, timeout=None, blocking=False):
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.timeout = timeout
+        self.blocking = blocking
+        self.executor = None
+        self.stats = StageStats(name, workers, timeout)
+
+    @classmethod
+    def configured(cls, name, work, workers, blocking=False):
+        """
+        A stage with the SCAN_STAGES settings of `name`; `workers` is used
+        when they do not set it.
+        """
+        config = settings.SCAN_STAGES.get(name, {})
+        return cls(name, work, config.get('workers') or workers, config.get('timeout'), blocking)
+
+    async def call(self, item):
+        if not self.blocking:
+            return await self.work(item)
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self.work, item)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+
+class Pipeline:
+    """
+    Run `sources` ([(name, iterable of items)], read one after the other in
+    a thread) through `stages`:
+
+        await Pipeline([('names', names)], [Stage('resolve', resolve, 100)]).run()
+    """
+    def __init__(self, sources, stages, queue_per_worker=None):
+        self.sources = [(StageStats(name), items) for name, items in sources]
+        self.stages = stages
+        self.queue_per_worker = queue_per_worker or settings.SCAN_QUEUE_PER_WORKER
+
+    def stats(self):
+        return {stats.name: stats.summary() for stats in [s for s, _ in self.sources] + [s.stats for s in self.stages]}
+
+    async def put(self, queue, item, stats):
+        if queue.full():
+            start = time.monotonic()
+            await queue.put(item)
+            stats.blocked += time.monotonic() - start
+        else:
+            queue.put_nowait(item)
+
+    async def feed(self, output, downstream):
+        loop = asyncio.get_running_loop()
+        for stats, items in self.sources:
+            stats.begin()
+            iterator = iter(items)
+            while True:
+                batch = await loop.run_in_executor(None, take, iterator, SOURCE_BATCH)
+                if not batch:
+                    break
+                for item in batch:
+                    stats.received += 1
+                    stats.sent += 1
+                    await self.put(output, item, stats)
+                stats.record(None)
+            stats.record(None)
+        for _ in range(downstream):
+            await output.put(DONE)
+
+    async def worker(self, stage, input, output, remaining, downstream):
+        stats = stage.stats
+        while True:
+            item = await input.get()
+            if item is DONE:
+                break
+            stats.begin()
+            stats.received += 1
+            start = time.monotonic()
+            try:
+                item = await asyncio.wait_for(stage.call(item), stage.timeout)
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                item = None
+            stats.record(time.monotonic() - start)
+            if item is not None:
+                stats.sent += 1
+                if output is not None:
+                    await self.put(output, item, stats)
+
+        # The last worker of a stage ends the next one
+        remaining[stage.name] -= 1
+        if remaining[stage.name] == 0 and output is not None:
+            for _ in range(downstream):
+                await output.put(DONE)
+
+    async def run(self):
+        queues = [asyncio.Queue(maxsize=stage.workers * self.queue_per_worker) for stage in self.stages]
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        for stage in self.stages:
+            if stage.blocking:
+                stage.executor = ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=f"scan-{stage.name}")
+
+        tasks = [asyncio.create_task(self.feed(queues[0], self.stages[0].workers))]
+        for i, stage in enumerate(self.stages):
+            last = i == len(self.stages) - 1
+            output = None if last else queues[i + 1]
+            downstream = 0 if last else self.stages[i + 1].workers
+            for _ in range(stage.workers):
+                tasks.append(asyncio.create_task(self.worker(stage, queues[i], output, remaining, downstream)))
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            for stage in self.stages:
+                if stage.executor:
+                    stage.executor.shutdown(wait=False, cancel_futures=True)
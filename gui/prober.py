@@ -0,0 +1,420 @@
+"""
+Asyncio HTTP/HTTPS probes used by the 'asyncio' scan engine.
+
+The probes answer the same (status, redirect, server) tuples and
+certificate triple as the knock probes, with:
+- keep-alive connections kept in a pool per (address, port, TLS name), at
+  most HTTP_CONNECTIONS_PER_HOST each, so the subdomains served by the same
+  edge reuse its connections. At most HTTP_IDLE_CONNECTIONS stay idle per
+  scan, the least recently used are closed first, and none is kept longer
+  than HTTP_IDLE_TIMEOUT seconds. A name covered by a certificate already
+  seen on the address (certificate cache) is requested over HTTPS with the
+  TLS name that certificate was fetched with, so the names behind an edge
+  serving a wildcard certificate share its HTTPS connections too; an
+  address answering 421 (Misdirected Request) gets the SNI of each name;
+- a budget of HTTP_CONCURRENCY requests in flight;
+- a token bucket per IP address (HTTP_RATE_PER_IP requests per second,
+  bursts of HTTP_BURST_PER_IP), so that a CDN edge shared by thousands of
+  names is not hammered.
+
+The budget and the buckets are shared by all the scans of a process
+(shared_limits), each running in its own thread and event loop.
+
+The certificate is read from the HTTPS connection itself instead of a
+second handshake, and stored in the certificate cache (gui.certificates).
+Requests are plain HTTP/1.1 written on asyncio streams.
+"""
+import asyncio
+from collections import OrderedDict, deque
+import random
+import ssl
+import threading
+import time
+
+from django.conf import settings
+from knock.knockpy import user_agent
+
+from . import certificates, metrics
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, at most `burst` saved up. A request reserves
+    its token, then sleeps until the token is there; thread-safe, so the
+    event loops of several scans can share it.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token: the seconds until it is there.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0, -self.tokens / self.rate)
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class Limiter:
+    """
+    Semaphore shared by the event loops of a process. A released slot is
+    handed to the oldest waiter, in its own loop.
+    """
+    def __init__(self, value):
+        self.value = value
+        self.lock = threading.Lock()
+        self.waiters = deque()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    async def acquire(self):
+        with self.lock:
+            if self.value and not self.waiters:
+                self.value -= 1
+                return
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                waiting = future in self.waiters
+                if waiting:
+                    self.waiters.remove(future)
+            # The slot was handed over just before the cancellation
+            if not waiting and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def grant(self, future):
+        # In the loop of the waiter, where it can be cancelled meanwhile
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self.lock:
+            while self.waiters:
+                future = self.waiters.popleft()
+                try:
+                    future.get_loop().call_soon_threadsafe(self.grant, future)
+                    return
+                except RuntimeError:
+                    continue  # its loop is closed
+            self.value += 1
+
+
+class Limits:
+    """
+    Requests in flight and token buckets per IP address.
+    """
+    def __init__(self, concurrency, rate, burst):
+        self.requests = Limiter(concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # ip -> TokenBucket
+        self.lock = threading.Lock()
+        self.prune_at = 1024
+
+    def bucket(self, ip):
+        with self.lock:
+            bucket = self.buckets.get(ip)
+            if bucket is None:
+                if len(self.buckets) >= self.prune_at:
+                    # A full bucket is the same as a new one
+                    now = time.monotonic()
+                    self.buckets = {ip: bucket for ip, bucket in self.buckets.items() if not bucket.full(now)}
+                    self.prune_at = max(1024, 2 * len(self.buckets))
+                bucket = self.buckets[ip] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_limits():
+    """
+    The limits of the process, from HTTP_CONCURRENCY, HTTP_RATE_PER_IP and
+    HTTP_BURST_PER_IP.
+    """
+    key = (settings.HTTP_CONCURRENCY, settings.HTTP_RATE_PER_IP, settings.HTTP_BURST_PER_IP)
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = Limits(*key)
+        return _shared[key]
+
+
+class ResponseError(Exception):
+    pass
+
+
+class Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @property
+    def usable(self):
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def certificate(self):
+        ssl_object = self.writer.get_extra_info('ssl_object')
+        return ssl_object.getpeercert(binary_form=True) if ssl_object else None
+
+    def close(self):
+        self.writer.close()
+
+
+class HTTPProber:
+    """
+    Probe names over HTTP and HTTPS with pooled connections.
+
+        async with HTTPProber(timeout=5) as prober:
+            result = await prober.probe('www.example.com', ['93.184.216.34'])
+
+    Probers share the limits of the process, unless given their own
+    `concurrency`, `rate` or `burst`.
+    """
+    def __init__(self, timeout=5, useragent=None, concurrency=None, rate=None, burst=None, resolve=None):
+        self.timeout = timeout
+        self.useragent = useragent
+        if concurrency or rate or burst:
+            self.limits = Limits(
+                concurrency or settings.HTTP_CONCURRENCY,
+                rate or settings.HTTP_RATE_PER_IP,
+                burst or settings.HTTP_BURST_PER_IP,
+            )
+        else:
+            self.limits = shared_limits()
+        self.resolve = resolve
+        self.ports = {'http': settings.PROBE_HTTP_PORT, 'https': settings.PROBE_HTTPS_PORT}
+        self.pools = {}  # (ip, port, tls name) -> [idle Connection]
+        self.idle = OrderedDict()  # idle Connection -> (key, released at), oldest first
+        self.slots = {}  # (ip, port, tls name) -> Semaphore
+        self.strict = set()  # addresses answering 421 to a shared TLS name
+        self.context = ssl.create_default_context()
+        self.context.check_hostname = False
+        self.context.verify_mode = ssl.CERT_NONE
+        self.opened = 0
+        self.requests = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle.clear()
+        self.pools.clear()
+
+    async def connect(self, key):
+        """
+        (connection, reused): an idle connection of the pool or a new one.
+        """
+        pool = self.pools.get(key)
+        while pool:
+            connection = pool.pop()
+            released = self.idle.pop(connection)[1]
+            if not pool:
+                del self.pools[key]
+            if connection.usable and time.monotonic() - released < settings.HTTP_IDLE_TIMEOUT:
+                return connection, True
+            connection.close()
+
+        ip, port, tls_name = key
+        reader, writer = await asyncio.open_connection(
+            ip, port,
+            ssl=self.context if tls_name else None,
+            server_hostname=tls_name,
+            limit=2 ** 16,
+        )
+        self.opened += 1
+        return Connection(reader, writer), False
+
+    def release(self, key, connection):
+        if not connection.usable:
+            connection.close()
+            return
+        now = time.monotonic()
+        self.idle[connection] = (key, now)
+        self.pools.setdefault(key, []).append(connection)
+
+        # Oldest first: over the cap, or idle for longer than servers keep them
+        while self.idle:
+            connection, (key, released) = next(iter(self.idle.items()))
+            if len(self.idle) <= settings.HTTP_IDLE_CONNECTIONS and now - released < settings.HTTP_IDLE_TIMEOUT:
+                break
+            del self.idle[connection]
+            pool = self.pools[key]
+            pool.remove(connection)
+            if not pool:
+                del self.pools[key]
+            connection.close()
+
+    def host_slot(self, key):
+        if key not in self.slots:
+            self.slots[key] = asyncio.Semaphore(settings.HTTP_CONNECTIONS_PER_HOST)
+        return self.slots[key]
+
+    async def read_response(self, reader):
+        """
+        (status, headers, keep alive) of a response, its body drained.
+        """
+        status_line = await reader.readline()
+        parts = status_line.decode('latin-1').split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise ResponseError(f"invalid status line {status_line[:50]!r}")
+        status = int(parts[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            field, _, value = line.decode('latin-1').partition(':')
+            headers[field.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and parts[0] != 'HTTP/1.0'
+        if status < 200 or status in (204, 304):
+            return status, headers, keep_alive
+
+        # The body is discarded; a large one is cheaper to drop with the connection
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            read = 0
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                read += size
+                if read > settings.HTTP_MAX_BODY:
+                    return status, headers, False
+                await reader.readexactly(size + 2)
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length > settings.HTTP_MAX_BODY:
+                return status, headers, False
+            await reader.readexactly(length)
+        else:
+            keep_alive = False
+        return status, headers, keep_alive
+
+    async def exchange(self, key, name):
+        """
+        GET / on a pooled connection: (connection, status, headers, keep alive).
+        """
+        connection, reused = await self.connect(key)
+        try:
+            connection.writer.write((
+                f"GET / HTTP/1.1\r\n"
+                f"Host: {name}\r\n"
+                f"User-Agent: {self.useragent or random.choice(user_agent)}\r\n"
+                f"Accept: */*\r\n"
+                f"Connection: keep-alive\r\n\r\n"
+            ).encode())
+            await connection.writer.drain()
+            return (connection, *await self.read_response(connection.reader))
+        except (OSError, asyncio.IncompleteReadError, ResponseError):
+            connection.close()
+            if not reused:
+                raise
+        except BaseException:
+            connection.close()
+            raise
+        # The server closed the idle connection meanwhile
+        return await self.exchange(key, name)
+
+    async def request(self, scheme, name, ip):
+        """
+        ((status, redirect, server), certificate) of GET / on the name, or
+        ((None, None, None), None) when it does not answer.
+        """
+        await self.limits.bucket(ip).acquire()
+        async with self.limits.requests:
+            # Chosen once the request can be sent: the certificate of the
+            # address may have been seen meanwhile
+            tls_name = None
+            if scheme == 'https':
+                tls_name = name if ip in self.strict else certificates.cache.tls_name(ip, name)
+            key = (ip, self.ports[scheme], tls_name)
+            async with self.host_slot(key):
+                start = time.perf_counter()
+                try:
+                    connection, status, headers, keep_alive = await asyncio.wait_for(self.exchange(key, name), self.timeout)
+                except (OSError, asyncio.TimeoutError, ValueError, ssl.SSLError, asyncio.IncompleteReadError, ResponseError):
+                    metrics.HTTP_PROBES.inc(scheme, 'error')
+                    return (None, None, None), None
+
+                metrics.HTTP_SECONDS.observe(time.perf_counter() - start, scheme)
+                metrics.HTTP_PROBES.inc(scheme, 'response')
+                self.requests += 1
+                certificate = connection.certificate()
+                if keep_alive:
+                    self.release(key, connection)
+                else:
+                    connection.close()
+
+        if status == 421 and tls_name != name:
+            # Misdirected: the server wants the SNI of each name
+            self.strict.add(ip)
+            return await self.request(scheme, name, ip)
+        return (status, headers.get('location'), headers.get('server')), certificate
+
+    async def probe(self, name, ips):
+        """
+        The knock result of a resolved name: ip, http, https and cert.
+        """
+        result = await self.probe_http(name, ips)
+        result["cert"] = list(certificates.status(result["certificate"], name))
+        return result
+
+    async def probe_http(self, name, ips):
+        """
+        ip, http and https of a resolved name, and the certificate read from
+        its HTTPS connection (None without one).
+        """
+        ip = ips[0]
+        http, _ = await self.request('http', name, ip)
+        https, certificate = await self.request('https', name, ip)
+
+        # Same fallback as knock: HTTPS on the host of the HTTP redirect
+        if http[0] and http[1] and not https[0]:
+            location = http[1]
+            if not location.startswith(('http://', 'https://')):
+                location = 'http://' + location
+            host = location.split('://')[1].split('/')[0]
+            redirect_ips = ips if host == name else (await self.resolve(host) if self.resolve else None)
+            if redirect_ips:
+                https, _ = await self.request('https', host, redirect_ips[0])
+
+        described = None
+        if https[0] and certificate:
+            described = certificates.describe(certificate)
+            if described:
+                certificates.cache.put(ip, name, described)
+        return {"domain": name, "ip": ips, "http": list(http), "https": list(https), "certificate": described}
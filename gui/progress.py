@@ -0,0 +1,95 @@
+import time
+
+from django.conf import settings
+
+from .facets import refresh_facets
+from .history import start_run, finish_run, fail_run
+from .models import Domain, ScanEvent
+from .pipeline import slowest_stage
+from . import events, writes
+
+
+def start_scan(domain, **data):
+    """
+    Open the run of a scan and reset the counters of the domain; returns
+    (run, messages). `data` is added to the started event.
+    """
+    events.prune()
+    run = start_run(domain)
+    events.publish(domain.id, ScanEvent.STARTED, run=run.id, **data)
+    messages = {"wildcard": False, "filtered": 0, "finished": False, "count": 0, "rate": "0.0", "time": 0}
+    writes.write(Domain.objects.filter(id=domain.id).update, messages=messages, completed=False)
+    return run, messages
+
+
+def finish_scan(domain, run, messages, stages=None):
+    """
+    Close the run of a scan: record its changes, refresh the facets and
+    publish the final counters of the domain.
+    """
+    events.publish(domain.id, ScanEvent.STAGE, stage='history')
+    # Subdomains that are gone are only pruned after a complete scan
+    run = finish_run(run, prune=domain.incremental and messages["finished"], stages=stages)
+    refresh_facets(domain)
+    messages.update({"run": run.id, "added": run.added, "removed": run.removed, "changed": run.changed,
+                     "slowest": slowest_stage(stages or {})})
+
+    domain.messages = messages
+    domain.completed = True
+    writes.write(domain.save, update_fields=['messages', 'completed'])
+    events.publish(domain.id, ScanEvent.FINISHED, **messages)
+    return run
+
+
+def fail_scan(domain, run, error, stages=None):
+    """
+    Close the run of a failed scan and leave the error in the status of
+    the domain.
+    """
+    fail_run(run, stages)
+    fail_domain(domain.id, error)
+
+
+def fail_domain(domain_id, error):
+    """
+    Mark the scan of the domain as ended by `error`, keeping its counters.
+    """
+    messages = Domain.objects.filter(id=domain_id).values_list('messages', flat=True).first() or {}
+    messages.update({"finished": False, "error": error})
+    writes.write(Domain.objects.filter(id=domain_id).update, messages=messages, completed=True)
+    events.publish(domain_id, ScanEvent.FAILED, error=error)
+
+
+class ScanProgress:
+    """
+    Publish the running counters of a scan in Domain.messages and as a
+    progress event.
+
+    The row and the event are written at most once every SCAN_PROGRESS_INTERVAL seconds,
+    whatever the rate of the results.
+    """
+    def __init__(self, domain, messages, interval=None):
+        self.domain = domain
+        self.messages = messages
+        self.interval = settings.SCAN_PROGRESS_INTERVAL if interval is None else interval
+        self.start = time.monotonic()
+        self.last = None
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def update(self, count, force=False):
+        now = time.monotonic()
+        if not force and self.last is not None and now - self.last < self.interval:
+            return
+        self.last = now
+
+        elapsed = now - self.start
+        self.messages.update({
+            "count": count,
+            "rate": f"{count / elapsed:.1f}" if elapsed else "0.0",
+            "time": f"{elapsed:.2f}",
+        })
+        writes.write(Domain.objects.filter(id=self.domain.id).update, messages=self.messages)
+        events.publish(self.domain.id, ScanEvent.PROGRESS, count=count, rate=self.messages["rate"],
+                       time=self.messages["time"], filtered=self.messages.get("filtered", 0))
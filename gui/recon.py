@@ -0,0 +1,285 @@
+"""
+Passive recon: the subdomains of a domain known to public sources.
+
+The sources are the ones of knock's recon, plus VirusTotal and Shodan when
+their API key is given. Keys are passed to the Recon client (from the
+Apikey row, or the options of a remote agent), never through the
+environment, so scans with other keys can run in the same process.
+
+- cache: the names answered by a source for a domain are kept for
+  RECON_CACHE_TTL seconds (ReconAnswer), so the scans of the workers do
+  not ask the sources again for a domain scanned a little earlier. A
+  source that fails is not cached.
+- rate limit: every request of a source listed in RECON_RATE_LIMITS takes
+  a token from the bucket of its API key (RateBucket), shared by all the
+  workers. A request waits for its token at most RECON_RATE_WAIT seconds,
+  then the source is skipped for that scan.
+
+Remote agents have no database: they keep the cache and the buckets in
+memory (MemoryStore).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import hashlib
+import json
+import re
+import threading
+import time
+
+import bs4
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RateBucket, ReconAnswer
+from . import writes
+
+
+def under(name, domain):
+    """
+    The name, normalized, when it is the domain or one of its subdomains;
+    otherwise None.
+    """
+    name = name.strip().lower().rstrip('.')
+    if '*' in name or not (name == domain or name.endswith('.' + domain)):
+        return None
+    return name
+
+
+def parse_alienvault(text, domain):
+    return [item['hostname'] for item in json.loads(text)['passive_dns']]
+
+
+def parse_certspotter(text, domain):
+    return [name for item in json.loads(text) for name in item['dns_names']]
+
+
+def parse_crtsh(text, domain):
+    return [item['common_name'] for item in json.loads(text)]
+
+
+def parse_hackertarget(text, domain):
+    return [line.split(',')[0] for line in text.splitlines()]
+
+
+def parse_rapiddns(text, domain):
+    return [cell.text for cell in bs4.BeautifulSoup(text, 'html.parser').find_all('td')]
+
+
+def parse_webarchive(text, domain):
+    pattern = re.compile(r"https?://([a-zA-Z0-9.-]+)")
+    return [match.group(1) for match in map(pattern.match, text.splitlines()) if match]
+
+
+def parse_virustotal(text, domain):
+    return json.loads(text).get('subdomains', [])
+
+
+def parse_shodan(text, domain):
+    return [f"{label}.{domain}" if label else domain for label in json.loads(text).get('subdomains', [])]
+
+
+class Source:
+    """
+    A recon source: URL template ({domain}, {key}), parser of its answer
+    and the name of its API key (None when it needs none).
+    """
+    def __init__(self, name, url, parse, key=None):
+        self.name = name
+        self.url = url
+        self.parse = parse
+        self.key = key
+
+
+SOURCES = [
+    Source('alienvault', 'https://otx.alienvault.com/api/v1/indicators/domain/{domain}/passive_dns', parse_alienvault),
+    Source('certspotter', 'https://api.certspotter.com/v1/issuances?domain={domain}&include_subdomains=true&expand=dns_names', parse_certspotter),
+    Source('crtsh', 'https://crt.sh/?q={domain}&output=json', parse_crtsh),
+    Source('hackertarget', 'https://api.hackertarget.com/hostsearch/?q={domain}', parse_hackertarget),
+    Source('rapiddns', 'https://rapiddns.io/subdomain/{domain}', parse_rapiddns),
+    Source('webarchive', 'https://web.archive.org/cdx/search/cdx?url=*.{domain}/*&output=txt', parse_webarchive),
+    Source('virustotal', 'https://www.virustotal.com/vtapi/v2/domain/report?apikey={key}&domain={domain}', parse_virustotal, key='virustotal'),
+    Source('shodan', 'https://api.shodan.io/dns/domain/{domain}?key={key}', parse_shodan, key='shodan'),
+]
+
+
+def bucket_key(source, key):
+    """
+    Name of the bucket of an API key of a source.
+    """
+    if not key:
+        return source.name
+    return f"{source.name}:{hashlib.sha256(key.encode()).hexdigest()[:32]}"
+
+
+def spend(tokens, updated_at, capacity, period, now):
+    """
+    Refill a bucket of `capacity` tokens per `period` seconds and take one:
+    (tokens left, 0), or (tokens, seconds until a token is there).
+    """
+    rate = capacity / period
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+def take_token(key, capacity, period):
+    with transaction.atomic():
+        now = time.time()
+        bucket, created = RateBucket.objects.select_for_update().get_or_create(
+            key=key, defaults={'tokens': capacity, 'updated_at': now},
+        )
+        bucket.tokens, wait = spend(bucket.tokens, bucket.updated_at, capacity, period, now)
+        bucket.updated_at = now
+        bucket.save(update_fields=['tokens', 'updated_at'])
+        return wait
+
+
+class DatabaseStore:
+    """
+    Cache and buckets in the database, shared by the worker processes.
+    """
+    def load(self, domain):
+        """
+        {source: names} of the unexpired answers for the domain.
+        """
+        answers = ReconAnswer.objects.filter(domain=domain, expires_at__gt=timezone.now())
+        return dict(answers.values_list('source', 'names'))
+
+    def save(self, domain, answers):
+        expires_at = timezone.now() + timedelta(seconds=settings.RECON_CACHE_TTL)
+        rows = [ReconAnswer(source=source, domain=domain, names=names, expires_at=expires_at) for source, names in answers.items()]
+        writes.write(
+            ReconAnswer.objects.bulk_create,
+            rows,
+            update_conflicts=True,
+            unique_fields=['domain', 'source'],
+            update_fields=['names', 'expires_at'],
+        )
+
+    def take(self, key, capacity, period):
+        """
+        Take a token: 0, or the seconds to wait before asking again.
+        """
+        return writes.write(take_token, key, capacity, period)
+
+
+class MemoryStore:
+    """
+    Cache and buckets of this process only (remote agents).
+    """
+    def __init__(self):
+        self.answers = {}  # domain -> {source: (names, expires)}
+        self.buckets = {}  # key -> (tokens, updated_at)
+        self.lock = threading.Lock()
+
+    def load(self, domain):
+        now = time.time()
+        with self.lock:
+            return {source: names for source, (names, expires) in self.answers.get(domain, {}).items() if expires > now}
+
+    def save(self, domain, answers):
+        expires = time.time() + settings.RECON_CACHE_TTL
+        with self.lock:
+            self.answers.setdefault(domain, {}).update((source, (names, expires)) for source, names in answers.items())
+
+    def take(self, key, capacity, period):
+        now = time.time()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens, wait = spend(tokens, updated_at, capacity, period, now)
+            self.buckets[key] = (tokens, now)
+            return wait
+
+
+class Recon:
+    """
+    Names of a domain found by the recon sources.
+
+    `keys` are the API keys by source ({'virustotal': ..., 'shodan': ...});
+    the sources that need a key are only asked when it is given. `urls`
+    replaces the URL template of some sources (tests, proxies).
+    """
+    def __init__(self, keys=None, timeout=3, store=None, urls=None):
+        self.keys = {source: key for source, key in (keys or {}).items() if key}
+        self.timeout = timeout or 3
+        self.store = store or DatabaseStore()
+        self.urls = urls or {}
+        self.stats = {"cached": 0, "fetched": 0, "failed": 0, "limited": 0}
+
+    @classmethod
+    def from_apikey(cls, apikey, **kwargs):
+        """
+        The client with the keys of an Apikey row (or none).
+        """
+        keys = {'virustotal': apikey.virustotal, 'shodan': apikey.shodan} if apikey else {}
+        return cls(keys, **kwargs)
+
+    def sources(self):
+        return [source for source in SOURCES if not source.key or source.key in self.keys]
+
+    def acquire(self, source, capacity, period):
+        """
+        Wait for a token of the bucket of the source; False when it would
+        take more than RECON_RATE_WAIT seconds.
+        """
+        key = bucket_key(source, self.keys.get(source.key))
+        deadline = time.monotonic() + settings.RECON_RATE_WAIT
+        while True:
+            wait = self.store.take(key, capacity, period)
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def fetch(self, source, domain):
+        """
+        The names answered by the source, or None when it failed.
+        """
+        url = self.urls.get(source.name, source.url).format(domain=domain, key=self.keys.get(source.key, ''))
+        try:
+            response = requests.get(url, timeout=(self.timeout, self.timeout))
+            response.raise_for_status()
+            names = source.parse(response.text, domain)
+        except (requests.RequestException, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        return sorted({name for name in (under(str(item), domain) for item in names) if name})
+
+    def names(self, domain):
+        """
+        The names of the domain found by all the sources, without duplicates.
+        """
+        domain = domain.lower()
+        sources = self.sources()
+        answers = self.store.load(domain)
+        missing = [source for source in sources if source.name not in answers]
+        self.stats["cached"] += len(sources) - len(missing)
+
+        if missing:
+            futures = {}
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                # The sources without a limit are asked while the others wait
+                # for their token; the buckets are only read from this thread
+                for source in sorted(missing, key=lambda source: source.name in settings.RECON_RATE_LIMITS):
+                    limit = settings.RECON_RATE_LIMITS.get(source.name)
+                    if limit and not self.acquire(source, *limit):
+                        self.stats["limited"] += 1
+                        continue
+                    futures[source.name] = executor.submit(self.fetch, source, domain)
+
+            fetched = {}
+            for name, future in futures.items():
+                names = future.result()
+                if names is None:
+                    self.stats["failed"] += 1
+                else:
+                    self.stats["fetched"] += 1
+                    fetched[name] = names
+            if fetched:
+                self.store.save(domain, fetched)
+            answers.update(fetched)
+
+        return list(dict.fromkeys(name for source in sources for name in answers.get(source.name, ())))
@@ -0,0 +1,196 @@
+"""
+Asyncio DNS resolver used by the 'asyncio' scan engine.
+
+All the queries share one UDP socket towards the configured name server,
+so thousands of lookups can be in flight at the same time without a
+thread each. Messages are built and parsed with dnspython (a knock
+dependency).
+"""
+import asyncio
+import random
+import time
+
+import dns.exception
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
+
+from . import metrics
+
+DEFAULT_NAMESERVER = '8.8.8.8'
+
+
+def addresses(response):
+    """
+    The A addresses of a response, or None (NXDOMAIN, error, no address).
+    """
+    if response.rcode() != dns.rcode.NOERROR:
+        return None
+    # The answer may hold a CNAME chain before the addresses
+    ips = [
+        rdata.address
+        for rrset in response.answer if rrset.rdtype == dns.rdatatype.A
+        for rdata in rrset
+    ]
+    return ips or None
+
+
+def response_ttl(response):
+    """
+    Seconds the answer of a response may be cached, or None when unknown.
+
+    The smallest TTL of the answer (CNAME chain included); for a negative
+    answer the SOA of the authority section (RFC 2308).
+    """
+    if response.answer and addresses(response):
+        return min(rrset.ttl for rrset in response.answer)
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum)
+    return None
+
+
+def resolve_sync(name, nameserver=None, port=53, timeout=2, retries=2):
+    """
+    Blocking A query over UDP, retried on timeout. Returns the response or
+    None, also for names that are not valid (an empty or too long label).
+    """
+    try:
+        message = dns.message.make_query(name, dns.rdatatype.A)
+    except (dns.exception.DNSException, ValueError):
+        return None
+    for attempt in range(retries + 1):
+        try:
+            return dns.query.udp(message, nameserver or DEFAULT_NAMESERVER, timeout=timeout, port=port)
+        except dns.exception.Timeout:
+            continue
+        except (OSError, dns.exception.DNSException):
+            return None
+    return None
+
+
+class ResolverProtocol(asyncio.DatagramProtocol):
+    def __init__(self, resolver):
+        self.resolver = resolver
+
+    def datagram_received(self, data, addr):
+        self.resolver.answer(data)
+
+    def error_received(self, exc):
+        # ICMP errors are handled by the query timeout
+        pass
+
+
+class AsyncResolver:
+    """
+    Resolve A records with at most `concurrency` queries in flight.
+
+    Each query is sent again after `timeout` seconds, up to `retries`
+    times. resolve() returns the list of addresses, or None when the name
+    does not exist, has no address or did not answer. With a DNSCache the
+    answers are read from and stored in it.
+
+        async with AsyncResolver('1.1.1.1') as resolver:
+            ips = await resolver.resolve('www.example.com')
+    """
+    def __init__(self, nameserver=None, port=53, timeout=2, retries=2, concurrency=500, cache=None):
+        self.nameserver = nameserver or DEFAULT_NAMESERVER
+        self.cache = cache
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.concurrency = concurrency
+        self.transport = None
+        self.semaphore = None
+        self.pending = {}  # query id -> (name, future)
+        self.sent = 0
+        self.answered = 0
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: ResolverProtocol(self),
+            remote_addr=(self.nameserver, self.port),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+        for name, future in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+
+    def new_id(self):
+        while True:
+            query_id = random.randint(0, 0xffff)
+            if query_id not in self.pending:
+                return query_id
+
+    def answer(self, data):
+        try:
+            response = dns.message.from_wire(data)
+        except dns.exception.DNSException:
+            return
+        entry = self.pending.get(response.id)
+        if not entry:
+            return  # late answer of a query that timed out
+        name, future = entry
+        if not response.question or response.question[0].name.to_text(omit_final_dot=True).lower() != name:
+            return  # not the answer to our question
+        if not future.done():
+            future.set_result(response)
+
+    async def query(self, name):
+        """
+        Send the query, retrying on timeout. Returns the response or None,
+        also for names that are not valid.
+        """
+        try:
+            message = dns.message.make_query(name, dns.rdatatype.A)
+        except (dns.exception.DNSException, ValueError):
+            return None
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            query_id = self.new_id()
+            message.id = query_id
+            future = loop.create_future()
+            self.pending[query_id] = (name, future)
+            try:
+                self.transport.sendto(message.to_wire())
+                self.sent += 1
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                continue
+            finally:
+                self.pending.pop(query_id, None)
+        return None
+
+    async def resolve(self, name):
+        name = name.lower().rstrip('.')
+        if self.cache is not None:
+            hit, ips = self.cache.get(name)
+            if hit:
+                metrics.DNS_QUERIES.inc('cached')
+                return ips
+
+        async with self.semaphore:
+            start = time.perf_counter()
+            response = await self.query(name)
+        if response is None:
+            metrics.DNS_QUERIES.inc('timeout')
+            return None
+        metrics.DNS_SECONDS.observe(time.perf_counter() - start)
+        self.answered += 1
+        ips = addresses(response)
+        metrics.DNS_QUERIES.inc('answer' if ips else 'nxdomain')
+        if self.cache is not None:
+            self.cache.put(name, ips, response_ttl(response))
+        return ips
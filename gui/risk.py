@@ -0,0 +1,53 @@
+"""
+Risk flags of the subdomains.
+
+Computed once, when a result is written (and by python manage.py backfill
+risk for the rows stored before), and kept in indexed columns so that the
+changelist filters, sorts and counts on them:
+- http_only: the name answers in clear HTTP, without HTTPS or with a 200
+  page instead of a redirect;
+- cert_expired: the certificate served over HTTPS expired before the scan;
+- cert_mismatch: its common name does not contain the domain name.
+
+risk_score adds the RISK_WEIGHTS of the flags that are set.
+"""
+from itertools import combinations
+
+from django.conf import settings
+
+FLAGS = ('http_only', 'cert_expired', 'cert_mismatch')
+
+
+def flags(http_status, https_status, not_after, common_name, domain_name, now):
+    """
+    {flag: bool} of a subdomain; `not_after` is the expiration of its
+    certificate (an aware datetime or None), `now` the time of the scan.
+    """
+    return {
+        'http_only': bool(http_status) and (not https_status or http_status == 200),
+        'cert_expired': bool(https_status) and not_after is not None and not_after < now,
+        'cert_mismatch': bool(https_status) and bool(common_name) and domain_name not in common_name,
+    }
+
+
+def score(values):
+    return sum(settings.RISK_WEIGHTS[flag] for flag in FLAGS if values[flag])
+
+
+def assess(subdomain, domain_name, not_after, common_name, now):
+    """
+    Set the risk flags and score of an unsaved or loaded Subdomain.
+    """
+    values = flags(subdomain.http_status, subdomain.https_status, not_after, common_name, domain_name, now)
+    for flag, value in values.items():
+        setattr(subdomain, flag, value)
+    subdomain.risk_score = score(values)
+    return subdomain
+
+
+def scores():
+    """
+    Every score a subdomain can have above 0, lowest first.
+    """
+    weights = [settings.RISK_WEIGHTS[flag] for flag in FLAGS]
+    return sorted({sum(chosen) for size in range(1, len(weights) + 1) for chosen in combinations(weights, size)} - {0})
@@ -0,0 +1,117 @@
+"""
+Recurring scans.
+
+A domain is scanned again every `scan_interval` hours: its own, or else
+the one of its tag. Its next scan time is kept in Domain.next_scan_at, and
+the scheduler (python manage.py scheduler) reads the due domains in the
+order of that index, queues their scans and moves their next time forward.
+
+Each next time is moved by a random part (SCHEDULE_JITTER) of the
+interval, and the domains of a tag given an interval get their first
+scheduled scan at random within one interval, so they do not all start
+together. A domain whose previous scan is still queued or running skips
+that run.
+"""
+from datetime import timedelta
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .jobs import enqueue_scans
+from .models import Domain, ScanJob
+
+
+def interval(own, inherited):
+    """
+    The interval of a domain from its hours and the hours of its tag.
+    """
+    hours = own or inherited
+    return timedelta(hours=hours) if hours else None
+
+
+def next_time(now, period, spread=False):
+    """
+    One period from `now`, give or take SCHEDULE_JITTER of it, or with
+    `spread` any time within one period.
+    """
+    if spread:
+        return now + period * random.random()
+    jitter = settings.SCHEDULE_JITTER
+    return now + period * (1 + random.uniform(-jitter, jitter))
+
+
+def reschedule(rows, now, spread=False):
+    """
+    Set the next scan time of the domains in `rows`, tuples of (id, hours
+    of the domain, hours of its tag); None when neither has an interval.
+    """
+    domains = []
+    for domain_id, own, inherited in rows:
+        period = interval(own, inherited)
+        domains.append(Domain(id=domain_id, next_scan_at=next_time(now, period, spread) if period else None))
+    Domain.objects.bulk_update(domains, ['next_scan_at'], batch_size=settings.SCHEDULE_BATCH)
+
+
+def schedule_domains(domains, now=None, spread=False):
+    """
+    Schedule the next scan of a queryset of domains: one interval after
+    the scan just queued, or with `spread` within the next interval.
+    """
+    now = now or timezone.now()
+    rows = domains.order_by('id').values_list('id', 'scan_interval', 'tag__scan_interval')
+    start = 0
+    while True:
+        batch = list(rows.filter(id__gt=start)[:settings.SCHEDULE_BATCH])
+        if not batch:
+            return
+        reschedule(batch, now, spread)
+        start = batch[-1][0]
+
+
+def schedule_tag(tag, now=None):
+    """
+    Follow a change of the interval of a saved tag. Its domains with their
+    own interval are left alone, and so are the ones already due within
+    the new interval; the others are spread over it.
+    """
+    now = now or timezone.now()
+    domains = Domain.objects.filter(tag=tag, scan_interval__isnull=True)
+    if tag.scan_interval:
+        latest = now + timedelta(hours=tag.scan_interval) * (1 + settings.SCHEDULE_JITTER)
+        domains = domains.filter(Q(next_scan_at__isnull=True) | Q(next_scan_at__gt=latest))
+    schedule_domains(domains, now, spread=True)
+
+
+def run_due(now=None, limit=None):
+    """
+    Queue the scans of up to `limit` domains due at `now`, the most
+    overdue first, and schedule their next one. Returns (queued, skipped):
+    skipped domains still had a scan queued or running.
+    """
+    now = now or timezone.now()
+    limit = limit or settings.SCHEDULE_BATCH
+    with transaction.atomic():
+        # Several schedulers on a server database take different rows
+        rows = list(
+            Domain.objects.filter(next_scan_at__lte=now)
+            .order_by('next_scan_at')
+            .select_for_update(skip_locked=True, of=('self',))
+            .values_list('id', 'scan_interval', 'tag__scan_interval')[:limit]
+        )
+        ids = [row[0] for row in rows]
+        active = set(ScanJob.objects.filter(
+            domain_id__in=ids, state__in=[ScanJob.QUEUED, ScanJob.RUNNING],
+        ).values_list('domain_id', flat=True))
+        queued = enqueue_scans([Domain(id=domain_id) for domain_id in ids if domain_id not in active])
+        reschedule(rows, now)
+    return queued, len(active)
+
+
+def next_due():
+    """
+    The time of the next scheduled scan, or None.
+    """
+    return Domain.objects.filter(next_scan_at__isnull=False).order_by('next_scan_at').values_list('next_scan_at', flat=True).first()
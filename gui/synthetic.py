@@ -0,0 +1,432 @@
+"""
+Synthetic knock results, so that scans can run offline (tests and benchmarks).
+"""
+import asyncio
+import datetime
+import multiprocessing
+import os
+import random
+import shutil
+import ssl
+import tempfile
+import threading
+import time
+
+import dns.message
+import dns.rcode
+import dns.rrset
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+def make_result(name, ips, http=None, https=None, cert=None):
+    """
+    A result shaped like the ones returned by knock.KNOCKPY.
+    """
+    return {
+        "domain": name,
+        "ip": ips,
+        "http": list(http or [200, None, 'nginx']),
+        "https": list(https or [200, None, 'nginx']),
+        "cert": list(cert or [True, '2030-01-01', name]),
+    }
+
+
+# (http status, server) answered by the synthetic hosts
+HTTP_ANSWERS = [
+    (200, 'nginx'), (301, 'nginx'), (200, 'Apache'), (403, 'cloudflare'),
+    (404, 'Microsoft-IIS/10.0'), (302, 'AmazonS3'), (None, None),
+]
+
+
+def generate(domain, count, seed=0, addresses=None, wildcard=False):
+    """
+    Yield `count` results for subdomains of `domain`.
+
+    Each name gets a random address, or one of a pool of `addresses`
+    shared by the names (CDN edges). With `wildcard` every name answers
+    like a wildcard DNS record: same addresses, same HTTP answer.
+    """
+    rand = random.Random(seed)
+    pool = [f"10.{seed % 256}.{k // 254 % 256}.{k % 254 + 1}" for k in range(addresses)] if addresses else None
+    for i in range(count):
+        name = f"host{i}.{domain}"
+        if wildcard:
+            yield make_result(name, ['10.255.0.1', '10.255.0.2'], http=[200, None, 'nginx'], https=[200, None, 'nginx'],
+                              cert=[True, '2030-01-01', f'*.{domain}'])
+            continue
+        if pool:
+            ips = [rand.choice(pool)]
+        else:
+            ips = [f"10.{rand.randint(0, 255)}.{rand.randint(0, 255)}.{rand.randint(1, 254)}"]
+        status, server = rand.choice(HTTP_ANSWERS)
+        # One wildcard certificate for the whole domain, like a CDN
+        yield make_result(name, ips, http=[status, None, server], https=[status, None, server],
+                          cert=[True, '2030-01-01', f'*.{domain}'])
+
+
+class FakeKnockpy:
+    """
+    Stands in for knock.KNOCKPY and for the scan engine.
+
+    Scans return `count` synthetic results after `delay` seconds and the
+    wildcard fingerprint of every domain is `wildcard` (none by default).
+    It keeps track of the calls and of how many scans were running at the
+    same time.
+
+    Use patch() to install it in the scan command.
+    """
+    def __init__(self, count=10, delay=0, fail=False, wildcard=None):
+        self.count = count
+        self.wildcard = wildcard
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, domain, dns=None, useragent=None, timeout=None, threads=None, recon=None, bruteforce=None, wordlist=None, silent=None):
+        if not (recon or bruteforce):
+            return None
+        return list(self.scan(domain))
+
+    def stream(self, domain, cache=None, stats=None, recon=None):
+        """
+        Stands in for gui.engine.stream.
+        """
+        return self.scan(domain.name)
+
+    def scan(self, name):
+        with self.lock:
+            self.calls.append(name)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError('scan failed')
+            yield from generate(name, self.count)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def patch(knockpy):
+    """
+    Make the scan command use a FakeKnockpy (engine and wildcard detection).
+    """
+    from unittest import mock
+    from contextlib import ExitStack
+    from .wildcard import Fingerprint
+
+    stack = ExitStack()
+    stack.enter_context(mock.patch('gui.engine.stream', knockpy.stream))
+    stack.enter_context(mock.patch('gui.wildcard.fingerprint', lambda domain, store=None: knockpy.wildcard or Fingerprint([], [])))
+    return stack
+
+
+class StubDNSServer:
+    """
+    A local UDP name server answering A queries from a dict {name: [ip, ...]}.
+
+    Names missing from `records` get NXDOMAIN; the first `drop` queries are
+    not answered (to exercise the retries) and every answer is sent after
+    `latency` seconds, like a remote server would. `records` may also be a
+    callable returning the addresses of a name, or None. With
+    `negative_ttl` NXDOMAIN answers carry a SOA with that minimum TTL. With
+    `process` the server runs in a child process (queries are then not
+    counted here).
+
+        with StubDNSServer({'www.example.com': ['10.0.0.1']}) as server:
+            resolver = AsyncResolver('127.0.0.1', port=server.port)
+    """
+    def __init__(self, records, ttl=300, drop=0, latency=0, process=False, negative_ttl=None):
+        self.records = records
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.drop = drop
+        self.latency = latency
+        self.process = process
+        self.queries = 0
+        self.loop = None
+        self.port = None
+        self.worker = None
+
+    def lookup(self, name):
+        if callable(self.records):
+            return self.records(name)
+        return self.records.get(name)
+
+    def respond(self, data):
+        query = dns.message.from_wire(data)
+        self.queries += 1
+        if self.queries <= self.drop:
+            return None
+
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        ips = self.lookup(question.name.to_text(omit_final_dot=True).lower())
+        if ips:
+            response.answer.append(dns.rrset.from_text_list(question.name, self.ttl, 'IN', 'A', ips))
+        else:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            if self.negative_ttl is not None:
+                zone = question.name.parent()
+                response.authority.append(dns.rrset.from_text(
+                    zone, 3600, 'IN', 'SOA', f"ns.{zone} hostmaster.{zone} 1 7200 900 1209600 {self.negative_ttl}",
+                ))
+        return response.to_wire()
+
+    def serve(self, started):
+        """
+        Run the server on a new event loop; started(port) is called once it listens.
+        """
+        stub = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                answer = stub.respond(data)
+                if answer:
+                    stub.loop.call_later(stub.latency, self.transport.sendto, answer, addr)
+
+        async def listen():
+            transport, _ = await self.loop.create_datagram_endpoint(Protocol, local_addr=('127.0.0.1', 0))
+            started(transport.get_extra_info('sockname')[1])
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(listen())
+        self.loop.run_forever()
+        self.loop.close()
+
+    def __enter__(self):
+        if self.process:
+            # A separate process, so that the server does not share the GIL
+            # with the resolver being measured
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            self.worker = multiprocessing.Process(target=self.serve, args=(sender.send,), daemon=True)
+            self.worker.start()
+            self.port = receiver.recv()
+        else:
+            ready = threading.Event()
+
+            def started(port):
+                self.port = port
+                ready.set()
+
+            self.worker = threading.Thread(target=self.serve, args=(started,), daemon=True)
+            self.worker.start()
+            ready.wait()
+        return self
+
+    def __exit__(self, *exc):
+        if self.process:
+            self.worker.terminate()
+        else:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.worker.join()
+
+
+def self_signed_certificate(directory, names, days=365):
+    """
+    Write a self-signed certificate for `names` (the first is the common
+    name) and its key in `directory`; returns (certificate path, key path).
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, names[0])])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(subject).issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(name) for name in names]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    with open(cert_path, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class StubHTTPServer:
+    """
+    A local HTTP and HTTPS server answering every GET with `status` and a
+    `server` header, keeping connections alive (HTTP/1.1).
+
+    The certificate is self-signed for `names`. `connections` and
+    `requests` count what was received, `times` holds the arrival time of
+    each request. With `process` the server runs in a child process
+    (nothing is then counted here).
+
+        with StubHTTPServer(names=['*.example.com']) as server:
+            settings PROBE_HTTP_PORT=server.http_port, PROBE_HTTPS_PORT=server.https_port
+    """
+    def __init__(self, status=200, server='stub', names=('localhost',), latency=0, process=False):
+        self.status = status
+        self.server = server
+        self.names = list(names)
+        self.latency = latency
+        self.process = process
+        self.connections = 0
+        self.requests = 0
+        self.times = []
+        self.http_port = None
+        self.https_port = None
+        self.loop = None
+        self.worker = None
+        self.directory = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        body = b'stub'
+        try:
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                if not request:
+                    break
+                self.requests += 1
+                self.times.append(time.monotonic())
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(
+                    f"HTTP/1.1 {self.status} OK\r\nServer: {self.server}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Cancelled connections are the ones still open at shutdown
+            pass
+        finally:
+            writer.close()
+
+    def serve(self, started):
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(*self_signed_certificate(self.directory, self.names))
+
+        servers = []
+
+        async def listen():
+            http = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+            https = await asyncio.start_server(self.handle, '127.0.0.1', 0, ssl=context)
+            servers.extend([http, https])
+            started((http.sockets[0].getsockname()[1], https.sockets[0].getsockname()[1]))
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(listen())
+        self.loop.run_forever()
+        # No new connections; the handlers just accepted get to start, then
+        # the connections still open are closed before the loop
+        for server in servers:
+            server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp()
+        if self.process:
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            self.worker = multiprocessing.Process(target=self.serve, args=(sender.send,), daemon=True)
+            self.worker.start()
+            self.http_port, self.https_port = receiver.recv()
+        else:
+            ready = threading.Event()
+
+            def started(ports):
+                self.http_port, self.https_port = ports
+                ready.set()
+
+            self.worker = threading.Thread(target=self.serve, args=(started,), daemon=True)
+            self.worker.start()
+            ready.wait()
+        return self
+
+    def __exit__(self, *exc):
+        if self.process:
+            self.worker.terminate()
+        else:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.worker.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class StubReconServer:
+    """
+    A local HTTP server standing in for the recon sources.
+
+    GET /<source>?domain=D&key=K answers `answers[source]` (a text, or a
+    callable of the domain returning it); the sources missing from
+    `answers` answer 500. `requests` counts the calls per source and `keys`
+    the API keys received per source.
+
+        with StubReconServer({'crtsh': '[{"common_name": "www.example.com"}]'}) as server:
+            Recon(urls=server.urls()).names('example.com')
+    """
+    def __init__(self, answers):
+        self.answers = answers
+        self.requests = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.worker = None
+
+    def urls(self):
+        from .recon import SOURCES
+        return {source.name: f"http://127.0.0.1:{self.port}/{source.name}?domain={{domain}}&key={{key}}" for source in SOURCES}
+
+    def answer(self, path):
+        from urllib.parse import parse_qs, urlsplit
+
+        url = urlsplit(path)
+        source, query = url.path.strip('/'), parse_qs(url.query)
+        with self.lock:
+            self.requests[source] = self.requests.get(source, 0) + 1
+            if query.get('key'):
+                self.keys.setdefault(source, set()).add(query['key'][0])
+        body = self.answers.get(source)
+        if callable(body):
+            body = body(query.get('domain', [''])[0])
+        return (500, b'') if body is None else (200, body.encode())
+
+    def __enter__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = stub.answer(self.path)
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.worker = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.worker.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self.worker.join()
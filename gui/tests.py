@@ -1,3 +1,1614 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+import asyncio
+import csv
+import gzip
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from asgiref.sync import sync_to_async
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import agents, benchmarks, certificates, engine, events, metrics, recon, risk, schedule, writes
+from .agent import Agent, Client
+from .dnscache import LRU, DNSCache
+from .export import export
+from .facets import facet_choices, refresh_facets
+from .imports import import_domains, parse_names
+from .history import diff
+from .ingest import SubdomainWriter
+from .progress import ScanProgress
+from .pipeline import SOURCE_BATCH, Pipeline, Stage
+from .recon import Recon
+from .prober import HTTPProber, Limiter
+from .resolver import AsyncResolver
+from . import wordlists
+from . import wildcard
+from .jobs import claim_job, enqueue_scan, enqueue_scans, requeue_expired, run_job
+from .models import AgentToken, Apikey, Certificate, DNSAnswer, Domain, RateBucket, ReconAnswer, ScanChange, ScanEvent, ScanJob, ScanRun, Subdomain, SubdomainFacet, SubdomainIP, Tag, WildcardFingerprint, Wordlist
+from .synthetic import FakeKnockpy, StubDNSServer, StubHTTPServer, StubReconServer, generate, make_result, patch
+
+
+def create_domain(name='example.com'):
+    tag, created = Tag.objects.get_or_create(name=name)
+    return Domain.objects.create(name=name, tag=tag)
+
+
+class ScanJobTest(TestCase):
+    def test_enqueue_does_not_duplicate_waiting_jobs(self):
+        domain = create_domain()
+        first = enqueue_scan(domain)
+        second = enqueue_scan(domain, priority=5)
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(ScanJob.objects.get().priority, 5)
+
+    def test_claim_by_priority_then_age(self):
+        low = enqueue_scan(create_domain('a.com'))
+        high = enqueue_scan(create_domain('b.com'), priority=10)
+        self.assertEqual(claim_job().id, high.id)
+        self.assertEqual(claim_job().id, low.id)
+        self.assertIsNone(claim_job())
+
+    def test_claim_respects_global_cap(self):
+        enqueue_scan(create_domain('a.com'))
+        enqueue_scan(create_domain('b.com'))
+        self.assertIsNotNone(claim_job(limit=1))
+        self.assertIsNone(claim_job(limit=1))
+
+    def test_failed_scan_is_retried_then_failed(self):
+        job = enqueue_scan(create_domain())
+        job.max_attempts = 2
+        job.save()
+        with patch(FakeKnockpy(fail=True)):
+            self.assertEqual(run_job(claim_job()), ScanJob.QUEUED)
+            self.assertEqual(run_job(claim_job()), ScanJob.FAILED)
+        self.assertIn('scan failed', ScanJob.objects.get().error)
+        domain = Domain.objects.get()
+        self.assertTrue(domain.completed)
+        self.assertIn('scan failed', domain.messages['error'])
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        response = self.client.get('/admin/gui/domain/')
+        self.assertContains(response, 'The scan failed.')
+        self.assertNotContains(response, 'The scan is currently in progress.')
+
+    def test_expired_lease_without_attempts_left_fails_the_domain(self):
+        job = enqueue_scan(create_domain())
+        ScanJob.objects.filter(id=job.id).update(max_attempts=1)
+        claim_job()
+        ScanJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(requeue_expired(), (0, 1))
+        self.assertEqual(Domain.objects.get().messages['error'], 'lease expired')
+
+    def test_expired_lease_goes_back_to_the_queue(self):
+        job = enqueue_scan(create_domain())
+        claim_job()
+        ScanJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(requeue_expired(), (1, 0))
+        self.assertEqual(ScanJob.objects.get().state, ScanJob.QUEUED)
+
+
+class IngestTest(TestCase):
+    def test_writer_skips_duplicates_in_the_database(self):
+        domain = create_domain()
+        results = list(generate(domain.name, 25))
+        with SubdomainWriter(domain, batch_size=10) as writer:
+            writer.extend(results)
+            writer.extend(results[:5])
+        self.assertEqual(writer.count, 25)
+        self.assertEqual(Subdomain.objects.filter(domain=domain).count(), 25)
+
+    def test_writer_flushes_full_chunks(self):
+        domain = create_domain()
+        writer = SubdomainWriter(domain, batch_size=10)
+        writer.extend(generate(domain.name, 15))
+        self.assertEqual(Subdomain.objects.count(), 10)
+        writer.flush()
+        self.assertEqual(Subdomain.objects.count(), 15)
+
+    def test_certificates_are_stored_once(self):
+        domain = create_domain()
+        with SubdomainWriter(domain, batch_size=10) as writer:
+            writer.extend(generate(domain.name, 25))
+        certificate = Certificate.objects.get()
+        self.assertEqual(certificate.common_name, '*.example.com')
+        self.assertEqual(Subdomain.objects.filter(certificate=certificate).count(), 25)
+        self.assertEqual(Subdomain.objects.first().cert_expiration_date.year, 2030)
+
+
+RISK_RESULTS = [
+    make_result('plain.example.com', ['10.0.0.1'], https=[None, None, None], cert=[None, None, None]),
+    make_result('old.example.com', ['10.0.0.2'], http=[301, 'https://old.example.com/', 'nginx'], cert=[False, '2020-01-01', 'old.example.com']),
+    make_result('cdn.example.com', ['10.0.0.3'], http=[301, 'https://cdn.example.com/', 'nginx'], cert=[True, '2030-01-01', '*.cdn.net']),
+    make_result('ok.example.com', ['10.0.0.4'], http=[301, 'https://ok.example.com/', 'nginx'], cert=[True, '2030-01-01', '*.example.com']),
+]
+
+
+class RiskTest(TestCase):
+    def flags(self):
+        return {name: (http_only, expired, mismatch, score) for name, http_only, expired, mismatch, score
+                in Subdomain.objects.values_list('name', 'http_only', 'cert_expired', 'cert_mismatch', 'risk_score')}
+
+    def test_flags_are_computed_at_ingestion(self):
+        domain = create_domain()
+        with SubdomainWriter(domain) as writer:
+            writer.extend(RISK_RESULTS)
+        self.assertEqual(self.flags(), {
+            'plain.example.com': (True, False, False, 1),
+            'old.example.com': (False, True, False, 2),
+            'cdn.example.com': (False, False, True, 2),
+            'ok.example.com': (False, False, False, 0),
+        })
+
+        # A renewed certificate clears the flag on the next scan
+        renewed = make_result('old.example.com', ['10.0.0.2'], http=[301, 'https://old.example.com/', 'nginx'])
+        with SubdomainWriter(domain, update=True) as writer:
+            writer.add(renewed)
+        self.assertEqual(self.flags()['old.example.com'], (False, False, False, 0))
+
+    def test_admin_filters_and_sorts_on_the_flags(self):
+        domain = create_domain()
+        with SubdomainWriter(domain) as writer:
+            writer.extend(RISK_RESULTS)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+        response = self.client.get('/admin/gui/subdomain/', {'risk_score__gte': 2})
+        self.assertEqual({obj.name for obj in response.context['cl'].result_list}, {'old.example.com', 'cdn.example.com'})
+        response = self.client.get('/admin/gui/subdomain/', {'http_only__exact': 1})
+        self.assertEqual([obj.name for obj in response.context['cl'].result_list], ['plain.example.com'])
+
+        column = response.context['cl'].list_display.index('risk_score')
+        response = self.client.get('/admin/gui/subdomain/', {'o': f"-{column}"})
+        self.assertEqual(response.context['cl'].result_list[0].risk_score, 2)
+        self.assertEqual(response.context['cl'].result_list[3].name, 'ok.example.com')
+
+    def test_backfill(self):
+        domain = create_domain()
+        with SubdomainWriter(domain) as writer:
+            writer.extend(RISK_RESULTS)
+        Subdomain.objects.update(http_only=False, cert_expired=False, cert_mismatch=False, risk_score=0)
+        call_command('backfill', 'risk', chunk=3, stdout=io.StringIO())
+        self.assertEqual(Subdomain.objects.filter(risk_score__gt=0).count(), 3)
+        self.assertTrue(Subdomain.objects.get(name='old.example.com').cert_expired)
+
+    def test_score_choices(self):
+        self.assertEqual(risk.scores(), [1, 2, 3, 4, 5])
+
+
+class StreamingTest(TestCase):
+    def test_engine_keeps_a_bounded_number_of_probes_in_flight(self):
+        domain = create_domain()
+        domain.threads = 2
+        submitted = []
+        consumed = []
+        # Source batch, queues and workers of the stages, results waiting for the caller
+        bound = SOURCE_BATCH + 4 * (2 + 2 * 2) + (1 + 2) + 10
+
+        def names():
+            for i in range(2000):
+                submitted.append(i)
+                # Candidates are only pulled when the stages have room
+                self.assertLessEqual(len(submitted) - len(consumed), bound)
+                yield f"host{i}.{domain.name}"
+
+        def probe_http(name, ips, domain):
+            return {"domain": name, "ip": ips, "http": [200, None, None], "https": [None, None, None]}
+
+        with mock.patch('gui.engine.sources', lambda domain, recon=None, seen=None: [('bruteforce', names())]), \
+                mock.patch('gui.engine.resolve', lambda name, domain, cache=None: ['10.0.0.1']), \
+                mock.patch('gui.engine.probe_http', probe_http), \
+                self.settings(ASYNC_RESULT_QUEUE=10, SCAN_STAGES={'certificate': {'workers': 2}}):
+            for result in engine.stream(domain):
+                consumed.append(result)
+                if len(consumed) % 100 == 0:
+                    time.sleep(0.01)
+        self.assertEqual(len(consumed), 2000)
+
+    def test_progress_is_published_at_a_bounded_frequency(self):
+        domain = create_domain()
+        progress = ScanProgress(domain, {}, interval=3600)
+        progress.update(1)
+        progress.update(2)
+        self.assertEqual(Domain.objects.get().messages['count'], 1)
+        progress.update(3, force=True)
+        self.assertEqual(Domain.objects.get().messages['count'], 3)
+
+    def test_scan_streams_results_into_the_database(self):
+        domain = create_domain()
+        with patch(FakeKnockpy(count=2500)):
+            call_command('scan', domain.id)
+        domain.refresh_from_db()
+        self.assertTrue(domain.completed)
+        self.assertEqual(domain.messages['count'], 2500)
+        self.assertTrue(domain.messages['finished'])
+        self.assertEqual(Subdomain.objects.count(), 2500)
+
+
+class WordlistTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(WORDLIST_DIR=os.path.join(self.directory, 'compiled')))
+        self.source = os.path.join(self.directory, 'words.txt')
+        with open(self.source, 'w') as f:
+            f.write('www\nAPI\n\n  mail \napi\nbad label\n-dash\ndev.internal\nwww.\n')
+
+    def test_compile_normalizes_dedupes_and_sorts(self):
+        wordlist = wordlists.compile_wordlist(Wordlist(name='Common words', source=self.source))
+        self.assertEqual(list(wordlists.words(wordlist.path)), ['api', 'dev.internal', 'mail', 'www'])
+        self.assertEqual(wordlist.entries, 4)
+        self.assertEqual(len(wordlist.checksum), 64)
+
+    def test_recompiling_replaces_the_file(self):
+        wordlist = wordlists.compile_wordlist(Wordlist(name='common', source=self.source))
+        first = wordlist.path
+        with open(self.source, 'a') as f:
+            f.write('vpn\n')
+        wordlists.compile_wordlist(wordlist)
+        self.assertNotEqual(wordlist.path, first)
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(wordlist.entries, 5)
+
+    def test_scans_share_one_mapping(self):
+        wordlist = wordlists.compile_wordlist(Wordlist(name='common', source=self.source))
+        self.assertIs(wordlists.open_compiled(wordlist.path), wordlists.open_compiled(wordlist.path))
+
+    def test_mappings_of_replaced_files_are_dropped(self):
+        wordlist = wordlists.compile_wordlist(Wordlist(name='common', source=self.source))
+        first = wordlist.path
+        reading = wordlists.words(first)
+        self.assertEqual(next(reading), 'api')
+        with open(self.source, 'a') as f:
+            f.write('vpn\n')
+        wordlists.compile_wordlist(wordlist)
+        self.assertNotIn(first, wordlists._maps)
+        # A scan already reading the old file finishes it
+        self.assertEqual(list(reading), ['dev.internal', 'mail', 'www'])
+        with self.assertRaises(wordlists.WordlistError):
+            wordlists.open_compiled(first)
+
+        # Replaced in place by another process
+        path = os.path.join(self.directory, 'other.kwl')
+        wordlists.compile_file(self.source, path)
+        self.assertIn('vpn', wordlists.words(path))
+        with open(self.source, 'w') as f:
+            f.write('ftp\n')
+        wordlists.compile_file(self.source, path)
+        self.assertEqual(list(wordlists.words(path)), ['ftp'])
+
+    def test_domain_bruteforce_uses_the_compiled_wordlist(self):
+        call_command('compile_wordlist', 'common', self.source, stdout=io.StringIO())
+        domain = create_domain()
+        domain.recon = False
+        domain.bruteforce = True
+        domain.wordlist_file = Wordlist.objects.get(name='common')
+        self.assertEqual([name for _, names in engine.sources(domain) for name in names][:2], ['api.example.com', 'dev.internal.example.com'])
+
+    def test_uncompiled_wordlist_is_an_error(self):
+        domain = create_domain()
+        domain.bruteforce = True
+        domain.wordlist_file = Wordlist.objects.create(name='common', source=self.source)
+        with self.assertRaises(wordlists.WordlistError):
+            list(engine.domain_words(domain))
+
+
+class AsyncEngineTest(TestCase):
+    records = {f"host{i}.example.com": [f"10.0.0.{i}"] for i in range(1, 51)}
+
+    def resolve(self, server, names, **kwargs):
+        async def run():
+            async with AsyncResolver('127.0.0.1', port=server.port, **kwargs) as resolver:
+                return await asyncio.gather(*(resolver.resolve(name) for name in names))
+        return asyncio.run(run())
+
+    def test_resolver_answers_and_nxdomain(self):
+        with StubDNSServer(self.records) as server:
+            answers = self.resolve(server, ['host1.example.com', 'missing.example.com'])
+        self.assertEqual(answers, [['10.0.0.1'], None])
+
+    def test_resolver_retries_lost_queries(self):
+        with StubDNSServer(self.records, drop=1) as server:
+            answers = self.resolve(server, ['host2.example.com'], timeout=0.2, retries=1)
+        self.assertEqual(answers, [['10.0.0.2']])
+        self.assertEqual(server.queries, 2)
+
+    def test_asyncio_resolver_skips_malformed_names(self):
+        with StubDNSServer(self.records) as server:
+            answers = self.resolve(server, ['a..example.com', 'x' * 64 + '.example.com', 'host3.example.com'])
+        self.assertEqual(answers, [None, None, ['10.0.0.3']])
+        self.assertEqual(server.queries, 1)
+
+    def test_malformed_names_are_unresolved(self):
+        domain = create_domain()
+        domain.dns = '127.0.0.1'
+        with StubDNSServer(self.records) as server, self.settings(ASYNC_DNS_PORT=server.port):
+            for word in ['a.', '-' * 64]:
+                self.assertIsNone(engine.resolve(f"{word}.example.com", domain))
+            self.assertEqual(engine.resolve('host1.example.com', domain), ['10.0.0.1'])
+
+    def test_asyncio_engine_streams_resolved_names(self):
+        domain = create_domain()
+        domain.engine = 'asyncio'
+        domain.dns = '127.0.0.1'
+        names = [f"host{i}.example.com" for i in range(1, 101)]
+
+        async def probe_http(prober, name, ips):
+            return {"domain": name, "ip": ips, "http": [200, None, None], "https": [None, None, None]}
+
+        stages = {}
+        with StubDNSServer(self.records) as server, \
+                self.settings(ASYNC_DNS_PORT=server.port, ASYNC_DNS_TIMEOUT=0.5, ASYNC_DNS_RETRIES=1), \
+                mock.patch('gui.engine.sources', lambda domain, recon=None, seen=None: [('bruteforce', iter(names))]), \
+                mock.patch('gui.engine.HTTPProber.probe_http', probe_http):
+            results = list(engine.stream(domain, stats=stages))
+
+        self.assertEqual(sorted(result['domain'] for result in results), sorted(self.records))
+        self.assertEqual((stages['resolve']['in'], stages['resolve']['out']), (100, 50))
+        self.assertEqual(stages['write']['out'], 50)
+
+    def test_results_are_labelled_with_their_source(self):
+        domain = create_domain()
+        domain.engine = 'asyncio'
+        domain.dns = '127.0.0.1'
+
+        def sources(domain, recon=None, seen=None):
+            seen.add('host1.example.com')
+            return [('recon', iter(['host1.example.com'])), ('bruteforce', iter(['host2.example.com']))]
+
+        async def probe_http(prober, name, ips):
+            return {"domain": name, "ip": ips, "http": [200, None, None], "https": [None, None, None]}
+
+        with StubDNSServer(self.records) as server, self.settings(ASYNC_DNS_PORT=server.port), \
+                mock.patch('gui.engine.sources', sources), mock.patch('gui.engine.HTTPProber.probe_http', probe_http):
+            results = list(engine.stream(domain))
+        self.assertEqual({result['domain']: result['source'] for result in results},
+                         {'host1.example.com': 'recon', 'host2.example.com': 'bruteforce'})
+
+
+class DNSCacheTest(TestCase):
+    records = {'www.example.com': ['10.0.0.1']}
+
+    def setUp(self):
+        self.domain = create_domain()
+        self.domain.dns = '127.0.0.1'
+
+    def cache(self):
+        return DNSCache(self.domain.name, '127.0.0.1', lru=LRU(100))
+
+    def test_positive_and_negative_answers_are_cached(self):
+        cache = self.cache()
+        with StubDNSServer(self.records) as server, self.settings(ASYNC_DNS_PORT=server.port):
+            for _ in range(3):
+                self.assertEqual(engine.resolve('www.example.com', self.domain, cache), ['10.0.0.1'])
+                self.assertIsNone(engine.resolve('missing.example.com', self.domain, cache))
+        self.assertEqual(server.queries, 2)
+        self.assertEqual(cache.stats(), {"hits": 4, "shared": 0, "negative": 2, "misses": 2})
+
+    def test_ttl_is_respected(self):
+        cache = self.cache()
+        with StubDNSServer(self.records, ttl=30, negative_ttl=5) as server, self.settings(ASYNC_DNS_PORT=server.port):
+            engine.resolve('www.example.com', self.domain, cache)
+            engine.resolve('missing.example.com', self.domain, cache)
+            now = time.time()
+            with mock.patch('gui.dnscache.time.time', return_value=now + 10):
+                # The SOA minimum bounds the negative answer
+                self.assertEqual(cache.get('www.example.com'), (True, ['10.0.0.1']))
+                self.assertEqual(cache.get('missing.example.com'), (False, None))
+            with mock.patch('gui.dnscache.time.time', return_value=now + 31):
+                self.assertEqual(cache.get('www.example.com'), (False, None))
+
+    def test_answers_are_shared_through_the_database(self):
+        cache = self.cache()
+        cache.put('www.example.com', ['10.0.0.1'], 300)
+        cache.put('missing.example.com', None, None)
+        cache.put('gone.example.com', ['10.0.0.2'], 0)
+        self.assertEqual(cache.flush(), 2)
+
+        other = self.cache()
+        self.assertEqual(other.warm(), 2)
+        self.assertEqual(other.get('www.example.com'), (True, ['10.0.0.1']))
+        self.assertEqual(other.get('missing.example.com'), (True, None))
+        self.assertEqual(other.stats()['shared'], 2)
+
+    def test_asyncio_resolver_uses_the_cache(self):
+        cache = self.cache()
+        with StubDNSServer(self.records) as server:
+            async def run():
+                async with AsyncResolver('127.0.0.1', port=server.port, cache=cache) as resolver:
+                    return [await resolver.resolve('www.example.com') for _ in range(3)]
+            self.assertEqual(asyncio.run(run()), [['10.0.0.1']] * 3)
+        self.assertEqual(server.queries, 1)
+
+    def test_scan_reports_the_counters(self):
+        with patch(FakeKnockpy(count=5)):
+            call_command('scan', self.domain.id)
+        self.domain.refresh_from_db()
+        self.assertEqual(set(self.domain.messages['dns']), {"hits", "shared", "negative", "misses"})
+
+
+RECON_ANSWERS = {
+    'crtsh': json.dumps([{"common_name": "www.example.com"}, {"common_name": "*.example.com"}, {"common_name": "evil.com"}]),
+    'hackertarget': "api.example.com,10.0.0.1\nWWW.example.com,10.0.0.2\n",
+    'alienvault': json.dumps({"passive_dns": [{"hostname": "mail.example.com"}, {"hostname": "notexample.com"}]}),
+    'virustotal': json.dumps({"subdomains": ["vt.example.com"]}),
+    'shodan': json.dumps({"subdomains": ["", "dev"]}),
+}
+
+
+class ReconTest(TestCase):
+    def test_sources_are_parsed_and_cached(self):
+        with StubReconServer(RECON_ANSWERS) as server:
+            client = Recon(urls=server.urls())
+            self.assertEqual(set(client.names('Example.com')), {'www.example.com', 'api.example.com', 'mail.example.com'})
+            # No key: the sources needing one are not asked
+            self.assertNotIn('virustotal', server.requests)
+            self.assertEqual(client.stats, {"cached": 0, "fetched": 3, "failed": 3, "limited": 0})
+
+            again = Recon(urls=server.urls())
+            self.assertEqual(len(again.names('example.com')), 3)
+            self.assertEqual(server.requests['crtsh'], 1)
+            # Failed sources are asked again
+            self.assertEqual(server.requests['rapiddns'], 2)
+            self.assertEqual(again.stats["cached"], 3)
+        self.assertEqual(ReconAnswer.objects.filter(domain='example.com').count(), 3)
+
+    def test_expired_answers_are_fetched_again(self):
+        with StubReconServer(RECON_ANSWERS) as server:
+            Recon(urls=server.urls()).names('example.com')
+            ReconAnswer.objects.update(expires_at=timezone.now())
+            Recon(urls=server.urls()).names('example.com')
+            self.assertEqual(server.requests['crtsh'], 2)
+
+    def test_keys_are_passed_explicitly(self):
+        with StubReconServer(RECON_ANSWERS) as server:
+            names = Recon({'virustotal': 'vt-1', 'shodan': 'sh-1'}, urls=server.urls()).names('example.com')
+        self.assertTrue({'vt.example.com', 'example.com', 'dev.example.com'} <= set(names))
+        self.assertEqual(server.keys, {'virustotal': {'vt-1'}, 'shodan': {'sh-1'}})
+
+        Apikey.objects.create(virustotal='vt-2', shodan='sh-2')
+        domain = create_domain()
+        used = []
+
+        def fake_stream(domain, cache=None, stats=None, recon=None):
+            used.append(recon)
+            return iter([])
+
+        with patch(FakeKnockpy()), mock.patch('gui.engine.stream', fake_stream):
+            call_command('scan', domain.id)
+        self.assertEqual(used[0].keys, {'virustotal': 'vt-2', 'shodan': 'sh-2'})
+        self.assertNotIn('API_KEY_VIRUSTOTAL', os.environ)
+        self.assertIn('recon', Domain.objects.get(id=domain.id).messages)
+
+    @override_settings(RECON_RATE_LIMITS={'virustotal': (2, 3600)}, RECON_RATE_WAIT=0)
+    def test_rate_limit_is_shared_per_key(self):
+        with StubReconServer(RECON_ANSWERS) as server:
+            for name in ('a.com', 'b.com', 'c.com'):
+                # A client per scan, like the workers: the bucket is in the database
+                Recon({'virustotal': 'vt-1'}, urls=server.urls()).names(name)
+            self.assertEqual(server.requests['virustotal'], 2)
+
+            client = Recon({'virustotal': 'vt-2'}, urls=server.urls())
+            client.names('c.com')
+            self.assertEqual(server.requests['virustotal'], 3)
+            self.assertEqual(client.stats["limited"], 0)
+        self.assertEqual(RateBucket.objects.count(), 2)
+        self.assertFalse(RateBucket.objects.filter(key__contains='vt-1').exists())
+
+    def test_token_bucket(self):
+        # 4 tokens per minute: one every 15 seconds
+        self.assertEqual(recon.spend(0, 0, 4, 60, 15), (0, 0))
+        self.assertEqual(recon.spend(0.5, 0, 4, 60, 0), (0.5, 7.5))
+        self.assertEqual(recon.spend(4, 0, 4, 60, 600), (3, 0))
+
+    def test_memory_store(self):
+        store = recon.MemoryStore()
+        with StubReconServer(RECON_ANSWERS) as server:
+            Recon(urls=server.urls(), store=store).names('example.com')
+            Recon(urls=server.urls(), store=store).names('example.com')
+            self.assertEqual(server.requests['crtsh'], 1)
+        self.assertFalse(ReconAnswer.objects.exists())
+
+
+class ProberTest(TestCase):
+    def setUp(self):
+        certificates.cache.clear()
+
+    def probe(self, server, names, **kwargs):
+        async def run():
+            async with HTTPProber(timeout=2, **kwargs) as prober:
+                results = await asyncio.gather(*(prober.probe(name, ['127.0.0.1']) for name in names))
+                return results, prober
+        with self.settings(PROBE_HTTP_PORT=server.http_port, PROBE_HTTPS_PORT=server.https_port):
+            return asyncio.run(run())
+
+    def test_results_match_the_knock_shape(self):
+        with StubHTTPServer(status=200, server='edge', names=['*.example.com']) as server:
+            (result,), prober = self.probe(server, ['www.example.com'])
+        self.assertEqual(result['http'], [200, None, 'edge'])
+        self.assertEqual(result['https'], [200, None, 'edge'])
+        self.assertTrue(result['cert'][0])
+        self.assertEqual(result['cert'][2], '*.example.com')
+
+    def test_certificate_for_another_name_is_not_valid(self):
+        with StubHTTPServer(names=['other.org']) as server:
+            (result,), prober = self.probe(server, ['www.example.com'])
+        self.assertFalse(result['cert'][0])
+
+    def test_connections_to_a_shared_address_are_reused(self):
+        names = [f"host{i}.example.com" for i in range(30)]
+        with StubHTTPServer(names=['*.example.com']) as server:
+            results, prober = self.probe(server, names, concurrency=4, rate=10000, burst=10000)
+        self.assertEqual(server.requests, 60)
+        # 4 requests at once: HTTP shares at most 4 connections for the 30
+        # names, HTTPS as many for the TLS name of the wildcard certificate
+        # once it is known
+        self.assertLessEqual(server.connections, 4 + 8)
+        self.assertEqual(prober.opened, server.connections)
+        self.assertTrue(all(result['http'][0] == 200 and result['cert'][0] for result in results))
+
+    def test_idle_connections_are_capped_and_expire(self):
+        class IdleConnection:
+            usable = True
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        prober = HTTPProber()
+        connections = [IdleConnection() for _ in range(5)]
+        with self.settings(HTTP_IDLE_CONNECTIONS=3, HTTP_IDLE_TIMEOUT=10):
+            for i, idle in enumerate(connections):
+                prober.release(('10.0.0.1', 80, None if i % 2 else f"h{i}.example.com"), idle)
+            self.assertEqual([idle.closed for idle in connections], [True, True, False, False, False])
+
+            later = time.monotonic() + 11
+            with mock.patch('gui.prober.time.monotonic', return_value=later):
+                prober.release(('10.0.0.2', 80, None), IdleConnection())
+        self.assertTrue(all(idle.closed for idle in connections))
+        self.assertEqual(list(prober.pools), [('10.0.0.2', 80, None)])
+
+    def test_limits_are_shared_by_the_scans_of_a_process(self):
+        self.assertIs(HTTPProber().limits, HTTPProber().limits)
+        self.assertIsNot(HTTPProber(concurrency=4).limits, HTTPProber().limits)
+
+        limiter = Limiter(2)
+        active = []
+        peak = []
+
+        async def scan():
+            async def request():
+                async with limiter:
+                    active.append(1)
+                    peak.append(len(active))
+                    await asyncio.sleep(0.01)
+                    active.pop()
+            await asyncio.gather(*(request() for _ in range(10)))
+
+        scans = [threading.Thread(target=asyncio.run, args=(scan(),)) for _ in range(3)]
+        for thread in scans:
+            thread.start()
+        for thread in scans:
+            thread.join()
+        self.assertEqual((len(peak), max(peak), limiter.value), (30, 2, 2))
+
+    def test_misdirected_requests_get_the_sni_of_their_name(self):
+        certificates.cache.put('10.0.0.1', 'www.example.com', {
+            "fingerprint": "f", "common_name": "*.example.com", "not_after": "2030-01-01", "sans": ["*.example.com"],
+        })
+
+        class ClosedConnection:
+            def certificate(self):
+                return None
+
+            def close(self):
+                pass
+
+        keys = []
+
+        async def exchange(key, name):
+            keys.append(key)
+            return ClosedConnection(), 421 if key[2] != name else 200, {}, False
+
+        prober = HTTPProber(rate=1000, burst=1000)
+        with mock.patch.object(prober, 'exchange', exchange):
+            self.assertEqual(asyncio.run(prober.request('https', 'api.example.com', '10.0.0.1'))[0][0], 200)
+            asyncio.run(prober.request('https', 'dev.example.com', '10.0.0.1'))
+        port = prober.ports['https']
+        self.assertEqual(keys, [('10.0.0.1', port, 'www.example.com'), ('10.0.0.1', port, 'api.example.com'),
+                                ('10.0.0.1', port, 'dev.example.com')])
+
+    def test_probes_fill_the_certificate_cache(self):
+        with StubHTTPServer(names=['*.example.com']) as server:
+            (result,), prober = self.probe(server, ['www.example.com'])
+        self.assertEqual(result['certificate']['sans'], ['*.example.com'])
+        self.assertEqual(certificates.cache.get('127.0.0.1', 'api.example.com'), result['certificate'])
+
+    def test_requests_per_ip_are_rate_limited(self):
+        with StubHTTPServer() as server, self.settings(PROBE_HTTP_PORT=server.http_port):
+            async def run():
+                async with HTTPProber(timeout=2, rate=20, burst=1) as prober:
+                    await asyncio.gather(*(prober.request('http', f"h{i}.example.com", '127.0.0.1') for i in range(6)))
+            asyncio.run(run())
+        # One request at once, then one every 50 ms
+        self.assertGreaterEqual(server.times[-1] - server.times[0], 0.2)
+
+
+class PipelineTest(TestCase):
+    def run_pipeline(self, names, stages, **kwargs):
+        pipeline = Pipeline([('names', names)], stages, **kwargs)
+        asyncio.run(pipeline.run())
+        return pipeline.stats()
+
+    def test_stages_record_counts_and_latencies(self):
+        async def double(item):
+            return item * 2
+
+        written = []
+        stats = self.run_pipeline(range(100), [
+            Stage('double', double, 5),
+            Stage('odd', lambda item: item if item % 4 else None, 2, blocking=True),
+            Stage('write', written.append, 1, blocking=True),
+        ])
+        self.assertEqual(sorted(written), [i for i in range(0, 200, 2) if i % 4])
+        self.assertEqual((stats['names']['out'], stats['double']['out'], stats['odd']['out']), (100, 100, 50))
+        self.assertIsNotNone(stats['odd']['p99'])
+
+    def test_items_over_the_timeout_are_dropped(self):
+        async def slow(item):
+            await asyncio.sleep(1 if item == 3 else 0)
+            return item
+
+        stats = self.run_pipeline(range(5), [Stage('slow', slow, 5, timeout=0.1)])
+        self.assertEqual((stats['slow']['out'], stats['slow']['timeouts']), (4, 1))
+
+    def test_a_slow_stage_holds_back_the_others(self):
+        read = []
+
+        def names():
+            for i in range(200):
+                read.append(i)
+                yield i
+
+        async def slow(item):
+            # Items read but not done: the queue, the workers and a source batch
+            self.assertLessEqual(len(read) - item, SOURCE_BATCH + 2 * 2 + 2 + 1)
+            await asyncio.sleep(0.001)
+            return item
+
+        stats = self.run_pipeline(names(), [Stage('slow', slow, 1)], queue_per_worker=2)
+        self.assertGreater(stats['names']['blocked'], 0)
+
+    def test_errors_stop_the_pipeline(self):
+        async def fail(item):
+            raise ValueError(item)
+
+        with self.assertRaises(ValueError):
+            self.run_pipeline(range(10), [Stage('fail', fail, 2)])
+
+    def test_scan_records_the_stages_with_the_run(self):
+        domain = create_domain()
+        domain.bruteforce = True
+
+        def fake_stream(domain, cache=None, stats=None, recon=None):
+            stats.update({"resolve": {"wall": 2.0, "p50": 0.1}, "http": {"wall": 5.0, "p50": 1.0}})
+            return iter(generate(domain.name, 3))
+
+        with patch(FakeKnockpy()), mock.patch('gui.engine.stream', fake_stream):
+            call_command('scan', domain.id)
+        self.assertEqual(ScanRun.objects.get().stages['http']['wall'], 5.0)
+        domain.refresh_from_db()
+        self.assertEqual(domain.messages['slowest'], ['http', 5.0])
+
+
+class CertificateTest(TestCase):
+    def setUp(self):
+        certificates.cache.clear()
+
+    def test_one_handshake_per_certificate_and_address(self):
+        names = [f"host{i}.example.com" for i in range(20)]
+        with StubHTTPServer(names=['*.example.com']) as server, self.settings(PROBE_HTTPS_PORT=server.https_port):
+            found = [certificates.certificate_for('127.0.0.1', name, 2) for name in names]
+        self.assertEqual(len({certificate["fingerprint"] for certificate in found}), 1)
+        self.assertEqual((certificates.cache.misses, certificates.cache.shared), (1, 19))
+
+    def test_names_not_covered_get_their_own_handshake(self):
+        with StubHTTPServer(names=['www.example.com']) as server, self.settings(PROBE_HTTPS_PORT=server.https_port):
+            certificates.certificate_for('127.0.0.1', 'www.example.com', 2)
+            certificates.certificate_for('127.0.0.1', 'api.example.com', 2)
+        self.assertEqual(certificates.cache.misses, 2)
+
+    def test_cache_keeps_the_recent_hosts_and_drops_expired_certificates(self):
+        cache = certificates.CertificateCache(size=2)
+        for i in range(3):
+            cache.put(f"10.0.0.{i}", f"host{i}.example.com", {"fingerprint": str(i), "sans": []})
+        self.assertEqual((len(cache.by_name), len(cache.by_ip)), (2, 2))
+        self.assertIsNone(cache.get('10.0.0.0', 'host0.example.com'))
+
+        with self.settings(CERT_CACHE_TTL=-1):
+            cache.put('10.0.0.9', 'www.example.com', {"fingerprint": "9", "sans": ['*.example.com']})
+        self.assertIsNone(cache.get('10.0.0.9', 'api.example.com'))
+        self.assertNotIn('10.0.0.9', cache.by_ip)
+
+    def test_validity_depends_on_the_name(self):
+        certificate = {"fingerprint": "0" * 64, "common_name": "*.example.com", "not_after": "2999-01-01",
+                       "sans": ["*.example.com"]}
+        self.assertEqual(certificates.status(certificate, 'www.example.com'), (True, '2999-01-01', '*.example.com'))
+        self.assertFalse(certificates.status(certificate, 'a.b.example.com')[0])
+        self.assertFalse(certificates.status(dict(certificate, not_after='2000-01-01'), 'www.example.com')[0])
+
+    def test_knock_results_get_a_derived_fingerprint(self):
+        first = certificates.from_knock([True, '2030-01-01', '*.example.com'])
+        self.assertEqual(first, certificates.from_knock([False, '2030-01-01', '*.example.com']))
+        self.assertIsNone(certificates.from_knock([None, None, None]))
+
+
+class HistoryTest(TestCase):
+    def test_diff_uses_names_and_digests(self):
+        previous = {'a': '1', 'b': '2', 'c': '3'}
+        current = {'b': '2', 'c': '4', 'd': '5'}
+        self.assertEqual(diff(previous, current), ({'d'}, {'a'}, {'c'}))
+
+    def test_incremental_scans_record_and_apply_the_changes(self):
+        domain = create_domain()
+        first = [make_result('a.example.com', ['10.0.0.1']), make_result('b.example.com', ['10.0.0.2'])]
+        second = [make_result('b.example.com', ['10.0.0.3']), make_result('c.example.com', ['10.0.0.4'])]
+
+        for results in (first, second):
+            knockpy = FakeKnockpy()
+            knockpy.scan = lambda name, results=results: iter(results)
+            with patch(knockpy):
+                call_command('scan', domain.id)
+
+        run = ScanRun.objects.filter(domain=domain).first()
+        self.assertEqual((run.count, run.added, run.removed, run.changed), (2, 1, 1, 1))
+        self.assertEqual(
+            set(run.changes.values_list('name', 'kind')),
+            {('c.example.com', ScanChange.ADDED), ('a.example.com', ScanChange.REMOVED), ('b.example.com', ScanChange.CHANGED)},
+        )
+        # Subdomain holds what the last run saw
+        self.assertEqual(
+            dict(Subdomain.objects.values_list('name', 'ip')),
+            {'b.example.com': {'ip': ['10.0.0.3']}, 'c.example.com': {'ip': ['10.0.0.4']}},
+        )
+
+
+class WildcardTest(TestCase):
+    def test_fingerprint_collects_rotating_answers(self):
+        domain = create_domain()
+        answers = iter([['10.0.0.1'], ['10.0.0.2'], None, ['10.0.0.1']])
+        found = wildcard.detect(domain, resolve=lambda name, domain: next(answers),
+                                signature=lambda name, domain: (200, 'nginx'))
+        self.assertEqual(found.ips, {'10.0.0.1', '10.0.0.2'})
+        self.assertTrue(found.matches(make_result('x.example.com', ['10.0.0.2'], http=[200, None, 'nginx'])))
+        self.assertFalse(found.matches(make_result('x.example.com', ['10.0.0.2'], http=[301, '/', 'apache'])))
+        self.assertFalse(found.matches(make_result('x.example.com', ['10.9.9.9'])))
+
+    def test_fingerprint_is_stored_per_domain(self):
+        domain = create_domain()
+        with mock.patch('gui.wildcard.detect', return_value=wildcard.Fingerprint(['10.0.0.1'], [(200, 'nginx')])) as detect:
+            wildcard.fingerprint(domain)
+            found = wildcard.fingerprint(domain)
+        self.assertEqual(detect.call_count, 1)
+        self.assertEqual((found.ips, found.signatures), ({'10.0.0.1'}, {(200, 'nginx')}))
+        self.assertEqual(WildcardFingerprint.objects.get().domain, 'example.com')
+
+        WildcardFingerprint.objects.update(expires_at=timezone.now())
+        with mock.patch('gui.wildcard.detect', return_value=wildcard.Fingerprint([], [])) as detect:
+            self.assertFalse(wildcard.fingerprint(domain))
+        self.assertEqual(detect.call_count, 1)
+
+    def test_http_is_not_probed_without_the_filter(self):
+        domain = create_domain()
+        domain.wildcard = False
+        found = wildcard.detect(domain, resolve=lambda name, domain: ['10.0.0.1'], signature=None)
+        self.assertEqual((found.ips, found.signatures), ({'10.0.0.1'}, set()))
+        with mock.patch('gui.wildcard.detect', return_value=found) as detect:
+            self.assertTrue(wildcard.fingerprint(domain))
+        detect.assert_called_once_with(domain, signature=None)
+        self.assertFalse(WildcardFingerprint.objects.exists())
+
+    def test_scan_filters_wildcard_hits(self):
+        domain = create_domain()
+        results = [make_result('www.example.com', ['10.0.0.9']), make_result('abc.example.com', ['10.0.0.1'])]
+        knockpy = FakeKnockpy(wildcard=wildcard.Fingerprint(['10.0.0.1'], []))
+        knockpy.scan = lambda name: iter(results)
+        with patch(knockpy):
+            call_command('scan', domain.id)
+        domain.refresh_from_db()
+        self.assertEqual(list(Subdomain.objects.values_list('name', flat=True)), ['www.example.com'])
+        self.assertEqual((domain.messages['wildcard'], domain.messages['filtered']), (True, 1))
+
+    def test_recon_names_on_the_wildcard_addresses_are_kept(self):
+        domain = create_domain()
+        results = [dict(make_result('mail.example.com', ['10.0.0.1']), source='recon'),
+                   dict(make_result('abc.example.com', ['10.0.0.1']), source='bruteforce')]
+        knockpy = FakeKnockpy(wildcard=wildcard.Fingerprint(['10.0.0.1'], []))
+        knockpy.scan = lambda name: iter(results)
+        with patch(knockpy):
+            call_command('scan', domain.id)
+        self.assertEqual(list(Subdomain.objects.values_list('name', flat=True)), ['mail.example.com'])
+
+
+class FacetTest(TestCase):
+    def test_facets_count_the_values_per_domain(self):
+        first, second = create_domain('a.com'), create_domain('b.com')
+        for domain, servers in ((first, ['nginx', 'nginx', None]), (second, ['nginx', 'Apache'])):
+            with SubdomainWriter(domain) as writer:
+                for i, server in enumerate(servers):
+                    writer.add(make_result(f"h{i}.{domain.name}", ['10.0.0.1'], http=[200, None, server]))
+            refresh_facets(domain)
+
+        self.assertEqual(facet_choices('http_server', first.id), [('nginx', 2)])
+        self.assertEqual(facet_choices('http_server'), [('Apache', 1), ('nginx', 3)])
+        self.assertEqual(facet_choices('http_status'), [('200', 5)])
+
+    def test_facets_follow_the_writes(self):
+        domain = create_domain()
+        with SubdomainWriter(domain, batch_size=2) as writer:
+            for i, server in enumerate(['nginx', 'nginx', 'Apache']):
+                writer.add(make_result(f"h{i}.example.com", ['10.0.0.1'], http=[200, None, server]))
+            writer.add(make_result('h0.example.com', ['10.0.0.1'], http=[200, None, 'IIS']))
+        self.assertEqual(facet_choices('http_server', domain.id), [('Apache', 1), ('nginx', 2)])
+
+        # Rescanned rows move from their old values to the new ones
+        with SubdomainWriter(domain, update=True) as writer:
+            writer.add(make_result('h0.example.com', ['10.0.0.1'], http=[404, None, 'Apache']))
+            writer.add(make_result('h2.example.com', ['10.0.0.1'], http=[200, None, 'nginx']))
+        self.assertEqual(facet_choices('http_server', domain.id), [('Apache', 1), ('nginx', 2)])
+        self.assertEqual(facet_choices('http_status', domain.id), [('200', 2), ('404', 1)])
+
+        counted = list(SubdomainFacet.objects.values_list('field', 'value', 'count').order_by('field', 'value'))
+        refresh_facets(domain)
+        self.assertEqual(list(SubdomainFacet.objects.values_list('field', 'value', 'count').order_by('field', 'value')), counted)
+
+    def test_backfill_counts_the_facets_of_every_domain(self):
+        domain = create_domain()
+        with SubdomainWriter(domain) as writer:
+            writer.add(make_result('a.example.com', ['10.0.0.1']))
+        SubdomainFacet.objects.all().delete()
+        call_command('backfill', 'facets', stdout=io.StringIO())
+        self.assertEqual(facet_choices('http_server', domain.id), [('nginx', 1)])
+
+    def test_changelist_filters_with_facets(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        domain = create_domain()
+        with SubdomainWriter(domain) as writer:
+            writer.add(make_result('a.example.com', ['10.0.0.1'], http=[200, None, 'nginx']))
+            writer.add(make_result('b.example.com', ['10.0.0.1'], http=[404, None, 'Apache']))
+        refresh_facets(domain)
+
+        response = self.client.get(f"/admin/gui/subdomain/?domain={domain.id}&http_server__exact=Apache")
+        self.assertContains(response, 'Apache (1)')
+        self.assertContains(response, 'nginx (1)')
+        self.assertEqual([obj.name for obj in response.context['cl'].result_list], ['b.example.com'])
+
+
+class AddressTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.domain = create_domain()
+        with SubdomainWriter(self.domain) as writer:
+            writer.add(make_result('a.example.com', ['10.0.0.1', '10.0.0.2']))
+            writer.add(make_result('b.example.com', ['10.0.0.2']))
+            writer.add(make_result('c.example.com', ['192.168.1.10']))
+
+    def search(self, term):
+        response = self.client.get('/admin/gui/subdomain/', {'q': term})
+        return sorted(obj.name for obj in response.context['cl'].result_list)
+
+    def test_addresses_are_stored_as_integers(self):
+        self.assertEqual(SubdomainIP.objects.count(), 4)
+        self.assertEqual(SubdomainIP.objects.get(address=167772161).subdomain.name, 'a.example.com')
+
+    def test_exact_ip_lists_its_subdomains(self):
+        self.assertEqual(self.search('10.0.0.2'), ['a.example.com', 'b.example.com'])
+
+    def test_cidr_range(self):
+        self.assertEqual(self.search('10.0.0.0/24'), ['a.example.com', 'b.example.com'])
+        self.assertEqual(self.search('192.168.0.0/16'), ['c.example.com'])
+
+    def test_names_are_still_searched(self):
+        self.assertEqual(self.search('b.example'), ['b.example.com'])
+
+    def test_update_replaces_the_addresses(self):
+        with SubdomainWriter(self.domain, update=True) as writer:
+            writer.add(make_result('a.example.com', ['10.0.0.3']))
+        self.assertEqual(self.search('10.0.0.1'), [])
+        self.assertEqual(self.search('10.0.0.3'), ['a.example.com'])
+
+    def test_backfill(self):
+        SubdomainIP.objects.all().delete()
+        call_command('backfill', 'ips', '--chunk', '2', stdout=mock.MagicMock())
+        self.assertEqual(SubdomainIP.objects.count(), 4)
+
+
+class GraphTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.domain = create_domain()
+        with SubdomainWriter(self.domain) as writer:
+            for i in range(5):
+                writer.add(make_result(f"cdn{i}.example.com", ['10.0.0.1'], http=[200, None, 'nginx']))
+            writer.add(make_result('www.example.com', ['10.0.0.2'], http=[404, None, 'Apache']))
+
+    def graph(self, **params):
+        response = self.client.get('/admin/gui/subdomain/graph/', {'domain': self.domain.id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_graph_nodes_and_links(self):
+        graph = self.graph()
+        self.assertEqual(len(graph['nodes']), 8)
+        self.assertEqual(len(graph['links']), 6)
+        self.assertFalse(graph['truncated'])
+
+    def test_shared_addresses_collapse(self):
+        graph = self.graph(collapse=1)
+        self.assertIn({'id': '5 subdomains on 10.0.0.1', 'group': 3, 'size': 5}, graph['nodes'])
+        self.assertEqual(len(graph['nodes']), 4)
+
+    def test_node_cap(self):
+        graph = self.graph(limit=4)
+        self.assertTrue(graph['truncated'])
+        self.assertLessEqual(len(graph['nodes']), 4)
+
+    def test_changelist_filters_apply(self):
+        graph = self.graph(http_server__exact='Apache')
+        self.assertEqual(graph['subdomains'], 1)
+
+    def test_graph_is_cached_per_scan_version(self):
+        self.graph()
+        with CaptureQueriesContext(connection) as context:
+            self.graph()
+        self.assertFalse([q for q in context.captured_queries if 'gui_subdomainip' in q['sql']])
+
+    def test_changelist_page_does_not_embed_the_graph(self):
+        response = self.client.get('/admin/gui/subdomain/', {'domain': self.domain.id})
+        self.assertContains(response, '/admin/gui/subdomain/graph/')
+        self.assertNotContains(response, 'cdn0.example.com", "group"')
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.domain = create_domain()
+        with SubdomainWriter(self.domain) as writer:
+            writer.extend(generate(self.domain.name, 30))
+        other = create_domain('other.com')
+        with SubdomainWriter(other) as writer:
+            writer.extend(generate(other.name, 10))
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def test_csv_is_written_in_chunks(self):
+        chunks = list(export(Subdomain.objects.filter(domain=self.domain), 'csv', chunk_size=7))
+        self.assertGreater(len(chunks), 4)
+        rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(rows[0]['domain'], 'example.com')
+
+    def test_admin_export_keeps_the_changelist_filters(self):
+        response = self.client.get('/admin/gui/subdomain/export/', {
+            'domain': self.domain.id, 'http_server__exact': 'nginx', 'format': 'jsonl',
+        })
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        expected = Subdomain.objects.filter(domain=self.domain, http_server='nginx').count()
+        self.assertEqual(len(rows), expected)
+        self.assertTrue(all(row['http_server'] == 'nginx' and isinstance(row['ip'], list) for row in rows))
+
+    def test_unknown_format(self):
+        response = self.client.get('/admin/gui/subdomain/export/', {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_exports_a_tag(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'other.jsonl')
+            call_command('export', tag='other.com', format='jsonl', output=output)
+            with open(output) as f:
+                self.assertEqual(len(f.readlines()), 10)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        data = b''.join(export(Subdomain.objects.all(), 'parquet', chunk_size=8))
+        parquet = pq.ParquetFile(io.BytesIO(data))
+        self.assertEqual(parquet.metadata.num_rows, 40)
+        self.assertEqual(parquet.num_row_groups, 5)
+
+
+class ImportTest(TestCase):
+    def test_names_are_validated_and_deduplicated(self):
+        names, invalid = parse_names([
+            'Example.com', 'example.com.', 'https://www.example.com/login', '# scope', '',
+            'not a domain', 'b.org  # comment',
+        ])
+        self.assertEqual(names, ['example.com', 'www.example.com', 'b.org'])
+        self.assertEqual(invalid, ['not a domain'])
+
+    def test_import_is_set_based(self):
+        create_domain('host0.example.com')
+        Tag.objects.create(name='host1.example.com')
+        lines = [f"host{i}.example.com" for i in range(200)]
+        with CaptureQueriesContext(connection) as context:
+            result = import_domains(lines, batch_size=50)
+        # A few queries per batch of 50, not per domain
+        self.assertLess(len(context.captured_queries), 40)
+        self.assertEqual((len(result.created), len(result.existing), result.queued), (199, 1, 199))
+        self.assertEqual(Tag.objects.count(), 200)
+        self.assertEqual(Domain.objects.get(name='host5.example.com').tag.name, 'host5.example.com')
+
+    def test_shared_tag_and_no_scan(self):
+        result = import_domains(['a.com', 'b.com'], tag='scope', scan=False, bruteforce=True)
+        self.assertEqual(result.queued, 0)
+        self.assertEqual(set(Domain.objects.values_list('tag__name', 'bruteforce')), {('scope', True)})
+        self.assertFalse(ScanJob.objects.exists())
+
+    def test_enqueue_scans_skips_waiting_jobs(self):
+        domains = [create_domain(f"d{i}.com") for i in range(5)]
+        enqueue_scan(domains[0])
+        self.assertEqual(enqueue_scans(domains, batch_size=2), 4)
+        self.assertEqual(ScanJob.objects.count(), 5)
+
+    def test_admin_upload(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        upload = SimpleUploadedFile('scope.txt', b'a.com\nb.com\na.com\n')
+        response = self.client.post('/admin/gui/domain/import/', {
+            'file': upload, 'recon': 'on', 'wildcard': 'on', 'scan': 'on',
+        })
+        self.assertRedirects(response, '/admin/gui/domain/', fetch_redirect_response=False)
+        self.assertEqual(Domain.objects.count(), 2)
+        self.assertEqual(ScanJob.objects.count(), 2)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write('a.com\nb.com\n')
+            f.flush()
+            call_command('import_domains', f.name, tag='scope', stdout=io.StringIO())
+        self.assertEqual(Domain.objects.filter(tag__name='scope').count(), 2)
+
+
+@override_settings(SCHEDULE_JITTER=0.1)
+class ScheduleTest(TestCase):
+    def test_due_domains_are_queued_and_rescheduled(self):
+        now = timezone.now()
+        tag = Tag.objects.create(name='scope', scan_interval=24)
+        due = Domain.objects.create(name='a.com', tag=tag, next_scan_at=now - timedelta(minutes=5))
+        own = Domain.objects.create(name='b.com', tag=tag, scan_interval=2, next_scan_at=now)
+        later = Domain.objects.create(name='c.com', tag=tag, next_scan_at=now + timedelta(hours=1))
+        self.assertEqual(schedule.run_due(now), (2, 0))
+        self.assertEqual(set(ScanJob.objects.values_list('domain__name', flat=True)), {'a.com', 'b.com'})
+        due.refresh_from_db()
+        own.refresh_from_db()
+        self.assertTrue(timedelta(hours=21.6) <= due.next_scan_at - now <= timedelta(hours=26.4))
+        self.assertTrue(timedelta(hours=1.8) <= own.next_scan_at - now <= timedelta(hours=2.2))
+        self.assertEqual(schedule.next_due(), Domain.objects.get(id=later.id).next_scan_at)
+
+    def test_active_scan_skips_the_run(self):
+        now = timezone.now()
+        domain = Domain.objects.create(name='a.com', scan_interval=1, next_scan_at=now)
+        ScanJob.objects.create(domain=domain, state=ScanJob.RUNNING)
+        self.assertEqual(schedule.run_due(now), (0, 1))
+        self.assertEqual(ScanJob.objects.count(), 1)
+        domain.refresh_from_db()
+        self.assertGreater(domain.next_scan_at, now)
+
+    def test_due_domains_are_read_from_the_index(self):
+        now = timezone.now()
+        for i in range(20):
+            Domain.objects.create(name=f"d{i}.com", scan_interval=1, next_scan_at=now + timedelta(minutes=i - 10))
+        with CaptureQueriesContext(connection) as context:
+            queued, skipped = schedule.run_due(now, limit=5)
+        self.assertEqual(queued, 5)
+        # The most overdue first
+        self.assertEqual(set(ScanJob.objects.values_list('domain__name', flat=True)), {f"d{i}.com" for i in range(5)})
+        select = next(query['sql'] for query in context.captured_queries if 'ORDER BY' in query['sql'])
+        plan = ' '.join(str(row) for row in connection.cursor().execute(f"EXPLAIN QUERY PLAN {select}").fetchall())
+        self.assertIn('next_scan_at', plan)
+        self.assertNotIn('SCAN gui_domain', plan)
+
+    def test_tag_interval_spreads_its_domains(self):
+        tag = Tag.objects.create(name='scope')
+        for i in range(50):
+            Domain.objects.create(name=f"d{i}.com", tag=tag)
+        own = Domain.objects.create(name='own.com', tag=tag, scan_interval=5)
+        now = timezone.now()
+        tag.scan_interval = 10
+        tag.save()
+        schedule.schedule_tag(tag, now)
+        times = list(Domain.objects.filter(tag=tag, scan_interval__isnull=True).values_list('next_scan_at', flat=True))
+        self.assertTrue(all(now <= time <= now + timedelta(hours=10) for time in times))
+        # Not a single start time for the whole tag
+        self.assertGreater(len({time.replace(second=0, microsecond=0) for time in times}), 25)
+        self.assertIsNone(Domain.objects.get(id=own.id).next_scan_at)
+
+        tag.scan_interval = None
+        tag.save()
+        schedule.schedule_tag(tag, now)
+        self.assertFalse(Domain.objects.filter(next_scan_at__isnull=False).exists())
+
+    def test_import_into_a_recurring_tag(self):
+        Tag.objects.create(name='scope', scan_interval=12)
+        import_domains(['a.com', 'b.com'], tag='scope')
+        self.assertFalse(Domain.objects.filter(next_scan_at__isnull=True).exists())
+
+    def test_command(self):
+        Domain.objects.create(name='a.com', scan_interval=1, next_scan_at=timezone.now())
+        out = io.StringIO()
+        call_command('scheduler', once=True, stdout=out)
+        self.assertIn('queued 1', out.getvalue())
+        self.assertEqual(ScanJob.objects.count(), 1)
+
+
+class BenchmarkSuiteTest(TestCase):
+    def baseline(self, **results):
+        return {"version": benchmarks.FORMAT_VERSION, "scale": 100, "results": results, "thresholds": {}}
+
+    def test_dataset_has_shared_addresses_and_a_wildcard_domain(self):
+        parts = list(benchmarks.dataset(1000))
+        self.assertEqual(sum(count for name, count, options in parts), 1000)
+        self.assertTrue(parts[-1][2]['wildcard'])
+        name, count, options = parts[0]
+        addresses = {result['ip'][0] for result in generate(name, count, **options)}
+        self.assertLessEqual(len(addresses), count // benchmarks.NAMES_PER_ADDRESS)
+
+    def test_slower_measurements_regress(self):
+        baseline = self.baseline(fast=0.001, page=0.1, graph=0.1)
+        baseline['thresholds'] = {'graph': 1.0}
+        current = self.baseline(fast=0.004, page=0.2, graph=0.15)
+        regressed = {name for name, before, now, change, regressed in benchmarks.compare(baseline, current) if regressed}
+        # fast: 4x slower but under BENCHMARK_MIN_DELTA; graph: within its own threshold
+        self.assertEqual(regressed, {'page'})
+
+    def test_baseline_of_another_scale_is_refused(self):
+        with self.assertRaises(benchmarks.BaselineError):
+            benchmarks.compare(self.baseline(page=0.1), dict(self.baseline(page=0.1), scale=1000))
+
+    def test_suite_saves_a_baseline(self):
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        call_command('benchmark', 'suite', scale=200, repeat=1, save=path, stdout=io.StringIO())
+        baseline = benchmarks.load(path)
+        self.assertEqual(baseline['scale'], 200)
+        self.assertIn('admin.subdomain_changelist.filtered', baseline['results'])
+        self.assertIn('graph.wildcard', baseline['results'])
+        # Everything written by the suite is rolled back
+        self.assertFalse(Domain.objects.exists())
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        metrics.store.clear()
+        self.addCleanup(metrics.store.clear)
+
+    def enabled(self, **kwargs):
+        return self.settings(METRICS_ENABLED=True, METRICS_DIR=self.directory.name, **kwargs)
+
+    def write_process(self, name, values, age=0):
+        path = os.path.join(self.directory.name, f"{name}.json")
+        with open(path, 'w') as f:
+            json.dump(values, f)
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    def test_hooks_record_nothing_when_disabled(self):
+        with self.settings(METRICS_ENABLED=False):
+            metrics.DNS_QUERIES.inc('answer')
+            metrics.DB_BATCHES.observe(0.1)
+            with SubdomainWriter(create_domain()) as writer:
+                writer.extend(generate('example.com', 3))
+        self.assertEqual(metrics.store.values, {})
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_ingestion_is_measured(self):
+        with self.enabled():
+            with SubdomainWriter(create_domain(), batch_size=2) as writer:
+                writer.extend(generate('example.com', 5))
+            # The rows already stored are not written again
+            with SubdomainWriter(Domain.objects.get(), batch_size=5) as writer:
+                writer.extend(generate('example.com', 5))
+            body = self.client.get('/metrics').content.decode()
+        self.assertIn('knockpy_db_rows_written_total 5', body)
+        self.assertIn('knockpy_db_write_batch_seconds_count 4', body)
+        self.assertIn('knockpy_db_write_batch_seconds_bucket{le="+Inf"} 4', body)
+        self.assertIn('knockpy_scan_jobs{state="queued"} 0', body)
+
+    def test_processes_are_added_up(self):
+        self.write_process('1-1', [['knockpy_dns_queries_total', ['answer'], 10], ['knockpy_active_workers', [], 1]])
+        # An exited worker: its counters stay, its gauges go
+        self.write_process('2-1', [['knockpy_dns_queries_total', ['answer'], 5], ['knockpy_active_workers', [], 1]], age=3600)
+        with self.enabled():
+            metrics.DNS_QUERIES.inc('answer')
+            body = metrics.exposition()
+        self.assertIn('knockpy_dns_queries_total{result="answer"} 16', body)
+        self.assertIn('knockpy_active_workers 1', body)
+
+    @unittest.skipIf(metrics.fcntl is None, "needs fcntl")
+    def test_files_of_exited_processes_are_folded(self):
+        # No process has this pid (above pid_max)
+        self.write_process('99999999-1', [['knockpy_dns_queries_total', ['answer'], 5], ['knockpy_active_workers', [], 1]])
+        with self.enabled():
+            metrics.DNS_QUERIES.inc('answer')
+            first = metrics.exposition()
+            second = metrics.exposition()
+        self.assertIn('knockpy_dns_queries_total{result="answer"} 6', first)
+        self.assertNotIn('knockpy_active_workers 1', first)
+        self.assertEqual(first, second)
+        self.assertEqual({name for name in os.listdir(self.directory.name) if name.endswith('.json')}, {metrics.EXITED, f"{metrics.store.process}.json"})
+
+    @unittest.skipIf(metrics.fcntl is None, "needs fcntl")
+    def test_file_is_removed_at_exit(self):
+        with self.enabled():
+            metrics.DNS_QUERIES.inc('answer', amount=3)
+            metrics.flush_at_exit()
+            self.assertFalse(os.path.exists(metrics.store.path()))
+            metrics.store.clear()
+            self.assertIn('knockpy_dns_queries_total{result="answer"} 3', metrics.exposition())
+
+    def test_changelist_render_time_is_observed(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        with self.enabled():
+            self.assertEqual(self.client.get('/admin/gui/subdomain/').status_code, 200)
+        self.assertEqual(metrics.store.values[('knockpy_admin_render_seconds', ('subdomain_changelist',))][-1], 1)
+
+    def test_token_is_required_when_set(self):
+        with self.enabled(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+
+class EventsTest(TestCase):
+    def kinds(self):
+        return list(ScanEvent.objects.order_by('id').values_list('kind', flat=True))
+
+    def test_scan_lifecycle_is_published(self):
+        domain = create_domain()
+        enqueue_scan(domain)
+        with patch(FakeKnockpy(count=10)):
+            call_command('scan', domain.id)
+        self.assertEqual(self.kinds(), ['queued', 'started', 'progress', 'stage', 'stage', 'progress', 'stage', 'finished'])
+        self.assertEqual([e.data['stage'] for e in ScanEvent.objects.filter(kind='stage').order_by('id')], ['wildcard', 'scan', 'history'])
+        finished = ScanEvent.objects.get(kind='finished')
+        self.assertEqual(finished.data['count'], 10)
+        self.assertEqual(finished.data['added'], 10)
+
+    def test_failed_scan_and_retry_are_published(self):
+        domain = create_domain()
+        enqueue_scan(domain)
+        job = claim_job()
+        with mock.patch('gui.engine.stream', side_effect=RuntimeError('resolver down')):
+            self.assertEqual(run_job(job), ScanJob.QUEUED)
+        failed = ScanEvent.objects.get(kind='failed')
+        self.assertEqual(failed.data['error'], 'RuntimeError: resolver down')
+        self.assertEqual(ScanEvent.objects.filter(kind='queued').last().data, {'retry': 1})
+
+    def test_old_events_are_pruned(self):
+        domain = create_domain()
+        events.publish(domain.id, ScanEvent.QUEUED)
+        ScanEvent.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        events.publish(domain.id, ScanEvent.QUEUED)
+        events.prune()
+        self.assertEqual(ScanEvent.objects.count(), 1)
+
+    @override_settings(EVENTS_POLL_INTERVAL=0.01)
+    async def test_one_poll_serves_every_viewer(self):
+        broadcaster = events.Broadcaster()
+        domain = await sync_to_async(create_domain)()
+        queues = [(await broadcaster.subscribe())[0] for _ in range(20)]
+        await sync_to_async(events.publish)(domain.id, ScanEvent.PROGRESS, count=5)
+        received = [await asyncio.wait_for(queue.get(), 5) for queue in queues]
+        self.assertEqual({event['data']['count'] for event in received}, {5})
+        # The database was read once per poll, not once per viewer
+        self.assertLess(broadcaster.polls, 20)
+        for queue in queues:
+            broadcaster.unsubscribe(queue)
+        await asyncio.wait_for(broadcaster.task, 5)
+
+    def test_slow_viewer_is_dropped(self):
+        broadcaster = events.Broadcaster()
+        queue = asyncio.Queue(2)
+        broadcaster.listeners.add(queue)
+        broadcaster.dispatch([{'id': i, 'domain_id': 1, 'kind': 'progress', 'data': {}} for i in range(1, 4)])
+        self.assertIs(queue.get_nowait(), events.DROPPED)
+        self.assertEqual(broadcaster.listeners, set())
+        self.assertEqual(broadcaster.last_id, 3)
+
+    async def test_stream_resumes_after_the_last_event(self):
+        user = await sync_to_async(User.objects.create_superuser)('admin', 'admin@example.com', 'admin')
+        await self.async_client.aforce_login(user)
+        domain = await sync_to_async(create_domain)()
+        first = await sync_to_async(ScanEvent.objects.create)(domain=domain, kind=ScanEvent.STARTED)
+        await sync_to_async(events.publish)(domain.id, ScanEvent.PROGRESS, count=7)
+
+        response = await self.async_client.get('/events', headers={'Last-Event-ID': str(first.id)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = aiter(response.streaming_content)
+        replayed = (await anext(content)).decode()
+        self.assertIn('event: progress\n', replayed)
+        self.assertIn('"domain": %d, "count": 7' % domain.id, replayed)
+        self.assertIn('event: ready\n', (await anext(content)).decode())
+        await content.aclose()
+
+    def test_wsgi_answers_the_missed_events(self):
+        domain = create_domain()
+        self.assertEqual(self.client.get('/events').status_code, 403)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        first = ScanEvent.objects.create(domain=domain, kind=ScanEvent.STARTED)
+        events.publish(domain.id, ScanEvent.FINISHED, count=3)
+        body = self.client.get('/events', HTTP_LAST_EVENT_ID=str(first.id)).content.decode()
+        self.assertIn('event: finished', body)
+        self.assertNotIn('event: started', body)
+        self.assertTrue(body.endswith(events.ready(first.id + 1)))
+
+    def test_changelist_rows_can_be_found_by_the_script(self):
+        domain = create_domain()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        body = self.client.get('/admin/gui/domain/').content.decode()
+        self.assertIn(f'data-scan-status="{domain.id}"', body)
+        self.assertIn(f'data-scan-result="{domain.id}"', body)
+        self.assertIn('js/scan_events.js', body)
+
+
+class QueryBudgetTest(TestCase):
+    """
+    The changelists run a fixed number of queries whatever the number of rows.
+    """
+    budget = 12
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def populate(self, count):
+        tag = Tag.objects.create(name=f"tag{Tag.objects.count()}")
+        for i in range(count):
+            domain = Domain.objects.create(name=f"d{Domain.objects.count()}.com", tag=tag)
+            Tag.objects.create(name=domain.name)
+            with SubdomainWriter(domain) as writer:
+                writer.extend(generate(domain.name, 3))
+        return domain
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assert_fixed_queries(self, url):
+        self.populate(2)
+        small = self.queries(url() if callable(url) else url)
+        self.populate(20)
+        large = self.queries(url() if callable(url) else url)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.budget)
+
+    def test_domain_changelist(self):
+        self.assert_fixed_queries('/admin/gui/domain/')
+
+    def test_tag_changelist(self):
+        self.assert_fixed_queries('/admin/gui/tag/')
+
+    def test_subdomain_changelist(self):
+        self.assert_fixed_queries('/admin/gui/subdomain/')
+
+    def test_subdomain_changelist_of_a_domain(self):
+        self.assert_fixed_queries(lambda: f"/admin/gui/subdomain/?domain={Domain.objects.last().id}")
+
+    def test_run_and_job_changelists(self):
+        def scan():
+            for domain in Domain.objects.all():
+                enqueue_scan(domain)
+                with patch(FakeKnockpy(count=2)):
+                    call_command('scan', domain.id)
+        self.populate(2)
+        scan()
+        small = [self.queries(url) for url in ('/admin/gui/scanrun/', '/admin/gui/scanjob/', '/admin/gui/scanchange/')]
+        self.populate(20)
+        scan()
+        large = [self.queries(url) for url in ('/admin/gui/scanrun/', '/admin/gui/scanjob/', '/admin/gui/scanchange/')]
+        self.assertEqual(small, large)
+
+
+class WorkerTest(TransactionTestCase):
+    def test_worker_drains_the_queue_within_its_concurrency(self):
+        for i in range(5):
+            enqueue_scan(create_domain(f"domain{i}.com"))
+
+        knockpy = FakeKnockpy(count=3, delay=0.05)
+        with patch(knockpy), self.settings(SCAN_MAX_RUNNING=2):
+            call_command('worker', '--once', '--concurrency', '3', '--poll', '0.01', stdout=mock.MagicMock())
+
+        self.assertEqual(len(knockpy.calls), 5)
+        self.assertLessEqual(knockpy.max_active, 2)
+        self.assertFalse(ScanJob.objects.exclude(state=ScanJob.DONE).exists())
+        self.assertEqual(Subdomain.objects.count(), 15)
+
+
+class ConcurrentScanTest(TransactionTestCase):
+    def test_twenty_scans_write_through_one_writer(self):
+        domains = [create_domain(f"domain{i}.com") for i in range(20)]
+        errors = []
+
+        def scan(domain):
+            try:
+                call_command('scan', domain.id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        groups, count = writes.coordinator.groups, writes.coordinator.writes
+        # Small chunks and constant progress: as many writes as possible
+        with patch(FakeKnockpy(count=300)), self.settings(INGEST_BATCH_SIZE=25, SCAN_PROGRESS_INTERVAL=0):
+            threads = [threading.Thread(target=scan, args=(domain,)) for domain in domains]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Subdomain.objects.count(), 20 * 300)
+        self.assertEqual(Domain.objects.filter(completed=True, messages__count=300).count(), 20)
+        self.assertEqual(ScanEvent.objects.filter(kind=ScanEvent.FINISHED).count(), 20)
+        # Writes of different scans were committed together
+        self.assertLess(writes.coordinator.groups - groups, writes.coordinator.writes - count)
+
+    def test_scans_leave_every_write_to_the_writer(self):
+        domain = create_domain("example.com")
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            if sql.split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+                statements.append(sql)
+            return execute(sql, params, many, context)
+
+        # The writer thread has a connection of its own: only the writes of the scan are seen
+        with patch(FakeKnockpy(count=10)), connection.execute_wrapper(record):
+            call_command('scan', domain.id)
+
+        self.assertEqual(statements, [])
+        self.assertEqual(Subdomain.objects.count(), 10)
+
+    def test_sqlite_readers_do_not_block_writers(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+
+class AgentAPITest(TestCase):
+    def setUp(self):
+        self.agent, self.token = AgentToken.create('agent1')
+        self.domain = create_domain()
+
+    def post(self, path, data=b'', token=None, **headers):
+        return self.client.post(path, data, content_type='application/octet-stream',
+                                HTTP_AUTHORIZATION=f"Bearer {token or self.token}", **headers)
+
+    def upload(self, lease, results, token=None):
+        body = gzip.compress(''.join(json.dumps(result) + '\n' for result in results).encode())
+        return self.post(f"/agent/jobs/{lease['job']}/results?attempt={lease['attempt']}", body, token, HTTP_CONTENT_ENCODING='gzip')
+
+    def test_token_is_required(self):
+        self.assertEqual(self.post('/agent/lease', token='wrong').status_code, 401)
+        AgentToken.objects.update(active=False)
+        self.assertEqual(self.post('/agent/lease').status_code, 401)
+
+    def test_lease_upload_complete(self):
+        self.assertEqual(self.post('/agent/lease').status_code, 204)
+        enqueue_scan(self.domain)
+        lease = self.post('/agent/lease').json()
+        self.assertEqual(lease['domain']['name'], 'example.com')
+        self.assertEqual(ScanJob.objects.get().agent, self.agent)
+
+        results = list(generate('example.com', 30)) + [make_result('www.other.com', ['10.0.0.1'])]
+        with self.assertLogs('gui.agents', 'WARNING'):
+            answer = self.upload(lease, results).json()
+        self.assertEqual(answer, {
+            'written': 30, 'rejected': [{'domain': 'www.other.com', 'error': 'not a name of example.com'}],
+        })
+        # A batch sent again is not counted twice
+        self.upload(lease, results[:10])
+        self.assertEqual(Domain.objects.get().messages['count'], 30)
+
+        report = {'finished': True, 'filtered': 2, 'dns': {'hits': 1, 'shared': 0, 'negative': 0, 'misses': 3}}
+        response = self.post(f"/agent/jobs/{lease['job']}/complete?attempt={lease['attempt']}", json.dumps(report).encode())
+        self.assertEqual(response.json(), {'state': ScanJob.DONE})
+        domain = Domain.objects.get()
+        self.assertTrue(domain.completed)
+        self.assertEqual((domain.messages['agent'], domain.messages['filtered'], domain.messages['added']), ('agent1', 2, 30))
+        self.assertEqual(Subdomain.objects.count(), 30)
+        self.assertEqual(ScanRun.objects.get().state, ScanRun.FINISHED)
+
+    def test_results_with_a_bad_certificate_are_rejected(self):
+        enqueue_scan(self.domain)
+        lease = self.post('/agent/lease').json()
+        certificate = {"fingerprint": "ab" * 32, "common_name": "example.com", "not_after": "2030-01-01",
+                       "sans": ["example.com", "*.example.com"]}
+        bad = [
+            ({**certificate, "fingerprint": "x"}, 'fingerprint'),
+            ({**certificate, "not_after": "tomorrow"}, 'not_after'),
+            ({**certificate, "sans": "example.com"}, 'sans'),
+            ({**certificate, "sans": ["a" * 300]}, 'sans'),
+            ({**certificate, "common_name": 42}, 'common name'),
+            ("example.com", 'not an object'),
+        ]
+        results = [dict(make_result('www.example.com', ['10.0.0.1']), certificate=certificate)]
+        results += [dict(make_result(f"bad{i}.example.com", ['10.0.0.1']), certificate=cert) for i, (cert, _) in enumerate(bad)]
+
+        with self.assertLogs('gui.agents', 'WARNING') as logs:
+            answer = self.upload(lease, results).json()
+        self.assertIn('6 results of example.com rejected', logs.output[0])
+        self.assertEqual(answer['written'], 1)
+        self.assertEqual([rejected['domain'] for rejected in answer['rejected']], [f"bad{i}.example.com" for i in range(len(bad))])
+        for rejected, (_, field) in zip(answer['rejected'], bad):
+            self.assertIn(field, rejected['error'])
+        self.assertEqual(list(Subdomain.objects.values_list('name', flat=True)), ['www.example.com'])
+        self.assertEqual(Certificate.objects.get().fingerprint, "ab" * 32)
+
+    def test_expired_lease_goes_to_another_agent(self):
+        enqueue_scan(self.domain)
+        first = agents.lease(self.agent)
+        ScanJob.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        other, token = AgentToken.create('agent2')
+        second = self.post('/agent/lease', token=token).json()
+
+        self.assertEqual((second['job'], second['attempt']), (first['job'], 2))
+        self.assertEqual(ScanRun.objects.order_by('id').first().state, ScanRun.FAILED)
+        # The first agent came back: its calls are refused
+        self.assertEqual(self.upload(first, generate('example.com', 3)).status_code, 409)
+        self.assertEqual(self.upload(second, generate('example.com', 3), token).status_code, 200)
+
+    def test_agent_reports_a_failed_scan(self):
+        enqueue_scan(self.domain)
+        lease = agents.lease(self.agent)
+        self.assertEqual(agents.complete(self.agent, lease['job'], lease['attempt'], {'error': 'OSError: no route'}), ScanJob.QUEUED)
+        self.assertEqual(ScanRun.objects.get().state, ScanRun.FAILED)
+        self.assertEqual(ScanEvent.objects.filter(kind='failed').get().data['error'], 'OSError: no route')
+
+    def test_upload_must_be_gzip_json_lines(self):
+        enqueue_scan(self.domain)
+        lease = agents.lease(self.agent)
+        path = f"/agent/jobs/{lease['job']}/results?attempt={lease['attempt']}"
+        self.assertEqual(self.post(path, b'not gzip', HTTP_CONTENT_ENCODING='gzip').status_code, 400)
+        with self.settings(AGENT_MAX_UPLOAD=100):
+            self.assertEqual(self.upload(lease, generate('example.com', 10)).status_code, 400)
+
+
+class AgentTest(LiveServerTestCase):
+    def test_agents_on_localhost_drain_the_queue(self):
+        for i in range(6):
+            enqueue_scan(create_domain(f"domain{i}.com"))
+        tokens = [AgentToken.create(f"agent{i}")[1] for i in range(3)]
+        knockpy = FakeKnockpy(count=250, delay=0.05)
+
+        with patch(knockpy), self.settings(SCAN_MAX_RUNNING=4):
+            runners = [Agent(Client(self.live_server_url, token), concurrency=2, batch_size=100, poll=0.01, log=lambda line: None)
+                       for token in tokens]
+            threads = [threading.Thread(target=runner.run, kwargs={'once': True}) for runner in runners]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(knockpy.calls), 6)
+        self.assertLessEqual(knockpy.max_active, 4)
+        self.assertFalse(ScanJob.objects.exclude(state=ScanJob.DONE).exists())
+        self.assertEqual(Subdomain.objects.count(), 6 * 250)
+        self.assertEqual(Domain.objects.filter(completed=True, messages__count=250).count(), 6)
+        self.assertFalse(ScanJob.objects.filter(agent=None).exists())
@@ -1,3 +1,111 @@
-from django.shortcuts import render
+import functools
+import json
 
-# Create your views here.
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
+
+from . import agents, events, metrics
+from .models import ScanJob
+
+
+def metrics_view(request):
+    """
+    The metrics of every process in the Prometheus text format, with the
+    depth of the scan queue. Needs `Authorization: Bearer METRICS_TOKEN`
+    when that setting is set.
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponse(status=401)
+
+    jobs = {(state,): 0 for state in (ScanJob.QUEUED, ScanJob.RUNNING)}
+    rows = ScanJob.objects.filter(state__in=[ScanJob.QUEUED, ScanJob.RUNNING]).values('state').annotate(count=Count('id'))
+    for row in rows:
+        jobs[(row['state'],)] = row['count']
+
+    body = metrics.exposition(extra=[('knockpy_scan_jobs', 'Scan jobs queued and running.', ['state'], jobs)])
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def events_view(request):
+    """
+    The scan events as Server-Sent Events, for the staff. The browser
+    sends the id of the last event it got when it reconnects.
+    """
+    user = await request.auser()
+    if not (user.is_active and user.is_staff):
+        return HttpResponse(status=403)
+
+    after = request.headers.get('Last-Event-ID') or request.GET.get('after')
+    after = int(after) if after and after.isdigit() else None
+
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(events.stream(after), content_type='text/event-stream')
+    else:
+        response = HttpResponse(await sync_to_async(events.snapshot)(after), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def agent_api(view):
+    """
+    A call of the agent API (gui.agents): POST with the token of an active
+    agent, passed to the view. A lease lost answers 409.
+    """
+    @csrf_exempt
+    @require_POST
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        agent = agents.authenticate(request)
+        if agent is None:
+            return JsonResponse({"error": "invalid token"}, status=401)
+        try:
+            return view(request, agent, *args, **kwargs)
+        except agents.LeaseLost as e:
+            return JsonResponse({"error": f"lease lost: {e}"}, status=409)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+    return wrapper
+
+
+def attempt(request):
+    try:
+        return int(request.GET['attempt'])
+    except (KeyError, ValueError):
+        raise ValueError("The attempt of the job is required (?attempt=N)")
+
+
+@agent_api
+def agent_lease(request, agent):
+    lease = agents.lease(agent)
+    if lease is None:
+        return HttpResponse(status=204)
+    return JsonResponse(lease)
+
+
+@agent_api
+def agent_heartbeat(request, agent, job_id):
+    agents.heartbeat(agent, job_id, attempt(request))
+    return JsonResponse({})
+
+
+@agent_api
+def agent_results(request, agent, job_id):
+    results = agents.parse_results(request.body, compressed=request.headers.get('Content-Encoding') == 'gzip')
+    written, rejected = agents.upload(agent, job_id, attempt(request), results)
+    return JsonResponse({"written": written, "rejected": rejected})
+
+
+@agent_api
+def agent_complete(request, agent, job_id):
+    report = json.loads(request.body or b'{}')
+    if not isinstance(report, dict):
+        raise ValueError("The report must be a JSON object")
+    return JsonResponse({"state": agents.complete(agent, job_id, attempt(request), report)})
@@ -0,0 +1,184 @@
+"""
+Wildcard DNS detection.
+
+Several random labels, at different depths, are resolved for the domain.
+When they resolve, the answers are a wildcard: the fingerprint keeps the
+union of their addresses (wildcards often rotate IPs) and their HTTP
+signature (status and server). Bruteforce results matching the
+fingerprint are wildcard hits and are filtered out; names found by recon
+are kept.
+
+Fingerprints are kept per domain name for WILDCARD_CACHE_TTL seconds in
+WildcardFingerprint, so the workers and the scheduled scans of a domain
+detect it once; remote agents keep them in memory (MemoryStore). When the
+wildcard filter of a domain is off nothing is matched against the
+fingerprint: only the DNS answers are probed, to report the wildcard, and
+that partial fingerprint is not stored.
+"""
+from datetime import timedelta
+import random
+import string
+import threading
+import time
+
+import dns.exception
+import dns.resolver
+from django.conf import settings
+from django.utils import timezone
+from knock.knockpy import HttpStatus
+
+from .models import WildcardFingerprint
+from . import writes
+
+
+def random_label():
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(10, 15)))
+
+
+def probe_names(domain, count):
+    """
+    Random names under the domain, alternating one and two labels deep.
+    """
+    names = []
+    for i in range(count):
+        labels = [random_label() for _ in range(1 + i % 2)]
+        names.append('.'.join(labels + [domain]))
+    return names
+
+
+def lookup(name, domain):
+    """
+    Addresses of a name with the name server of the domain, or None.
+    """
+    resolver = dns.resolver.Resolver()
+    resolver.nameservers = [domain.dns or '8.8.8.8']
+    resolver.port = settings.ASYNC_DNS_PORT
+    resolver.timeout = resolver.lifetime = domain.timeout or 3
+    try:
+        return [str(ip) for ip in resolver.resolve(name, 'A')]
+    except dns.exception.DNSException:
+        return None
+
+
+def http_signature(name, domain):
+    """
+    (status, server) answered over HTTP by a name, or None.
+    """
+    status, redirect, server = HttpStatus(name, domain.dns, domain.useragent, domain.timeout).http_response(f"http://{name}")
+    if status is None:
+        return None
+    return (status, server)
+
+
+class Fingerprint:
+    """
+    The addresses and HTTP signatures answered by the wildcard of a domain.
+    """
+    def __init__(self, ips, signatures):
+        self.ips = set(ips)
+        self.signatures = {tuple(signature) for signature in signatures}
+
+    def __bool__(self):
+        return bool(self.ips)
+
+    def matches(self, result):
+        """
+        True when a scan result looks like an answer of the wildcard.
+        """
+        if not self.ips.intersection(result['ip'] or ()):
+            return False
+        if not self.signatures:
+            return True
+        return (result['http'][0], result['http'][2]) in self.signatures
+
+    def filters(self, result):
+        """
+        True when a result is a wildcard hit of the bruteforce. Names found
+        by recon are kept even when they point to the wildcard addresses.
+        """
+        return result.get('source') != 'recon' and self.matches(result)
+
+    def to_dict(self):
+        return {"ips": sorted(self.ips), "http": sorted(self.signatures, key=str)}
+
+
+def detect(domain, resolve=lookup, signature=http_signature):
+    """
+    Resolve WILDCARD_PROBES random names and build the fingerprint; without
+    `signature` their HTTP answers are not probed.
+
+    Returns an empty fingerprint when none of them resolves.
+    """
+    ips = set()
+    signatures = set()
+    for name in probe_names(domain.name, settings.WILDCARD_PROBES):
+        answer = resolve(name, domain)
+        if not answer:
+            continue
+        ips.update(answer)
+        http = signature(name, domain) if signature else None
+        if http:
+            signatures.add(http)
+    return Fingerprint(ips, signatures)
+
+
+class DatabaseStore:
+    """
+    Fingerprints in the database, shared by the worker processes.
+    """
+    def load(self, name):
+        row = WildcardFingerprint.objects.filter(domain=name, expires_at__gt=timezone.now()).first()
+        return Fingerprint(row.ips, row.signatures) if row else None
+
+    def save(self, name, found):
+        data = found.to_dict()
+        row = WildcardFingerprint(
+            domain=name,
+            ips=data['ips'],
+            signatures=data['http'],
+            expires_at=timezone.now() + timedelta(seconds=settings.WILDCARD_CACHE_TTL),
+        )
+        writes.write(
+            WildcardFingerprint.objects.bulk_create,
+            [row],
+            update_conflicts=True,
+            unique_fields=['domain'],
+            update_fields=['ips', 'signatures', 'expires_at'],
+        )
+
+
+class MemoryStore:
+    """
+    Fingerprints of this process only (remote agents).
+    """
+    def __init__(self):
+        self.fingerprints = {}  # name -> (fingerprint, expires)
+        self.lock = threading.Lock()
+
+    def load(self, name):
+        with self.lock:
+            found, expires = self.fingerprints.get(name, (None, 0))
+        return found if expires > time.time() else None
+
+    def save(self, name, found):
+        with self.lock:
+            self.fingerprints[name] = (found, time.time() + settings.WILDCARD_CACHE_TTL)
+
+
+def fingerprint(domain, store=None):
+    """
+    The stored fingerprint of the domain, detected again when it expired.
+
+    Without the wildcard filter the HTTP answers are not probed and the
+    fingerprint is not stored.
+    """
+    store = store or DatabaseStore()
+    found = store.load(domain.name)
+    if found is not None:
+        return found
+    if not domain.wildcard:
+        return detect(domain, signature=None)
+
+    found = detect(domain)
+    store.save(domain.name, found)
+    return found
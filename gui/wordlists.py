@@ -0,0 +1,164 @@
+"""
+Compiled wordlists.
+
+A wordlist is compiled once into a binary file: a header with the number of
+entries, then the normalized, deduplicated and sorted words, one per line.
+Scans memory-map the compiled file and read it lazily, so the pages are
+shared by every scan and every worker process using the same wordlist and
+nothing is parsed or copied at startup.
+"""
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
+
+MAGIC = b'KNOCKWL1'
+HEADER = struct.Struct('<8sQ')
+BLOCK_SIZE = 256 * 1024
+
+LABEL = re.compile(r'^[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?$')
+
+
+class WordlistError(Exception):
+    pass
+
+
+def normalize(line):
+    """
+    The word of a line of a wordlist, or None when it is not a valid
+    (possibly dotted) subdomain label.
+    """
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='ignore')
+    word = line.strip().strip('.').lower()
+    if not word or len(word) > 200:
+        return None
+    if not all(LABEL.match(label) for label in word.split('.')):
+        return None
+    return word
+
+
+def compile_file(source, destination):
+    """
+    Compile the text file `source` into `destination`.
+
+    Returns (entries, checksum): the number of words and the sha256 of the
+    compiled file.
+    """
+    try:
+        with open(source, 'rb') as f:
+            words = {word for word in map(normalize, f) if word}
+    except OSError as e:
+        raise WordlistError(f"Cannot read {source}: {e}")
+
+    header = HEADER.pack(MAGIC, len(words))
+    checksum = hashlib.sha256(header)
+    words = sorted(words)
+
+    # Written aside then renamed: scans mapping the previous file keep it
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    temporary = f"{destination}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(header)
+        for i in range(0, len(words), 10000):
+            data = ''.join(f"{word}\n" for word in words[i:i + 10000]).encode()
+            f.write(data)
+            checksum.update(data)
+    os.replace(temporary, destination)
+    return len(words), checksum.hexdigest()
+
+
+def compile_wordlist(wordlist):
+    """
+    Compile the source of a Wordlist and record its file, entries and checksum.
+
+    Each content gets its own file (named after the checksum), the previous
+    one is removed once the row points to the new one.
+    """
+    temporary = os.path.join(settings.WORDLIST_DIR, f"{slugify(wordlist.name)}.compiling")
+    entries, checksum = compile_file(wordlist.source, temporary)
+    path = os.path.join(settings.WORDLIST_DIR, f"{slugify(wordlist.name)}-{checksum[:16]}.kwl")
+    os.replace(temporary, path)
+
+    previous = wordlist.path
+    wordlist.path = path
+    wordlist.entries = entries
+    wordlist.checksum = checksum
+    wordlist.compiled_at = timezone.now()
+    wordlist.save()
+
+    if previous and previous != path:
+        forget(previous)
+        if os.path.exists(previous):
+            os.remove(previous)
+    return wordlist
+
+
+_maps = {}  # path -> (identity of the file, mapping)
+_lock = threading.Lock()
+
+
+def identity(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def forget(path):
+    """
+    Drop the mapping of a file from the cache. The scans still reading it
+    keep it; it is unmapped when the last of them is done.
+    """
+    with _lock:
+        _maps.pop(path, None)
+
+
+def open_compiled(path):
+    """
+    The shared read-only mapping of a compiled wordlist.
+
+    One mapping per file and per process, used by all the scans of a worker.
+    The mappings of files removed or replaced since (recompiled by another
+    process) are dropped.
+    """
+    with _lock:
+        for cached, (known, mapping) in list(_maps.items()):
+            try:
+                current = identity(os.stat(cached))
+            except OSError:
+                current = None
+            if current != known:
+                del _maps[cached]
+
+        if path in _maps:
+            return _maps[path][1]
+        try:
+            with open(path, 'rb') as f:
+                known = identity(os.fstat(f.fileno()))
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise WordlistError(f"Cannot open the compiled wordlist {path}: {e}")
+        if len(mapping) < HEADER.size or mapping[:len(MAGIC)] != MAGIC:
+            mapping.close()
+            raise WordlistError(f"{path} is not a compiled wordlist")
+        _maps[path] = (known, mapping)
+        return mapping
+
+
+def words(path):
+    """
+    Yield the words of a compiled wordlist, read lazily from the mapping.
+    """
+    mapping = open_compiled(path)
+    position = HEADER.size
+    end = len(mapping)
+    # Whole lines are decoded BLOCK_SIZE bytes at a time
+    while position < end:
+        stop = mapping.rfind(b'\n', position, min(position + BLOCK_SIZE, end)) + 1 or mapping.find(b'\n', position) + 1
+        yield from mapping[position:stop].decode().splitlines()
+        position = stop
+
@@ -0,0 +1,140 @@
+"""
+Single writer for the scans of a process.
+
+The scans running in the threads of a worker do not write to the database
+themselves: they hand their writes (chunks of results, progress, events)
+to one writer thread through a bounded queue. The writer takes every write
+waiting, up to WRITE_GROUP_SIZE, and commits them in one transaction, each
+in a savepoint of its own so that a failing write does not undo the others.
+Many scans then cost one commit, and no two threads of the process compete
+for the SQLite write lock; other processes wait for it (busy timeout).
+
+    writes.write(Domain.objects.filter(id=1).update, completed=True)
+    future = writes.submit(writer.write_chunk, pending)
+
+Every write of a scan goes through here: its run and changes, results,
+facets, progress, events and cached answers. The writes made outside the
+scans go to the database directly: the job queue (claim_job reads and
+updates a job in one transaction of its own, the lease updates are made
+by the worker loop between scans), the scheduler, and the admin pages
+and commands that edit rows (imports, wordlists, agent tokens, backfill).
+
+Nothing here is specific to SQLite: on a server database the writes are
+grouped the same way. A write made inside a transaction of the caller
+(or by the writer itself, or with WRITE_COORDINATOR off) runs right away
+in the caller's thread, so that it belongs to that transaction.
+"""
+from concurrent.futures import Future
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+STOP = object()
+
+
+class WriteCoordinator:
+    def __init__(self, group_size=None, queue_size=None):
+        self.group_size = group_size
+        self.queue_size = queue_size
+        self.queue = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.groups = 0
+        self.writes = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.queue = queue.Queue(self.queue_size or settings.WRITE_QUEUE_SIZE)
+                self.thread = threading.Thread(target=self.loop, name='writer', daemon=True)
+                self.thread.start()
+
+    def inline(self):
+        return (
+            not settings.WRITE_COORDINATOR
+            or threading.current_thread() is self.thread
+            or connection.in_atomic_block
+        )
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue a write; the Future gets its result once it is committed.
+        """
+        future = Future()
+        if self.inline():
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self.start()
+        self.queue.put((future, function, args, kwargs))
+        return future
+
+    def write(self, function, *args, **kwargs):
+        """
+        Run a write and wait until it is committed; its exception is raised here.
+        """
+        return self.submit(function, *args, **kwargs).result()
+
+    def stop(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(STOP)
+            self.thread.join()
+
+    def loop(self):
+        try:
+            running = True
+            while running:
+                group = [self.queue.get()]
+                while len(group) < (self.group_size or settings.WRITE_GROUP_SIZE):
+                    try:
+                        group.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if STOP in group:
+                    group.remove(STOP)
+                    running = False
+                if group:
+                    self.commit(group)
+        finally:
+            connection.close()
+
+    def commit(self, group):
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for future, function, args, kwargs in group:
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((future, function(*args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed: none of the writes was stored
+            logger.exception("Group of %s writes failed", len(group))
+            outcomes = [(future, None, e) for future, *_ in group]
+
+        self.groups += 1
+        self.writes += len(group)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+coordinator = WriteCoordinator()
+submit = coordinator.submit
+write = coordinator.write
+
+
+@atexit.register
+def stop_at_exit():
+    coordinator.stop()
@@ -82,6 +82,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Scans write from worker threads: take the write lock when the
+            # transaction starts instead of failing when a reader upgrades
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            # Enough with the write-ahead log that migrate turns on (gui.apps)
+            'init_command': 'PRAGMA synchronous=NORMAL',
+        },
+        # Tests use a file database because the workers run scans in threads
+        # with their own connections
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -128,3 +139,160 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Scan queue (python manage.py worker)
+
+# Scans run at the same time by one worker process
+SCAN_WORKER_CONCURRENCY = 2
+# Scans running at the same time across all worker processes
+SCAN_MAX_RUNNING = 4
+# Seconds a worker waits before polling an empty queue
+SCAN_WORKER_POLL = 2
+# Seconds before the job of an unresponsive worker goes back to the queue
+SCAN_JOB_LEASE = 300
+# Runs of a failing scan before the job is marked as failed
+SCAN_JOB_ATTEMPTS = 3
+
+# Remote agents (python -m gui.agent): results per upload, seconds after
+# which a smaller batch is uploaded anyway, seconds an agent waits when
+# the queue is empty, largest upload accepted (bytes, decompressed)
+AGENT_BATCH_SIZE = 500
+AGENT_FLUSH_INTERVAL = 5
+AGENT_POLL = 5
+AGENT_MAX_UPLOAD = 64 * 1024 * 1024
+
+# Recurring scans (python manage.py scheduler): most seconds between two
+# looks at the due domains, part of the interval a next scan time is moved
+# by at random, domains handled per query
+SCHEDULE_POLL = 30
+SCHEDULE_JITTER = 0.1
+SCHEDULE_BATCH = 500
+
+
+# Scan results are written in chunks of this many subdomains
+INGEST_BATCH_SIZE = 1000
+# Seconds between two updates of the progress of a running scan
+SCAN_PROGRESS_INTERVAL = 2
+
+# Writes of the scans (results, progress, events) go through one writer
+# thread per process, which commits up to WRITE_GROUP_SIZE of them per
+# transaction; the scans wait when WRITE_QUEUE_SIZE writes are pending.
+# Off: each scan writes from its own thread.
+WRITE_COORDINATOR = True
+WRITE_GROUP_SIZE = 64
+WRITE_QUEUE_SIZE = 256
+
+# asyncio engine: DNS lookups in flight when the domain does not set it,
+# name server port, seconds before a query is sent again, retries
+ASYNC_DNS_CONCURRENCY = 500
+ASYNC_DNS_PORT = 53
+ASYNC_DNS_TIMEOUT = 2
+ASYNC_DNS_RETRIES = 2
+# Results waiting to be written before the lookups slow down
+ASYNC_RESULT_QUEUE = 1000
+
+# Scan pipeline (gui.pipeline): workers of each stage, when not the threads
+# of the domain (or its concurrency and HTTP_CONCURRENCY with the asyncio
+# engine), and seconds an item may spend in it (None: no limit); items
+# waiting between two stages, per worker of the next one
+SCAN_STAGES = {
+    'resolve': {'workers': None, 'timeout': 30},
+    'http': {'workers': None, 'timeout': 120},
+    'certificate': {'workers': 20, 'timeout': 30},
+}
+SCAN_QUEUE_PER_WORKER = 2
+
+# Benchmark suite (gui.benchmarks): a measurement regresses when it is
+# slower than its baseline by this fraction and by this many seconds
+BENCHMARK_THRESHOLD = 0.25
+BENCHMARK_MIN_DELTA = 0.005
+
+# Metrics (gui.metrics, /metrics): off by default. Each process writes its
+# values under METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds;
+# the gauges of a process silent for METRICS_GAUGE_TTL seconds are dropped.
+# The file of a process is removed when it exits (or, if it was killed, by
+# the next /metrics), its counters kept in METRICS_DIR/exited.json.
+# With METRICS_TOKEN, /metrics requires "Authorization: Bearer <token>".
+METRICS_ENABLED = False
+METRICS_DIR = BASE_DIR / 'metrics'
+METRICS_FLUSH_INTERVAL = 5
+METRICS_GAUGE_TTL = 60
+METRICS_TOKEN = None
+
+# Rows read or written at once when comparing two scan runs
+HISTORY_CHUNK_SIZE = 5000
+
+# Random names resolved to fingerprint a wildcard DNS record, and seconds
+# the fingerprint of a domain is kept in the database (WildcardFingerprint)
+WILDCARD_PROBES = 4
+WILDCARD_CACHE_TTL = 3600
+
+# Subdomain graph: nodes sent to the browser at most, seconds a graph is cached
+GRAPH_MAX_NODES = 50000
+GRAPH_CACHE_TTL = 600
+
+# Rows read from the database and written at once by the export
+EXPORT_CHUNK_SIZE = 5000
+
+# Domains created, and scans queued, per query by the bulk import
+IMPORT_BATCH_SIZE = 500
+
+# Compiled wordlists, memory-mapped by the scans
+WORDLIST_DIR = BASE_DIR / 'wordlists'
+
+# DNS cache: answers kept in memory per process, seconds a negative answer
+# without SOA is kept, longest TTL honoured
+DNS_CACHE_SIZE = 100000
+DNS_CACHE_NEGATIVE_TTL = 300
+DNS_CACHE_MAX_TTL = 86400
+
+# Risk score of a subdomain: weight of each risk flag it has (gui.risk);
+# after a change run python manage.py backfill risk
+RISK_WEIGHTS = {
+    'http_only': 1,
+    'cert_expired': 2,
+    'cert_mismatch': 2,
+}
+
+# Passive recon (gui.recon): seconds the names answered by a source are
+# cached, requests allowed per API key as (requests, seconds) shared by all
+# the workers, longest wait for a token before the source is skipped
+RECON_CACHE_TTL = 86400
+RECON_RATE_LIMITS = {
+    'virustotal': (4, 60),
+    'shodan': (1, 1),
+}
+RECON_RATE_WAIT = 60
+
+# HTTP probes of the asyncio engine: requests in flight and requests per
+# second and burst per IP address, shared by all the scans of a process;
+# per scan, keep-alive connections open per host (HTTPS: per TLS name,
+# shared by the names its certificate covers), idle connections kept and
+# seconds they stay idle; largest body drained to reuse a connection, ports
+# probed
+HTTP_CONCURRENCY = 200
+HTTP_RATE_PER_IP = 20
+HTTP_BURST_PER_IP = 20
+HTTP_CONNECTIONS_PER_HOST = 8
+HTTP_IDLE_CONNECTIONS = 100
+HTTP_IDLE_TIMEOUT = 10
+HTTP_MAX_BODY = 1024 * 1024
+PROBE_HTTP_PORT = 80
+PROBE_HTTPS_PORT = 443
+
+# Seconds a certificate fetched for an (IP, SNI name) is reused by a worker,
+# most (IP, name) pairs and IPs it keeps
+CERT_CACHE_TTL = 3600
+CERT_CACHE_SIZE = 10000
+
+# Scan events pushed to the admin (/events): seconds between two reads of
+# the new events by the poller of a web process, seconds between keep-alive
+# comments on an idle stream, events a viewer may fall behind before its
+# stream is closed (the browser resumes it), seconds before the browser
+# reconnects, seconds the events are kept
+EVENTS_POLL_INTERVAL = 1
+EVENTS_KEEPALIVE = 15
+EVENTS_QUEUE_SIZE = 1000
+EVENTS_RETRY = 3
+EVENTS_RETENTION = 3600
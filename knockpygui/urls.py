@@ -2,7 +2,9 @@ from django.contrib import admin
 from django.http import HttpResponseRedirect
 from django.urls import path, include
 from django.conf.urls.static import static
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.conf import settings
+from gui.views import events_view, metrics_view, agent_lease, agent_heartbeat, agent_results, agent_complete
 
 urlpatterns = [
     path('', lambda request: HttpResponseRedirect('/admin/gui/domain/')),
@@ -10,4 +12,10 @@ urlpatterns = [
     path('admin/', lambda request: HttpResponseRedirect('/admin/gui/domain/')),
     path('admin/gui/', lambda request: HttpResponseRedirect('/admin/gui/domain/')),
     path('admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('metrics', metrics_view),
+    path('events', events_view),
+    path('agent/lease', agent_lease),
+    path('agent/jobs/<int:job_id>/heartbeat', agent_heartbeat),
+    path('agent/jobs/<int:job_id>/results', agent_results),
+    path('agent/jobs/<int:job_id>/complete', agent_complete),
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + staticfiles_urlpatterns()
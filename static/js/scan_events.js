@@ -0,0 +1,127 @@
+// Live scan status on the domain changelist.
+//
+// Listens to the scan events (/events) and rewrites the status and result
+// cells of the domains they are about; the other rows are left alone.
+(function () {
+    'use strict';
+
+    if (!window.EventSource) {
+        return;
+    }
+
+    var script = document.currentScript;
+    var url = (script && script.dataset.eventsUrl) || '/events';
+    var stages = {};  // domain id -> current stage
+
+    function escape(value) {
+        var span = document.createElement('span');
+        span.textContent = value === undefined || value === null ? '' : String(value);
+        return span.innerHTML;
+    }
+
+    function cell(kind, domain) {
+        return document.querySelector('[data-scan-' + kind + '="' + Number(domain) + '"]');
+    }
+
+    function flag(value, good) {
+        var ok = good === undefined ? Boolean(value) : value === good;
+        return ok
+            ? '<span style="color: green;">' + escape(value) + '</span>'
+            : '<span style="color: red; font-style: italic;">' + escape(value) + '</span>';
+    }
+
+    function note(text) {
+        return '<span style="color: orangered; font-style: italic;">' + escape(text) + '</span><br>';
+    }
+
+    function running(data) {
+        var html = note('The scan is currently in progress.');
+        if (stages[data.domain]) {
+            html += '<b>stage</b>: ' + escape(stages[data.domain]) + '<br>';
+        }
+        if (data.count !== undefined) {
+            html += '<b>found</b>: ' + escape(data.count) + '<br>'
+                + '<b>rate</b>: ' + escape(data.rate) + ' /s<br>'
+                + '<b>time</b>: ' + escape(data.time) + ' s<br>';
+        }
+        return html;
+    }
+
+    function finished(data) {
+        var html = '<b>wildcard</b>: ' + flag(data.wildcard, false)
+            + (data.filtered ? ' (' + escape(data.filtered) + ' filtered)' : '') + '<br>'
+            + '<b>finished</b>: ' + flag(data.finished) + '<br>'
+            + '<b>completed</b>: ' + flag(true) + '<br>'
+            + '<b>time</b>: ' + escape(data.time) + ' s<br>';
+        if (data.slowest) {
+            html += '<b>slowest stage</b>: <a href="/admin/gui/scanrun/' + Number(data.run) + '/change/">'
+                + escape(data.slowest[0]) + '</a> (' + escape(data.slowest[1]) + ' s)<br>';
+        }
+        if (data.dns) {
+            html += '<b>dns cache</b>: ' + escape(data.dns.hits) + ' hits / ' + escape(data.dns.misses) + ' misses<br>';
+        }
+        if (data.run) {
+            html += '<b>changes</b>: <a href="/admin/gui/scanrun/?domain__id__exact=' + Number(data.domain) + '">'
+                + '+' + escape(data.added) + ' -' + escape(data.removed) + ' ~' + escape(data.changed) + '</a><br>';
+        }
+        return html;
+    }
+
+    function setStatus(data, html) {
+        var status = cell('status', data.domain);
+        if (status) {
+            status.innerHTML = html;
+        }
+    }
+
+    function setCount(data) {
+        var result = cell('result', data.domain);
+        if (result && data.count !== undefined) {
+            result.innerHTML = '<a href="/admin/gui/subdomain/?domain=' + Number(data.domain)
+                + '" style="color: blue; font-style: bold; font-size: 18px">' + escape(data.count) + '</a>';
+        }
+    }
+
+    var handlers = {
+        queued: function (data) {
+            delete stages[data.domain];
+            setStatus(data, note(data.retry ? 'Queued again (attempt ' + data.retry + ' failed).' : 'Queued.'));
+        },
+        started: function (data) {
+            delete stages[data.domain];
+            setStatus(data, running(data));
+        },
+        stage: function (data) {
+            stages[data.domain] = data.stage;
+            setStatus(data, running(data));
+        },
+        progress: function (data) {
+            setStatus(data, running(data));
+            setCount(data);
+        },
+        finished: function (data) {
+            delete stages[data.domain];
+            setStatus(data, finished(data));
+            setCount(data);
+        },
+        failed: function (data) {
+            delete stages[data.domain];
+            setStatus(data, '<span style="color: red; font-style: italic;">The scan failed.</span><br>' + escape(data.error));
+        }
+    };
+
+    function listen() {
+        var source = new EventSource(url);
+        Object.keys(handlers).forEach(function (kind) {
+            source.addEventListener(kind, function (event) {
+                handlers[kind](JSON.parse(event.data));
+            });
+        });
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', listen);
+    } else {
+        listen();
+    }
+})();